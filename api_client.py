@@ -1,44 +1,206 @@
 import asyncio
+import logging
+import time
 import fal_client
-from config import FAL_KEY, CONTENT_CREATOR_WORKFLOW, VISION_SPECIALIST_WORKFLOW
+import buffers
+import recording
+from config import (
+    FAL_KEY,
+    CONTENT_CREATOR_WORKFLOW,
+    VISION_SPECIALIST_WORKFLOW,
+    PRODUCT_SHOT_TYPES,
+    WORKFLOW_LATENCY_TARGETS,
+    FAL_RUN_TIMEOUT_SECONDS,
+    FAL_CONCURRENCY_MIN,
+    FAL_CONCURRENCY_MAX,
+    BREAKER_FAILURE_RATE,
+    BREAKER_WINDOW,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_SECONDS
+)
+from metrics import FAL_STREAM_SECONDS, FAL_REQUESTS_TOTAL, JOBS_IN_FLIGHT
+from resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from tracing import span
+from warmer import WorkflowWarmer
+
+logger = logging.getLogger(__name__)
+
+# Shot type ids keyed by their prompt, used as a low-cardinality metrics label
+_SHOT_IDS_BY_PROMPT = {shot_info["prompt"]: shot_id for shot_id, shot_info in PRODUCT_SHOT_TYPES.items()}
 
 class FalAPIClient:
-    def __init__(self):
-        if FAL_KEY:
-            # Set the API key for fal_client
-            fal_client.key = FAL_KEY
-        else:
-            print("❌ FAL_KEY not found in environment variables!")
-            print("Please set your Fal AI API key in the .env file")
+    def __init__(self, backend=None, warmer=None, run_timeout=FAL_RUN_TIMEOUT_SECONDS):
+        """
+        Args:
+            backend: Object exposing the fal_client async API (stream_async,
+                upload_file_async). Defaults to fal_client itself; pass a
+                FalStandIn to run against a local stand-in.
+            warmer (WorkflowWarmer): Keeps workflows warm and records cold/warm
+                latency; defaults to one configured by the FAL_WARM_* settings
+            run_timeout (float): Seconds after which a workflow run fails
+        """
+        self.backend = backend or fal_client
+        self.warmer = warmer or WorkflowWarmer(self.backend, run_timeout=run_timeout)
+        self.run_timeout = run_timeout
+        # Per workflow, created on first use (see resilience.py)
+        self.breakers = {}
+        self.limiters = {}
+        # Keep-alive runs wait while a workflow's circuit is open
+        self.warmer.breakers = self.breakers
+        
+        # Stand-ins don't need credentials
+        if backend is None:
+            if FAL_KEY:
+                # Set the API key for fal_client
+                fal_client.key = FAL_KEY
+            else:
+                logger.error("FAL_KEY not found in environment variables! Please set your Fal AI API key in the .env file")
+    
+    async def close(self):
+        """Stop keep-alive runs and close the pooled HTTP connections of fal_client (stand-ins have none)"""
+        await self.warmer.close()
+        async_client = getattr(self.backend, "async_client", None)
+        # fal_client creates its httpx client on first use and caches it on the instance
+        if async_client is None or "_client" not in vars(async_client):
+            return
+        client = await async_client._client
+        del async_client._client
+        await client.aclose()
+        logger.info("Closed fal HTTP connections")
+    
+    def guards(self, workflow):
+        """
+        Circuit breaker and concurrency limiter of a workflow
+        
+        Returns:
+            tuple: (CircuitBreaker, AdaptiveLimiter)
+        """
+        if workflow not in self.breakers:
+            self.breakers[workflow] = CircuitBreaker(
+                workflow,
+                failure_rate=BREAKER_FAILURE_RATE,
+                window=BREAKER_WINDOW,
+                min_calls=BREAKER_MIN_CALLS,
+                open_seconds=BREAKER_OPEN_SECONDS
+            )
+            self.limiters[workflow] = AdaptiveLimiter(
+                workflow,
+                latency_target=WORKFLOW_LATENCY_TARGETS.get(workflow, self.run_timeout),
+                minimum=FAL_CONCURRENCY_MIN,
+                maximum=FAL_CONCURRENCY_MAX
+            )
+        return self.breakers[workflow], self.limiters[workflow]
     
-    async def generate_product_image(self, image_url: str, shot_type: str, model: str = "sd15"):
+    def check_available(self, *workflows):
+        """
+        Fail fast before starting work that needs the given workflows
+        
+        Raises:
+            CircuitOpenError: One of the workflows has an open circuit
+        """
+        for workflow in workflows:
+            breaker, _ = self.guards(workflow)
+            if breaker.retry_after() > 0:
+                raise CircuitOpenError(workflow, breaker.retry_after())
+    
+    def prewarm(self):
+        """Start warming cold workflows ahead of a likely run (no-op unless FAL_WARMER is on)"""
+        self.warmer.prewarm()
+    
+    async def _run_workflow(self, workflow: str, arguments: dict, shot_type: str):
+        """
+        Stream a workflow run and return its output, or None on an error event
+        
+        Runs go through the workflow's circuit breaker and concurrency limit.
+        
+        Raises:
+            CircuitOpenError: The workflow's circuit is open; nothing was run
+            asyncio.TimeoutError: The run took longer than run_timeout
+        """
+        breaker, limiter = self.guards(workflow)
+        try:
+            # Don't queue for a slot while the circuit is open, and check
+            # again once one is free: it may have opened in the meantime
+            self.check_available(workflow)
+            slot = await limiter.acquire()
+            try:
+                probe = breaker.check()
+            except CircuitOpenError:
+                limiter.release(slot)
+                raise
+        except CircuitOpenError:
+            FAL_REQUESTS_TOTAL.labels(workflow=workflow, outcome="circuit_open").inc()
+            raise
+        
+        start = time.perf_counter()
+        state = self.warmer.run_started(workflow)
+        outcome = "empty"
+        in_flight = JOBS_IN_FLIGHT.labels(kind=workflow)
+        in_flight.inc()
+        with span("fal.workflow", workflow=workflow, shot_type=shot_type) as workflow_span:
+            async def consume():
+                nonlocal outcome
+                async for event in self.backend.stream_async(workflow, arguments=arguments):
+                    workflow_span.add_event(str(event.get("type")))
+                    if event.get("type") == "output":
+                        outcome = "ok"
+                        return event.get("output", {})
+                    elif event.get("type") == "error":
+                        outcome = "error"
+                        return None
+                return None
+            
+            try:
+                return await asyncio.wait_for(consume(), self.run_timeout)
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                raise
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            except Exception:
+                outcome = "exception"
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                in_flight.dec()
+                if outcome == "cancelled":
+                    breaker.cancel(probe)
+                    limiter.release(slot)
+                else:
+                    breaker.record(failed=outcome != "ok", probe=probe)
+                    limiter.release(slot, failed=outcome != "ok", latency=seconds)
+                    if breaker.retry_after() > 0:
+                        limiter.fail_waiting(CircuitOpenError(workflow, breaker.retry_after()))
+                self.warmer.run_finished(workflow, state, seconds)
+                recording.record_fal(workflow, seconds, outcome, draft=arguments.get("reasoning") is False)
+                FAL_STREAM_SECONDS.labels(workflow=workflow, shot_type=shot_type).observe(seconds)
+                FAL_REQUESTS_TOTAL.labels(workflow=workflow, outcome=outcome).inc()
+                workflow_span.set_attribute("outcome", outcome)
+                workflow_span.set_attribute("state", state)
+    
+    async def generate_product_image(self, image_url: str, shot_type: str, model: str = "sd15", reasoning: bool = True):
         """
         Generate product image using the content creator workflow
+        
+        reasoning=False skips the prompt reasoning step for a faster, cheaper draft.
         """
         try:
-            stream = fal_client.stream_async(
+            return await self._run_workflow(
                 CONTENT_CREATOR_WORKFLOW,
                 arguments={
                     "image_url": image_url,
                     "prompt": shot_type,
-                    "reasoning": True,
+                    "reasoning": reasoning,
                     "model": model
                 },
+                shot_type=_SHOT_IDS_BY_PROMPT.get(shot_type, "custom")
             )
-            
-            result = None
-            async for event in stream:
-                if event.get("type") == "output":
-                    result = event.get("output", {})
-                    break
-                elif event.get("type") == "error":
-                    return None
-            
-            return result
+        except CircuitOpenError:
+            # Callers tell the user right away instead of a generic error
+            raise
         except Exception as e:
-            print(f"Error generating product image: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Error generating product image: {e}", exc_info=True, extra={"event": "fal.exception"})
             return None
     
     async def generate_text_content(self, image_url: str, prompt: str):
@@ -46,25 +208,74 @@ class FalAPIClient:
         Generate text content using the vision specialist workflow
         """
         try:
-            stream = fal_client.stream_async(
+            return await self._run_workflow(
                 VISION_SPECIALIST_WORKFLOW,
                 arguments={
                     "image_url": image_url,
                     "prompt": prompt
                 },
+                shot_type="none"
             )
-            
-            result = None
-            async for event in stream:
-                if event.get("type") == "output":
-                    result = event.get("output", {})
-                    break
-                elif event.get("type") == "error":
-                    return None
-            
-            return result
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating text content: {e}", exc_info=True, extra={"event": "fal.exception"})
+            return None
+    
+    async def upload_file(self, path: str):
+        """
+        Upload a local image so the workflows can fetch it
+        """
+        try:
+            return await self.backend.upload_file_async(path)
         except Exception as e:
-            print(f"Error generating text content: {e}")
-            import traceback
-            traceback.print_exc()
-            return None 
\ No newline at end of file
+            logger.error(f"Error uploading file: {e}")
+            return None
+    
+    async def ingest_image(self, image_url: str):
+        """
+        Copy an image into fal storage once so several workflow runs can share it
+        
+        Falls back to the original URL if the copy fails.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            with await loop.run_in_executor(None, buffers.fetch, image_url) as buffer:
+                # fal_client uploads bytes; in memory this doesn't copy the buffer
+                return await self.backend.upload_async(buffer.getvalue(), buffer.content_type or "image/jpeg", "product.jpg")
+        except Exception as e:
+            logger.warning(f"Error ingesting image, using original URL: {e}")
+            return image_url
+    
+    async def generate_text_pack(self, image_url: str, prompts: dict):
+        """
+        Generate several text contents for one image concurrently
+        
+        Args:
+            image_url: URL of the product image
+            prompts: Mapping of content type to prompt
+        
+        Yields:
+            (content_type, result) pairs in completion order; result is None on failure
+        
+        Raises:
+            CircuitOpenError: The vision workflow's circuit is open; nothing was run
+        """
+        self.check_available(VISION_SPECIALIST_WORKFLOW)
+        shared_image_url = await self.ingest_image(image_url)
+        
+        async def run(content_type, prompt):
+            try:
+                return content_type, await self.generate_text_content(shared_image_url, prompt)
+            except CircuitOpenError:
+                # Opened while the pack was running
+                return content_type, None
+        
+        tasks = [asyncio.ensure_future(run(content_type, prompt)) for content_type, prompt in prompts.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The consumer stopped early, don't leave runs behind
+            for task in tasks:
+                task.cancel()
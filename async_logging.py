@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Queue-backed structured logging that never blocks the event loop
+
+Handlers on the event loop only put the log record on a bounded in-memory
+queue; a listener thread formats it as one JSON object per line and does the
+actual I/O. When the queue is full the record is dropped and counted rather
+than waiting. Large payloads (e.g. fal results) are truncated when formatted,
+and chatty events can be sampled per event name.
+
+Attach structured fields with ``extra``:
+
+    logger.info("API Result", extra={"event": "fal.result", "payload": result})
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import traceback
+
+from metrics import LOG_RECORDS_DROPPED_TOTAL
+from tracing import current_span
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def truncate(value, max_chars):
+    """
+    Cap the size of a payload for logging
+
+    Strings longer than max_chars are cut and marked with the original length;
+    dicts and lists are truncated recursively and long lists are shortened.
+
+    Args:
+        value: Any JSON-like value
+        max_chars (int): Longest string kept, also bounds list lengths
+
+    Returns:
+        A value of the same shape that is safe to serialize
+    """
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return f"{value[:max_chars]}…[{len(value)} chars]"
+        return value
+    if isinstance(value, dict):
+        return {str(key): truncate(item, max_chars) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        limit = max(1, max_chars // 100)
+        items = [truncate(item, max_chars) for item in value[:limit]]
+        if len(value) > limit:
+            items.append(f"…[{len(value)} items]")
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return truncate(repr(value), max_chars)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_field_chars=2000):
+        """
+        Format records as single-line JSON objects
+
+        Args:
+            max_field_chars (int): Longest string kept in the message, extra
+                fields and tracebacks
+        """
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record):
+        entry = {
+            "ts": f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))}.{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), self.max_field_chars)
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = truncate(value, self.max_field_chars)
+        if record.exc_info:
+            formatted = "".join(traceback.format_exception(*record.exc_info))
+            # Keep the end of the traceback, where the error is
+            if len(formatted) > self.max_field_chars:
+                formatted = f"…{formatted[-self.max_field_chars:]}"
+            entry["exc"] = formatted
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line text format, with the same size caps as JsonFormatter"""
+
+    def __init__(self, max_field_chars=2000):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.max_field_chars = max_field_chars
+
+    def format(self, record):
+        line = super().format(record)
+        extra = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+        if extra:
+            line += f" {json.dumps(truncate(extra, self.max_field_chars), ensure_ascii=False, default=str)}"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        """
+        Keep only a fraction of the records of chatty events
+
+        Args:
+            rates (dict): Event name (the ``event`` extra field) to the fraction
+                of its records that are kept. Warnings and errors are always kept.
+        """
+        super().__init__()
+        self.rates = dict(rates)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None))
+        return rate is None or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on a bounded queue without waiting
+
+    Unlike the stdlib QueueHandler, records aren't formatted here (that's the
+    listener's job, off the event loop); only the current trace ids are attached
+    because they live in the caller's context.
+    """
+
+    def prepare(self, record):
+        span = current_span()
+        trace_id = getattr(span, "trace_id", None)
+        if trace_id:
+            record.trace_id = trace_id
+            record.span_id = span.span_id
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED_TOTAL.inc()
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue instead of failing"""
+
+    def enqueue_sentinel(self):
+        # The listener thread is still draining, so this only waits for one free slot
+        self.queue.put(self._sentinel)
+
+
+def parse_sample_rates(spec):
+    """
+    Parse 'event=rate,event=rate' into a dict
+
+    Example: 'fal.result=0.1,telegram.update=0.01'
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(level="INFO", fmt="json", path=None, max_field_chars=2000, sample_rates=None, queue_size=10000):
+    """
+    Route the root logger through a queue to a listener thread
+
+    Args:
+        level (str): Root log level
+        fmt (str): 'json' for structured records or 'text' for the classic format
+        path (str): Log file; None or empty logs to stderr
+        max_field_chars (int): Longest string kept per field
+        sample_rates (dict): Per-event sampling rates (see SamplingFilter)
+        queue_size (int): Records buffered before new ones are dropped
+
+    Returns:
+        DrainingQueueListener: The running listener; call stop() to
+        flush and stop it
+    """
+    formatter = JsonFormatter(max_field_chars) if fmt == "json" else TextFormatter(max_field_chars)
+    output = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    records = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(records)
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = DrainingQueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Offline batch pipeline for processing a catalog of product images
+
+Takes a directory of images or a CSV/JSONL manifest, runs every requested
+shot type, text type and watermark position through FalAPIClient and
+WatermarkProcessor with bounded concurrency, and writes the results next to a
+results manifest. The manifest doubles as the checkpoint: re-running the same
+command skips every task already recorded as done.
+
+Examples:
+    python batch_process.py catalog/ --shots product_only_hero --watermarks bottom_right
+    python batch_process.py manifest.csv --shots all --texts "Product Description" --prompt "Summer sale"
+    python batch_process.py catalog/ --shots all --standin
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+
+import buffers
+from animation import animated_format
+from api_client import FalAPIClient
+from config import (
+    CONTENT_CREATOR_WORKFLOW,
+    VISION_SPECIALIST_WORKFLOW,
+    PRODUCT_SHOT_TYPES,
+    TEXT_CONTENT_TYPES,
+    WATERMARK_POSITIONS,
+    TEXT_PROMPT_TEMPLATE,
+    WORKFLOW_COSTS
+)
+from watermark import WatermarkProcessor
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+LIST_FIELDS = ("shots", "texts", "watermarks")
+# Allowed values of each list field ("all" selects every one)
+FIELD_CHOICES = {"shots": PRODUCT_SHOT_TYPES, "texts": TEXT_CONTENT_TYPES, "watermarks": WATERMARK_POSITIONS}
+
+
+def split_list(value):
+    """Split a ';' or ',' separated manifest field into a list"""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return value
+    separator = ";" if ";" in value else ","
+    return [part.strip() for part in value.split(separator) if part.strip()]
+
+
+def image_extension(content_type):
+    """File extension for an image Content-Type (.jpg when it isn't an image type we know)"""
+    if content_type:
+        extension = mimetypes.guess_extension(content_type.split(";", 1)[0].strip().lower())
+        if extension in IMAGE_EXTENSIONS:
+            return extension
+    return ".jpg"
+
+
+def check_sku(sku):
+    """
+    Raise ValueError unless a SKU is usable as a single directory name
+
+    Results are written to <output dir>/<sku>/, so a SKU must not be empty,
+    '.' or '..', or contain a path separator.
+    """
+    if sku in ("", ".", "..") or "/" in sku or "\\" in sku or "\0" in sku:
+        raise ValueError(f"Unsafe SKU {sku!r}: SKUs are used as directory names")
+
+
+def load_items(source):
+    """
+    Load catalog items from a directory or a CSV/JSONL manifest
+
+    Manifest rows need an ``image`` column (local path or URL) and may set
+    ``sku``, ``shots``, ``texts``, ``watermarks`` and ``prompt`` to override
+    the command-line defaults for that image. In a directory, each image's
+    SKU is its file name without the extension, or the whole file name when
+    two images share a stem (a.jpg and a.png).
+
+    Returns:
+        list: Item dicts with at least 'sku' and 'image'
+
+    Raises:
+        ValueError: Unsupported manifest format, an unsafe or repeated SKU,
+            or an unknown shot type, text type or watermark position
+    """
+    if os.path.isdir(source):
+        names = [name for name in sorted(os.listdir(source)) if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+        stems = Counter(os.path.splitext(name)[0] for name in names)
+        items = []
+        for name in names:
+            stem = os.path.splitext(name)[0]
+            sku = stem if stems[stem] == 1 and stem not in names else name
+            check_sku(sku)
+            items.append({"sku": sku, "image": os.path.join(source, name)})
+        return items
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="", encoding="utf-8") as f:
+        if source.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif source.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            raise ValueError(f"Unsupported manifest format: {source}")
+
+    items = []
+    seen = {}
+    for number, row in enumerate(rows, start=1):
+        image = row.get("image")
+        if not image:
+            continue
+        # Relative paths in a manifest are relative to the manifest itself
+        if not image.startswith(("http://", "https://")) and not os.path.isabs(image):
+            image = os.path.join(base_dir, image)
+
+        item = {key: value for key, value in row.items() if value not in (None, "")}
+        item["image"] = image
+        item["sku"] = str(item.get("sku", os.path.splitext(os.path.basename(image))[0]))
+        try:
+            check_sku(item["sku"])
+        except ValueError as e:
+            raise ValueError(f"{source} row {number}: {e}") from None
+        if item["sku"] in seen:
+            raise ValueError(f"{source} row {number}: SKU {item['sku']!r} already used in row {seen[item['sku']]}")
+        seen[item["sku"]] = number
+
+        for field in LIST_FIELDS:
+            if field not in item:
+                continue
+            values = split_list(item[field])
+            if values == ["all"]:
+                values = list(FIELD_CHOICES[field])
+            unknown = [value for value in values if value not in FIELD_CHOICES[field]]
+            if unknown:
+                raise ValueError(
+                    f"{source} row {number}: unknown {field} {', '.join(map(repr, unknown))} "
+                    f"(choose from: {', '.join(FIELD_CHOICES[field])})"
+                )
+            item[field] = values
+        items.append(item)
+    return items
+
+
+def load_completed(manifest_path):
+    """Return the keys of every task already recorded as done in the results manifest"""
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["key"])
+    return completed
+
+
+class BatchRunner:
+    def __init__(self, api_client, watermark_processor, output_dir, concurrency=4, prompt=""):
+        self.api_client = api_client
+        self.watermark_processor = watermark_processor
+        self.output_dir = output_dir
+        self.prompt = prompt
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.calls = Counter()
+        self.stats = Counter()
+        self._uploads = {}
+        self._manifest = None
+
+    async def resolve_image(self, item):
+        """Return a URL the workflows can fetch, uploading local files once per image"""
+        image = item["image"]
+        if image.startswith(("http://", "https://")):
+            return image
+        if image not in self._uploads:
+            self._uploads[image] = asyncio.ensure_future(self.api_client.upload_file(image))
+        return await self._uploads[image]
+
+    def write_file(self, relative_path, data):
+        path = os.path.join(self.output_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, bytes):
+            with open(path, "wb") as f:
+                f.write(data)
+        elif hasattr(data, "read"):
+            # A streamed download or animation (buffers.SpooledBuffer)
+            data.seek(0)
+            with open(path, "wb") as f:
+                shutil.copyfileobj(data, f)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(data)
+        return path
+
+    def save_shot(self, sku, shot_id, image_url, watermarks):
+        """
+        Download a generated image and write it plus one file per watermark position
+
+        The downloaded file is named after its Content-Type; watermarked files
+        after the encoder's format, or the container of an animation.
+        """
+        with buffers.fetch(image_url) as image:
+            extension = image_extension(image.content_type)
+            raw_path = self.write_file(os.path.join(sku, f"{shot_id}{extension}"), image)
+
+        files = [raw_path]
+        for pos_id in watermarks:
+            watermarked = self.watermark_processor.add_watermark(
+                image_url=raw_path,
+                position=WATERMARK_POSITIONS[pos_id]["value"]
+            )
+            if watermarked is None:
+                raise RuntimeError(f"Watermarking failed for position {pos_id}")
+            fmt = animated_format(watermarked)
+            extension = f".{fmt.lower()}" if fmt else self.watermark_processor.encoder.extension
+            try:
+                files.append(self.write_file(os.path.join(sku, f"{shot_id}_{pos_id}{extension}"), watermarked))
+            finally:
+                if hasattr(watermarked, "close"):
+                    watermarked.close()
+        return files
+
+    async def run_shot(self, item, shot_id):
+        image_url = await self.resolve_image(item)
+        if not image_url:
+            raise RuntimeError("Image upload failed")
+
+        async with self.semaphore:
+            self.calls[CONTENT_CREATOR_WORKFLOW] += 1
+            result = await self.api_client.generate_product_image(
+                image_url=image_url,
+                shot_type=PRODUCT_SHOT_TYPES[shot_id]["prompt"]
+            )
+        if not (result and result.get("images")):
+            raise RuntimeError(f"No valid result from API: {result}")
+
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(
+            None, self.save_shot, item["sku"], shot_id, result["images"][0]["url"], item["watermarks"]
+        )
+        self.stats["images"] += len(files)
+        return {"source_url": result["images"][0]["url"], "files": files}
+
+    async def run_text(self, item, content_type):
+        image_url = await self.resolve_image(item)
+        if not image_url:
+            raise RuntimeError("Image upload failed")
+
+        prompt = TEXT_PROMPT_TEMPLATE.format(
+            content_type=content_type,
+            user_prompt=item.get("prompt", self.prompt)
+        )
+        async with self.semaphore:
+            self.calls[VISION_SPECIALIST_WORKFLOW] += 1
+            result = await self.api_client.generate_text_content(image_url=image_url, prompt=prompt)
+        if not (result and result.get("output")):
+            raise RuntimeError(f"No valid text result from API: {result}")
+
+        file_name = content_type.lower().replace(" ", "_") + ".txt"
+        path = self.write_file(os.path.join(item["sku"], file_name), result["output"])
+        self.stats["texts"] += 1
+        return {"files": [path]}
+
+    async def run_task(self, task):
+        item, kind, type_id = task["item"], task["kind"], task["type"]
+        start = time.perf_counter()
+        record = {"key": task["key"], "sku": item["sku"], "image": item["image"], "kind": kind, "type": type_id}
+        try:
+            if kind == "shot":
+                record.update(await self.run_shot(item, type_id))
+            else:
+                record.update(await self.run_text(item, type_id))
+            record["status"] = "ok"
+            self.stats["done"] += 1
+            print(f"✅ {task['key']} ({time.perf_counter() - start:.1f}s)")
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = str(e)
+            self.stats["failed"] += 1
+            print(f"❌ {task['key']}: {e}")
+
+        record["elapsed"] = round(time.perf_counter() - start, 3)
+        self._manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._manifest.flush()
+
+    async def run(self, tasks, manifest_path):
+        with open(manifest_path, "a", encoding="utf-8") as manifest:
+            self._manifest = manifest
+            await asyncio.gather(*(self.run_task(task) for task in tasks))
+        self._manifest = None
+
+    def cost(self):
+        return sum(WORKFLOW_COSTS.get(workflow, 0.0) * count for workflow, count in self.calls.items())
+
+
+def task_key(item, kind, type_id, prompt, logo):
+    """
+    Checkpoint key of a task
+
+    Ends in a digest of everything else that changes the task's output (the
+    image, the watermark positions and logo of a shot, the brief of a text),
+    so a re-run with other options runs the task again instead of skipping it.
+    """
+    if kind == "shot":
+        options = {"watermarks": sorted(item["watermarks"]), "logo": logo if item["watermarks"] else None}
+    else:
+        options = {"prompt": item.get("prompt", prompt)}
+    options["image"] = item["image"]
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{item['sku']}/{kind}/{type_id}/{digest}"
+
+
+def build_tasks(items, defaults, completed, prompt="", logo=""):
+    """Expand catalog items into one task per shot type and text type"""
+    tasks = []
+    skipped = 0
+    for item in items:
+        for field in LIST_FIELDS:
+            item.setdefault(field, defaults[field])
+        for kind, field in (("shot", "shots"), ("text", "texts")):
+            for type_id in item[field]:
+                key = task_key(item, kind, type_id, prompt, logo)
+                if key in completed:
+                    skipped += 1
+                    continue
+                tasks.append({"key": key, "item": item, "kind": kind, "type": type_id})
+    return tasks, skipped
+
+
+def parse_choices(value, choices, name, parser):
+    values = split_list(value) or []
+    if values == ["all"]:
+        return list(choices)
+    unknown = [v for v in values if v not in choices]
+    if unknown:
+        parser.error(f"Unknown {name}: {', '.join(unknown)} (choose from: {', '.join(choices)})")
+    return values
+
+
+async def run_batch(args, parser):
+    defaults = {
+        "shots": parse_choices(args.shots, PRODUCT_SHOT_TYPES, "shot types", parser),
+        "texts": parse_choices(args.texts, TEXT_CONTENT_TYPES, "text types", parser),
+        "watermarks": parse_choices(args.watermarks, WATERMARK_POSITIONS, "watermark positions", parser)
+    }
+
+    try:
+        items = load_items(args.input)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    if not items:
+        print(f"❌ No images found in {args.input}")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, "results.jsonl")
+    tasks, skipped = build_tasks(items, defaults, load_completed(manifest_path), prompt=args.prompt, logo=args.logo)
+
+    standin = None
+    if args.standin:
+        from fal_standin import FalStandIn
+        standin = FalStandIn(latency=(args.standin_latency / 2, args.standin_latency * 1.5))
+        standin.start()
+
+    runner = BatchRunner(
+        api_client=FalAPIClient(backend=standin),
+        watermark_processor=WatermarkProcessor(args.logo),
+        output_dir=args.output_dir,
+        concurrency=args.concurrency,
+        prompt=args.prompt
+    )
+
+    print(f"📦 {len(items)} images, {len(tasks)} tasks to run ({skipped} already done)")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    try:
+        await runner.run(tasks, manifest_path)
+    finally:
+        if standin is not None:
+            standin.stop()
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "tasks": len(tasks),
+        "skipped": skipped,
+        "done": runner.stats["done"],
+        "failed": runner.stats["failed"],
+        "images_written": runner.stats["images"],
+        "texts_written": runner.stats["texts"],
+        "elapsed_seconds": round(elapsed, 3),
+        "tasks_per_second": round(len(tasks) / elapsed, 3) if elapsed else 0.0,
+        "images_per_minute": round(runner.stats["images"] * 60 / elapsed, 1) if elapsed else 0.0,
+        "workflow_calls": dict(runner.calls),
+        "estimated_cost_usd": round(runner.cost(), 4)
+    }
+    with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    print("=" * 50)
+    print(f"🏁 Done: {summary['done']}  Failed: {summary['failed']}  Skipped: {skipped}")
+    print(f"⏱️  {elapsed:.1f}s, {summary['tasks_per_second']} tasks/s, {summary['images_per_minute']} images/min")
+    print(f"💰 Estimated cost: ${summary['estimated_cost_usd']}")
+    print(f"📄 Results manifest: {manifest_path}")
+    return 1 if summary["failed"] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-process a catalog of product images")
+    parser.add_argument("input", help="Directory of images or a .csv/.jsonl manifest")
+    parser.add_argument("--shots", default="", help="Shot type ids (comma separated) or 'all'")
+    parser.add_argument("--texts", default="", help="Text content types (comma separated) or 'all'")
+    parser.add_argument("--watermarks", default="", help="Watermark position ids for generated shots, or 'all'")
+    parser.add_argument("--prompt", default="", help="Brief used for text content")
+    parser.add_argument("--output-dir", default="batch_output", help="Where results and the manifest are written")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum workflow runs in flight")
+    parser.add_argument("--logo", default="logo.png", help="Logo used for watermarks")
+    parser.add_argument("--standin", action="store_true", help="Run against the local fal stand-in")
+    parser.add_argument("--standin-latency", type=float, default=1.0, help="Mean stand-in latency in seconds")
+    args = parser.parse_args()
+
+    if not args.shots and not args.texts:
+        parser.error("Nothing to do: pass --shots and/or --texts")
+
+    sys.exit(asyncio.run(run_batch(args, parser)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for watermarking animated GIF and WebP images
+
+Synthetic animations with a growing number of frames are watermarked two
+ways, each in a fresh interpreter so peak RSS isn't hidden by memory kept
+from an earlier case:
+
+- streaming: WatermarkProcessor.watermark_animation (what add_watermark uses
+  for animations), which decodes, watermarks and encodes one frame at a time
+  into a file
+- eager: every frame decoded and watermarked into a list, then written with
+  Pillow's save_all (what the straightforward implementation does)
+
+Peak RSS growth should stay flat with the frame count for streaming and grow
+linearly for eager. Encoded data isn't part of that bound: Pillow's WebP
+decoder holds the whole source file, and add_watermark returns the output
+as bytes. Each streaming output is checked for its frame count and
+durations. Results are written to JSON; pass --compare with an earlier file
+to see the change.
+
+Examples:
+    python bench_animation.py --output bench_animation.json
+    python bench_animation.py --frames 20,80,320 --size 800x600 --compare bench_animation.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import animation
+
+# Runs in the child interpreter; prints peak RSS growth and time as JSON
+PROBE = """
+import io, json, resource, time
+from PIL import Image
+import animation
+from watermark import WatermarkProcessor
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+processor = WatermarkProcessor(logo_path={logo!r})
+start_rss = rss_bytes()
+start = time.perf_counter()
+if {mode!r} == "streaming":
+    with open({output!r}, "w+b") as f:
+        source, _ = processor.open_image({path!r})
+        processor.watermark_animation(source, f)
+        source.close()
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    with open({output!r}, "rb") as f:
+        data = f.read()
+else:
+    source = Image.open({path!r})
+    frames = list(processor.watermark_frames(animation.iter_frames(source), "bottom-right", logo=processor.pyramid))
+    output = io.BytesIO()
+    frames[0][0].save(
+        output, format=source.format, save_all=True, append_images=[frame for frame, _ in frames[1:]],
+        duration=[duration for _, duration in frames], loop=source.info.get("loop", 0), disposal=2
+    )
+    data = output.getvalue()
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+durations = [duration for _, duration in animation.iter_frames(Image.open(io.BytesIO(data)))]
+print(json.dumps({{
+    "seconds": seconds,
+    "peak_rss_growth": max(0, peak - start_rss),
+    "bytes": len(data),
+    "frames": len(durations),
+    "durations": durations
+}}))
+"""
+
+
+def synthetic_frames(size, count):
+    """A moving gradient; each frame is made when it's needed, with a varying duration"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 16)
+    for i in range(count):
+        shift = gradient.point(lambda value, i=i: (value + i * 7) % 256)
+        yield Image.merge("RGBA", (shift, noise, gradient, Image.new("L", size, 255))), 40 + (i % 5) * 20
+
+
+def write_source(path, fmt, size, count):
+    """Write a synthetic animation without holding its frames, so the parent stays small"""
+    with open(path, "wb") as f:
+        animation.write_frames(synthetic_frames(size, count), fmt, f, size)
+    return [40 + (i % 5) * 20 for i in range(count)]
+
+
+def run_case(path, mode, logo):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    process = subprocess.run(
+        [sys.executable, "-c", PROBE.format(path=path, output=f"{path}.out", mode=mode, logo=logo)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if process.returncode != 0:
+        raise SystemExit(f"❌ {mode} run failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(case["format"], case["mode"], case["frames"]): case for case in json.load(f)["results"]}
+    print("=" * 72)
+    print(f"Compared with {baseline_path} (ratio < 1 is smaller)")
+    print(f"{'case':28s} {'before MB':>10s} {'after MB':>10s} {'ratio':>7s}")
+    for case in results:
+        previous = baseline.get((case["format"], case["mode"], case["frames"]))
+        if previous and previous["peak_rss_mb"]:
+            name = f"{case['format']}/{case['mode']}/{case['frames']}"
+            print(f"{name:28s} {previous['peak_rss_mb']:10.1f} {case['peak_rss_mb']:10.1f} {case['peak_rss_mb'] / previous['peak_rss_mb']:7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", default="10,40,160", help="Comma-separated frame counts")
+    parser.add_argument("--size", default="640x480", help="Frame size, WIDTHxHEIGHT")
+    parser.add_argument("--formats", default="GIF,WEBP", help=f"Comma-separated subset of {', '.join(animation.FORMATS)}")
+    parser.add_argument("--modes", default="streaming,eager", help="Comma-separated subset of streaming, eager")
+    parser.add_argument("--logo", default="logo.png")
+    parser.add_argument("--output", default="bench_animation.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+    counts = [int(value) for value in args.frames.split(",")]
+    print(f"🧪 Animated watermark benchmark ({args.size}, frames {args.frames})")
+    print("=" * 72)
+    print(f"{'format':7s} {'mode':10s} {'frames':>7s} {'time s':>8s} {'peak RSS MB':>12s} {'output KB':>10s}  durations")
+
+    results = []
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="bench_animation_") as directory:
+        for fmt in args.formats.split(","):
+            for count in counts:
+                path = os.path.join(directory, f"source_{count}{animation.FORMATS[fmt]}")
+                expected = write_source(path, fmt, size, count)
+                for mode in args.modes.split(","):
+                    result = run_case(path, mode, args.logo)
+                    kept = result["frames"] == count and result["durations"] == expected
+                    if mode == "streaming" and not kept:
+                        failures += 1
+                    print(
+                        f"{fmt:7s} {mode:10s} {count:7d} {result['seconds']:8.2f} "
+                        f"{result['peak_rss_growth'] / 2**20:12.1f} {result['bytes'] / 1024:10.0f}  "
+                        f"{'kept' if kept else 'CHANGED'}"
+                    )
+                    results.append({
+                        "format": fmt,
+                        "mode": mode,
+                        "frames": count,
+                        "seconds": result["seconds"],
+                        "peak_rss_mb": result["peak_rss_growth"] / 2**20,
+                        "output_bytes": result["bytes"],
+                        "durations_kept": kept
+                    })
+    print("=" * 72)
+
+    # Streaming peak should not grow with the frame count
+    for fmt in args.formats.split(","):
+        streaming = [case for case in results if case["format"] == fmt and case["mode"] == "streaming"]
+        if len(streaming) > 1:
+            first, last = streaming[0], streaming[-1]
+            print(
+                f"📈 {fmt} streaming: {last['frames'] / first['frames']:.0f}x the frames, "
+                f"peak RSS {first['peak_rss_mb']:.1f} → {last['peak_rss_mb']:.1f} MB"
+            )
+    if failures:
+        print(f"❌ {failures} streaming outputs lost frames or durations")
+    else:
+        print("✅ Streaming outputs kept every frame and duration")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "size": args.size
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
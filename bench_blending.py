@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Compare the Pillow and NumPy watermark compositing backends
+
+Checks pixel parity between the two paths (every position, several
+opacities and image sizes) and then times compositing alone, without
+download or JPEG encode. Also times blending several positions and a batch
+of images in one NumPy call. Exits non-zero if parity fails.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+from PIL import Image
+
+import blending
+from config import WATERMARK_POSITIONS
+from watermark import WatermarkProcessor
+
+SIZES = ((512, 512), (1024, 1024), (2048, 2048), (3840, 2160))
+OPACITIES = (1.0, 0.75, 0.5, 0.2)
+
+
+def synthetic_image(size):
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    return Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def best_ms(func, repeat):
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, statistics.median(times) * 1000
+
+
+def check_parity(processor, tolerance):
+    """Largest per-channel difference between the backends for each case"""
+    np = blending.load_numpy()
+    worst = 0
+    failures = []
+    for size in SIZES[:3] + ((300, 200), (40, 40)):
+        base = synthetic_image(size)
+        for position in WATERMARK_POSITIONS.values():
+            for opacity in OPACITIES:
+                expected = np.asarray(processor.compose_pillow(base, position["value"], opacity), dtype=np.int16)
+                actual = np.asarray(processor.compose_numpy(base, position["value"], opacity), dtype=np.int16)
+                difference = int(np.abs(expected - actual).max())
+                worst = max(worst, difference)
+                if difference > tolerance:
+                    failures.append(f"{size[0]}x{size[1]} {position['value']} opacity={opacity}: max diff {difference}")
+    return worst, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=8, help="Images blended in one batched call")
+    parser.add_argument("--tolerance", type=int, default=2, help="Largest allowed per-channel difference")
+    parser.add_argument("--logo", default="logo.png")
+    args = parser.parse_args()
+
+    if not blending.AVAILABLE:
+        sys.exit("❌ NumPy is not installed")
+    processor = WatermarkProcessor(args.logo, backend="numpy")
+    positions = [position["value"] for position in WATERMARK_POSITIONS.values()]
+
+    print("🧪 Pixel parity (Pillow vs NumPy)")
+    worst, failures = check_parity(processor, args.tolerance)
+    for failure in failures:
+        print(f"   ❌ {failure}")
+    print(f"{'✅' if not failures else '❌'} Largest channel difference: {worst} (tolerance {args.tolerance})")
+
+    print("=" * 78)
+    print(f"{'size':>10s} {'case':30s} {'pillow ms':>10s} {'numpy ms':>10s} {'speedup':>8s}")
+    for size in SIZES:
+        base = synthetic_image(size)
+        label = f"{size[0]}x{size[1]}"
+        for opacity in (1.0, 0.5):
+            pillow_ms, _ = best_ms(lambda: processor.compose_pillow(base, "bottom-right", opacity), args.repeat)
+            numpy_ms, _ = best_ms(lambda: processor.compose_numpy(base, "bottom-right", opacity), args.repeat)
+            print(f"{label:>10s} {f'one position, opacity {opacity}':30s} {pillow_ms:10.2f} {numpy_ms:10.2f} {pillow_ms / numpy_ms:7.1f}x")
+
+        # Every position on one image: one Pillow composite each vs one NumPy pass
+        pillow_ms, _ = best_ms(lambda: [processor.compose_pillow(base, position) for position in positions], args.repeat)
+        numpy_ms, _ = best_ms(lambda: processor.compose_numpy(base, positions[0], positions=positions[1:]), args.repeat)
+        print(f"{label:>10s} {f'{len(positions)} positions':30s} {pillow_ms:10.2f} {numpy_ms:10.2f} {pillow_ms / numpy_ms:7.1f}x")
+
+        # A batch of same-sized images in one call
+        images = [base] * args.batch
+        logo = processor.premultiplied_logo(processor.calculate_watermark_size(base))
+        corner = processor.calculate_position(base.size, logo.size, "bottom-right")
+        pillow_ms, _ = best_ms(lambda: [processor.compose_pillow(image, "bottom-right") for image in images], args.repeat)
+        numpy_ms, _ = best_ms(lambda: blending.blend_images(images, logo, [corner]), args.repeat)
+        print(f"{label:>10s} {f'batch of {args.batch} images':30s} {pillow_ms:10.2f} {numpy_ms:10.2f} {pillow_ms / numpy_ms:7.1f}x")
+    print("=" * 78)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
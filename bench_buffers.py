@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for delivering a generated image: download to Telegram upload
+
+A local server plays both the image host and the Telegram Bot API. Each
+case runs in a fresh interpreter (as in bench_animation.py), downloads one
+generated image, passes it through the output encoder (no byte budget, so
+it is passed through as-is) and sends it with python-telegram-bot's
+send_photo, two ways:
+
+- copying: requests' response.content wrapped in a BytesIO, which
+  python-telegram-bot reads whole into the request (how the bot used to do it)
+- streaming: buffers.fetch() into a SpooledBuffer, sent with buffers.upload()
+  so the HTTP client reads it in chunks (what the bot does now)
+
+Reported per image size: peak RSS growth, and the peak of memory allocated
+by Python (tracemalloc) as a multiple of the image size, i.e. how many
+whole copies of the image were alive at once. Images above
+BUFFER_SPILL_BYTES are spilled to a temporary file in streaming mode. The
+server checks that every upload arrived intact.
+
+Examples:
+    python bench_buffers.py
+    python bench_buffers.py --sizes 1000,3000,5000 --spill-bytes 1048576 --output bench_buffers.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+TOKEN = "123456:bench"
+
+# Runs in the child interpreter; prints the measurements as JSON
+PROBE = """
+import asyncio, io, json, resource, time, tracemalloc
+import requests
+from telegram import Bot
+import buffers
+from encoder import ImageEncoder
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+def reset_peak_rss():
+    # ru_maxrss carries over the parent's peak through fork and exec; reset the high-water mark instead
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_bytes():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+encoder = ImageEncoder(max_bytes=0)
+
+def send_copying(bot, url):
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    content = encoder.reencode(response.content)
+    image_data = io.BytesIO(content)
+    image_data.name = "generated.jpg"
+    return bot.send_photo(chat_id=1, photo=image_data)
+
+def send_streaming(bot, url):
+    image = buffers.fetch(url)
+    content = encoder.reencode(image)
+    return bot.send_photo(chat_id=1, photo=buffers.upload(content, "generated.jpg")), image
+
+async def main():
+    async with Bot({token!r}, base_url={base_url!r}) as bot:
+        # Warm up connection pools and lazy imports on a small image
+        if {mode!r} == "copying":
+            await send_copying(bot, {warm_url!r})
+        else:
+            call, image = send_streaming(bot, {warm_url!r})
+            await call
+            image.close()
+        reset_peak_rss()
+        start_rss = rss_bytes()
+        tracemalloc.start()
+        start = time.perf_counter()
+        if {mode!r} == "copying":
+            await send_copying(bot, {url!r})
+            spilled = False
+        else:
+            call, image = send_streaming(bot, {url!r})
+            await call
+            spilled = image.spilled
+            image.close()
+        seconds = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        peak = peak_rss_bytes()
+    print(json.dumps({{
+        "seconds": seconds,
+        "peak_rss_growth": max(0, peak - start_rss),
+        "traced_peak": traced_peak,
+        "spilled": spilled
+    }}))
+
+asyncio.run(main())
+"""
+
+
+class BenchServer:
+    """Serves images and a minimal Bot API (getMe, sendPhoto) that checks uploads"""
+
+    def __init__(self):
+        self.images = {}
+        self.received = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                data = server.images.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                view = memoryview(data)
+                for offset in range(0, len(data), 1 << 20):
+                    self.wfile.write(view[offset:offset + (1 << 20)])
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                method = self.path.rsplit("/", 1)[-1]
+                if method == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+                else:
+                    # The upload is intact if one of the served images appears whole in the body
+                    server.received.append(any(image in body for image in server.images.values() if len(image) > 4096))
+                    result = {"message_id": len(server.received), "date": int(time.time()), "chat": {"id": 1, "type": "private"}}
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def make_image(side, seed):
+    """A noisy JPEG (compresses poorly, like a detailed photo) of side x side pixels"""
+    noise = Image.effect_noise((side, side), 64 + seed % 32)
+    image = Image.merge("RGB", (noise, noise.rotate(90), noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def run_case(server, mode, path, spill_bytes):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1", BUFFER_SPILL_BYTES=str(spill_bytes), OUTPUT_MAX_BYTES="0")
+    probe = PROBE.format(
+        token=TOKEN, base_url=f"{server.base_url}/bot", mode=mode,
+        url=f"{server.base_url}{path}", warm_url=f"{server.base_url}/warm.jpg"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", probe], capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if process.returncode != 0:
+        raise SystemExit(f"❌ {mode} run failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,2500,4000", help="Comma-separated image sides in pixels")
+    parser.add_argument("--modes", default="copying,streaming", help="Comma-separated subset of copying, streaming")
+    parser.add_argument("--spill-bytes", type=int, default=4 * 1024 * 1024, help="BUFFER_SPILL_BYTES for the streaming runs")
+    parser.add_argument("--output", default="bench_buffers.json", help="JSON results file")
+    args = parser.parse_args()
+
+    server = BenchServer()
+    server.images["/warm.jpg"] = make_image(64, 0)
+    print(f"🧪 Image delivery memory benchmark (spill above {args.spill_bytes / 2**20:.1f} MB)")
+    print("=" * 78)
+    print(f"{'mode':10s} {'image MB':>9s} {'time s':>7s} {'peak RSS MB':>12s} {'copies alive':>13s} {'spilled':>8s}  upload")
+
+    results = []
+    failures = 0
+    try:
+        for side in (int(value) for value in args.sizes.split(",")):
+            path = f"/image_{side}.jpg"
+            server.images[path] = make_image(side, side)
+            size = len(server.images[path])
+            for mode in args.modes.split(","):
+                received = len(server.received)
+                result = run_case(server, mode, path, args.spill_bytes)
+                # The warm-up upload comes first; the measured one is last
+                intact = len(server.received) == received + 2 and server.received[-1]
+                failures += not intact
+                copies = result["traced_peak"] / size
+                print(
+                    f"{mode:10s} {size / 2**20:9.1f} {result['seconds']:7.2f} {result['peak_rss_growth'] / 2**20:12.1f} "
+                    f"{copies:13.2f} {'yes' if result['spilled'] else 'no':>8s}  {'intact' if intact else 'BROKEN'}"
+                )
+                results.append({
+                    "mode": mode,
+                    "image_bytes": size,
+                    "seconds": result["seconds"],
+                    "peak_rss_mb": result["peak_rss_growth"] / 2**20,
+                    "traced_peak_bytes": result["traced_peak"],
+                    "copies_alive": copies,
+                    "spilled": result["spilled"],
+                    "intact": bool(intact)
+                })
+            del server.images[path]
+    finally:
+        server.stop()
+    print("=" * 78)
+
+    by_case = {(case["mode"], case["image_bytes"]): case for case in results}
+    for case in results:
+        before = by_case.get(("copying", case["image_bytes"]))
+        if case["mode"] == "streaming" and before:
+            print(
+                f"📉 {case['image_bytes'] / 2**20:5.1f} MB image: copies alive {before['copies_alive']:.2f} → {case['copies_alive']:.2f}, "
+                f"peak RSS {before['peak_rss_mb']:.1f} → {case['peak_rss_mb']:.1f} MB"
+            )
+    if failures:
+        print(f"❌ {failures} uploads arrived broken")
+    else:
+        print("✅ Every upload arrived intact")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "spill_bytes": args.spill_bytes
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
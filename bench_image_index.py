@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark perceptual-hash index lookups at a million entries
+"""
+
+import argparse
+import random
+import time
+
+from image_index import PerceptualHashIndex
+
+
+def flip_bits(phash, count, rng):
+    """Flip `count` random bits of a 64-bit hash"""
+    for bit in rng.sample(range(64), count):
+        phash ^= 1 << bit
+    return phash
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index = PerceptualHashIndex(max_distance=args.max_distance)
+
+    print(f"🧪 Building index with {args.entries:,} entries...")
+    start = time.perf_counter()
+    hashes = [rng.getrandbits(64) for _ in range(args.entries)]
+    for phash in hashes:
+        index.add(phash)
+    print(f"Build time: {time.perf_counter() - start:.1f}s")
+
+    # Half near-duplicates of stored hashes, half unrelated images
+    queries = []
+    for _ in range(args.queries // 2):
+        queries.append(flip_bits(rng.choice(hashes), rng.randint(0, args.max_distance), rng))
+        queries.append(rng.getrandbits(64))
+
+    timings = []
+    hits = 0
+    for phash in queries:
+        start = time.perf_counter()
+        matches = index.lookup(phash)
+        timings.append(time.perf_counter() - start)
+        hits += bool(matches)
+
+    print("=" * 50)
+    print(f"Queries: {len(queries):,} (hits: {hits:,})")
+    print(f"Mean lookup: {sum(timings) / len(timings) * 1e6:.1f} µs")
+    print(f"p50 lookup:  {percentile(timings, 50) * 1e6:.1f} µs")
+    print(f"p99 lookup:  {percentile(timings, 99) * 1e6:.1f} µs")
+    print(f"Max lookup:  {max(timings) * 1e6:.1f} µs")
+
+    if percentile(timings, 99) < 1e-3:
+        print("✅ p99 lookup is under 1 ms")
+    else:
+        print("❌ p99 lookup exceeds 1 ms")
+
+
+if __name__ == "__main__":
+    main()
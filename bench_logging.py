@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Check that logging never blocks the event loop
+
+Logs fal-sized payloads from a coroutine while a ticker measures event loop
+lag, once with a handler that writes synchronously and once through the
+queue-backed pipeline in async_logging. The output handler simulates a slow
+disk by sleeping on every write.
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import queue
+import statistics
+import time
+
+from async_logging import DrainingQueueListener, JsonFormatter, NonBlockingQueueHandler, SamplingFilter
+from metrics import LOG_RECORDS_DROPPED_TOTAL
+
+
+class SlowHandler(logging.StreamHandler):
+    """Formats and writes to memory, then sleeps as if the write hit a slow disk"""
+
+    def __init__(self, delay):
+        super().__init__(io.StringIO())
+        self.delay = delay
+        self.written = 0
+
+    def emit(self, record):
+        super().emit(record)
+        self.written += 1
+        time.sleep(self.delay)
+
+
+async def measure(logger, records, payload_chars):
+    payload = {"images": [{"url": "https://fal.media/files/x.jpg"}], "output": "x" * payload_chars}
+    lags = []
+    running = True
+
+    async def ticker():
+        interval = 0.001
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    ticker_task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0.01)
+
+    call_times = []
+    for i in range(records):
+        start = time.perf_counter()
+        logger.info("API Result", extra={"event": "fal.result", "payload": payload})
+        call_times.append(time.perf_counter() - start)
+        if i % 10 == 0:
+            await asyncio.sleep(0)
+
+    running = False
+    await ticker_task
+    call_times.sort()
+    return {
+        "max_lag_ms": max(lags) * 1000,
+        "p50_call_us": call_times[len(call_times) // 2] * 1e6,
+        "p99_call_us": call_times[int(len(call_times) * 0.99)] * 1e6,
+        "mean_call_us": statistics.mean(call_times) * 1e6
+    }
+
+
+def run_case(name, args, queued):
+    output = SlowHandler(args.write_delay)
+    output.setFormatter(JsonFormatter(args.max_field_chars))
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+
+    listener = None
+    if queued:
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=args.queue_size))
+        if args.sample_rate < 1.0:
+            handler.addFilter(SamplingFilter({"fal.result": args.sample_rate}))
+        listener = DrainingQueueListener(handler.queue, output)
+        listener.start()
+        logger.addHandler(handler)
+    else:
+        logger.addHandler(output)
+
+    dropped_before = LOG_RECORDS_DROPPED_TOTAL._only_child().value
+    result = asyncio.run(measure(logger, args.records, args.payload_chars))
+    if listener:
+        listener.stop()
+    result["written"] = output.written
+    result["dropped"] = int(LOG_RECORDS_DROPPED_TOTAL._only_child().value - dropped_before)
+    result["bytes_per_record"] = len(output.stream.getvalue()) / max(1, output.written)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--payload-chars", type=int, default=20000, help="Size of the generated text in each payload")
+    parser.add_argument("--write-delay", type=float, default=0.01, help="Seconds the simulated disk takes per write")
+    parser.add_argument("--max-field-chars", type=int, default=2000)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--sample-rate", type=float, default=0.1, help="Fraction of fal.result records kept (queued case)")
+    args = parser.parse_args()
+
+    print(f"🧪 Logging {args.records} records with {args.payload_chars}-char payloads, {args.write_delay * 1000:.1f} ms per write")
+    print("=" * 78)
+    print(f"{'handler':10s} {'max lag ms':>11s} {'p50 call µs':>12s} {'p99 call µs':>12s} {'written':>8s} {'dropped':>8s} {'B/record':>9s}")
+    results = {}
+    for name, queued in (("sync", False), ("queued", True)):
+        results[name] = result = run_case(name, args, queued)
+        print(
+            f"{name:10s} {result['max_lag_ms']:11.1f} {result['p50_call_us']:12.1f} {result['p99_call_us']:12.1f} "
+            f"{result['written']:8d} {result['dropped']:8d} {result['bytes_per_record']:9.0f}"
+        )
+    print("=" * 78)
+
+    # The ticker should only ever see scheduler noise, not a disk write
+    blocked = results["queued"]["max_lag_ms"] >= args.write_delay * 1000
+    print("❌ Event loop waited on log I/O" if blocked else "✅ Event loop never waited on log I/O")
+    return 1 if blocked else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Startup time benchmark for the bot
+
+Each run starts a fresh interpreter and measures three phases:
+
+- import: ``import bot``, broken down per module with ``-X importtime``
+- ready: creating ContentCreatorBot and its Application, i.e. everything
+  before polling can start
+- warm_up: ContentCreatorBot.warm_up(), which the bot runs in the
+  background once polling has started
+
+Modules that took the most time are listed, and so are the heavy modules
+that were imported before the bot was ready (they belong in warm-up).
+Results are written to JSON; pass --compare with an earlier file to see the
+change.
+
+Examples:
+    python bench_startup.py --output bench_startup.json
+    python bench_startup.py --repeat 10 --compare bench_startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Imported by the bot but not needed to start polling
+HEAVY_MODULES = ("PIL", "numpy", "fal_client", "requests")
+
+# Written to stderr between the importtime lines of the two phases
+WARM_UP_MARKER = "-- warm-up --"
+
+# Runs in the child interpreter; prints the phase timings as JSON
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import bot
+imported = time.perf_counter()
+instance = bot.ContentCreatorBot()
+instance.build_application(token="123456:STARTUP-BENCH")
+ready = time.perf_counter()
+loaded_before_ready = [name for name in {heavy!r} if name in sys.modules]
+sys.stderr.write("{marker}\\n")
+# Trees from before lazy initialization have no warm_up()
+getattr(instance, "warm_up", lambda: None)()
+warm = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "ready_ms": (ready - imported) * 1000,
+    "warm_up_ms": (warm - ready) * 1000,
+    "loaded_before_ready": loaded_before_ready
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Parse ``-X importtime`` output
+
+    Returns:
+        list: {'module', 'self_ms', 'cumulative_ms', 'depth', 'phase'} in
+            import order; phase is 'startup' or 'warm_up'
+    """
+    modules = []
+    phase = "startup"
+    for line in stderr.splitlines():
+        if line == WARM_UP_MARKER:
+            phase = "warm_up"
+            continue
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # "import time:       564 |       5877 |   async_logging"; nesting is two spaces per level
+        self_part, cumulative_part, name = line.split("|", 2)
+        modules.append({
+            "module": name.strip(),
+            "self_ms": int(self_part.split(":")[1]) / 1000,
+            "cumulative_ms": int(cumulative_part) / 1000,
+            "depth": (len(name) - len(name.lstrip(" ")) - 1) // 2,
+            "phase": phase
+        })
+    return modules
+
+
+def run_once():
+    """One fresh interpreter: phase timings plus the per-module import breakdown"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(heavy=HEAVY_MODULES, marker=WARM_UP_MARKER)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if process.returncode != 0:
+        raise SystemExit(f"❌ Startup probe failed:\n{process.stderr[-2000:]}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["modules"] = parse_importtime(process.stderr)
+    return result
+
+
+def interpreter_ms(repeat):
+    """Bare interpreter start, for reference"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=15, help="Modules to list")
+    parser.add_argument("--output", default="bench_startup.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    print(f"🧪 Startup benchmark (Python {platform.python_version()}, median of {args.repeat})")
+    runs = [run_once() for _ in range(args.repeat)]
+    phases = {
+        phase: statistics.median(run[phase] for run in runs)
+        for phase in ("import_ms", "ready_ms", "warm_up_ms")
+    }
+    phases["interpreter_ms"] = interpreter_ms(args.repeat)
+
+    # Per-module times of the run with the median import time
+    median_run = sorted(runs, key=lambda run: run["import_ms"])[len(runs) // 2]
+    modules = median_run["modules"]
+
+    print("=" * 72)
+    print(f"{'interpreter start':30s} {phases['interpreter_ms']:9.1f} ms")
+    print(f"{'import bot':30s} {phases['import_ms']:9.1f} ms")
+    print(f"{'bot + application created':30s} {phases['ready_ms']:9.1f} ms")
+    print(f"{'time to polling':30s} {phases['import_ms'] + phases['ready_ms']:9.1f} ms")
+    print(f"{'background warm-up':30s} {phases['warm_up_ms']:9.1f} ms")
+    print("=" * 72)
+    for phase, title in (("startup", "before polling"), ("warm_up", "during warm-up")):
+        # Top-level imports of the bot's modules, by cumulative time
+        imports = [module for module in modules if module["phase"] == phase and module["depth"] <= 1]
+        print(f"Slowest imports {title} (cumulative)")
+        for module in sorted(imports, key=lambda module: module["cumulative_ms"], reverse=True)[:args.top]:
+            print(f"   {module['module']:40s} {module['cumulative_ms']:9.1f} ms")
+    print("Slowest modules by self time")
+    for module in sorted(modules, key=lambda module: module["self_ms"], reverse=True)[:args.top]:
+        print(f"   {module['module']:40s} {module['self_ms']:9.1f} ms  ({module['phase']})")
+    print("=" * 72)
+
+    loaded = median_run["loaded_before_ready"]
+    if loaded:
+        print(f"⚠️  Heavy modules loaded before polling: {', '.join(loaded)}")
+    else:
+        print(f"✅ None of {', '.join(HEAVY_MODULES)} loaded before polling")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": args.repeat
+        },
+        "phases": phases,
+        "loaded_before_ready": loaded,
+        "modules": modules
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print("=" * 72)
+        print(f"Compared with {args.compare} (ratio < 1 is faster)")
+        print(f"{'phase':30s} {'before ms':>10s} {'after ms':>10s} {'ratio':>7s}")
+        for phase, value in phases.items():
+            previous = baseline["phases"].get(phase)
+            if previous:
+                print(f"{phase:30s} {previous:10.1f} {value:10.1f} {value / previous:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for workflow warm-keeping
+
+Replays bursty traffic (a handful of users, a pause, another handful, ...)
+against the fal stand-in with simulated cold starts: a workflow that has
+been idle for --idle-timeout seconds takes --cold-start extra seconds on its
+next run. Each user sends a photo (pre-warming, when enabled), thinks, and
+runs one image or text generation. The same traffic runs with the warmer
+off and on, and the report shows how many real runs hit a cold start, their
+latency percentiles, the cold/warm latency recorded in fal_run_seconds, and
+what the keep-alive runs cost at the WORKFLOW_COSTS estimates.
+
+Time is scaled down so a run takes a minute or two; the pauses alternate
+between shorter and longer than --window, so both keep-alive runs (short
+pauses) and pre-warming (long pauses) are exercised.
+
+Examples:
+    python bench_warmer.py
+    python bench_warmer.py --cold-start 4 --idle-timeout 3 --interval 2 --max-cost 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import time
+
+from api_client import FalAPIClient
+from config import PRODUCT_SHOT_TYPES, WORKFLOW_COSTS
+from fal_standin import FalStandIn
+from metrics import FAL_RUN_SECONDS
+from warmer import WorkflowWarmer
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def run_seconds_by_state():
+    """(count, sum) of fal_run_seconds per state, summed over workflows"""
+    totals = {}
+    for (workflow, state), child in FAL_RUN_SECONDS._children.items():
+        count, total = totals.get(state, (0, 0.0))
+        totals[state] = (count + child.count, total + child.sum)
+    return totals
+
+
+async def run_user(client, rng, args, start, latencies):
+    await asyncio.sleep(max(0.0, start - time.monotonic()))
+    # Sending a photo is the hint that a generation is coming
+    client.prewarm()
+    await asyncio.sleep(rng.uniform(*args.think))
+    run_start = time.monotonic()
+    if rng.random() < 0.5:
+        await client.generate_product_image("https://example.com/product.jpg", rng.choice(list(PRODUCT_SHOT_TYPES.values()))["prompt"])
+    else:
+        await client.generate_text_content("https://example.com/product.jpg", "Product Description")
+    latencies.append(time.monotonic() - run_start)
+
+
+async def run_mode(args, enabled):
+    latency = tuple(args.latency)
+    with FalStandIn(latency=latency, seed=args.seed, cold_start=args.cold_start, idle_timeout=args.idle_timeout) as fal:
+        warmer = WorkflowWarmer(
+            fal,
+            enabled=enabled,
+            idle_seconds=args.idle_timeout,
+            interval=args.interval,
+            window=args.window,
+            max_cost_per_hour=args.max_cost
+        )
+        client = FalAPIClient(backend=fal, warmer=warmer)
+        before = run_seconds_by_state()
+        rng = random.Random(args.seed)
+        latencies = []
+        tasks = []
+        burst_start = time.monotonic() + 0.1
+        for burst in range(args.bursts):
+            for _ in range(args.users):
+                tasks.append(run_user(client, rng, args, burst_start + rng.uniform(0, args.burst_seconds), latencies))
+            # Pauses alternate between shorter and longer than the warming window
+            burst_start += args.burst_seconds + (args.short_pause if burst % 2 == 0 else args.long_pause)
+        await asyncio.gather(*tasks)
+        spend = warmer.spent_last_hour()
+        await client.close()
+        after = run_seconds_by_state()
+
+    real_runs = len(latencies)
+    keep_alive_runs = sum(fal.calls.values()) - real_runs
+    by_state = {}
+    for state, (count, total) in after.items():
+        previous_count, previous_total = before.get(state, (0, 0.0))
+        if count > previous_count:
+            by_state[state] = {"runs": count - previous_count, "mean_s": (total - previous_total) / (count - previous_count)}
+    real_cost = sum(
+        WORKFLOW_COSTS[workflow] * count for workflow, count in fal.calls.items()
+    ) - spend
+    return {
+        "warmer": "on" if enabled else "off",
+        "real_runs": real_runs,
+        # A real run waited for a worker to start if it took longer than the slowest warm run
+        "cold_hits": sum(1 for seconds in latencies if seconds > latency[1] + 0.05),
+        "cold_starts": sum(fal.cold_starts.values()),
+        "p50_s": statistics.median(latencies),
+        "p95_s": percentile(latencies, 0.95),
+        "max_s": max(latencies),
+        "by_state": by_state,
+        "keep_alive_runs": keep_alive_runs,
+        "keep_alive_cost": spend,
+        "real_cost": real_cost
+    }
+
+
+def parse_range(value):
+    low, _, high = value.partition("-")
+    return (float(low), float(high or low))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=5, help="Bursts of traffic")
+    parser.add_argument("--users", type=int, default=8, help="Users per burst")
+    parser.add_argument("--burst-seconds", type=float, default=1.5, help="Seconds over which a burst's users arrive")
+    parser.add_argument("--short-pause", type=float, default=5.0, help="Pause after even bursts (shorter than --window)")
+    parser.add_argument("--long-pause", type=float, default=14.0, help="Pause after odd bursts (longer than --window)")
+    parser.add_argument("--think", type=parse_range, default=(1.5, 3.0), help="Seconds between photo and generation")
+    parser.add_argument("--latency", type=parse_range, default=(0.3, 0.8), help="Warm run time range")
+    parser.add_argument("--cold-start", type=float, default=2.5, help="Extra seconds for a run on a cold workflow")
+    parser.add_argument("--idle-timeout", type=float, default=3.0, help="Idle seconds after which a workflow goes cold")
+    parser.add_argument("--interval", type=float, default=2.0, help="FAL_WARM_INTERVAL_SECONDS")
+    parser.add_argument("--window", type=float, default=8.0, help="FAL_WARM_WINDOW_SECONDS")
+    parser.add_argument("--max-cost", type=float, default=2.0, help="FAL_WARM_MAX_COST_PER_HOUR (covers the whole run here)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_warmer.json", help="JSON results file")
+    args = parser.parse_args()
+
+    print(f"🧪 Warm-keeping benchmark: {args.bursts} bursts of {args.users} users, cold start {args.cold_start}s after {args.idle_timeout}s idle")
+    results = []
+    for enabled in (False, True):
+        result = asyncio.run(run_mode(args, enabled))
+        results.append(result)
+
+    print("=" * 78)
+    print(f"{'warmer':8s} {'runs':>5s} {'cold hits':>10s} {'p50 s':>7s} {'p95 s':>7s} {'max s':>7s} {'keep-alives':>12s} {'warm cost':>10s}")
+    for result in results:
+        print(
+            f"{result['warmer']:8s} {result['real_runs']:5d} {result['cold_hits']:10d} {result['p50_s']:7.2f} "
+            f"{result['p95_s']:7.2f} {result['max_s']:7.2f} {result['keep_alive_runs']:12d} {'$' + format(result['keep_alive_cost'], '.2f'):>10s}"
+        )
+    print("=" * 78)
+    print("fal_run_seconds by expected state (mean)")
+    for result in results:
+        states = ", ".join(f"{state} {values['runs']} runs {values['mean_s']:.2f}s" for state, values in sorted(result["by_state"].items()))
+        print(f"   warmer {result['warmer']:4s} {states}")
+    off, on = results
+    print("=" * 78)
+    print(
+        f"{'✅' if on['cold_hits'] < off['cold_hits'] else '⚠️ '} Cold hits {off['cold_hits']} → {on['cold_hits']}, "
+        f"p95 {off['p95_s']:.2f}s → {on['p95_s']:.2f}s, for ${on['keep_alive_cost']:.2f} of keep-alive runs "
+        f"(real runs ${on['real_cost']:.2f})"
+    )
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "settings": {name: value for name, value in vars(args).items() if name != "output"}
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark suite for WatermarkProcessor
+
+Covers download_image mode conversions (P, LA, RGBA, RGB), calculate_watermark_size,
+logo resize, add_watermark at every WATERMARK_POSITIONS value (and with a
+tenant logo from a LogoRegistry), the tiled overlay on its own and JPEG encode,
+on synthetic images from 512px up to 8K. Each case reports wall time, Python
+heap peak (tracemalloc), Pillow image/block allocations and the peak RSS
+growth while it ran. Results are written to JSON; pass --compare with an
+earlier file to see the change per case.
+
+Examples:
+    python bench_watermark.py --output bench_watermark.json
+    python bench_watermark.py --sizes 512,2048 --compare bench_watermark.json
+"""
+
+import argparse
+import io
+import json
+import platform
+import resource
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import PIL
+from PIL import Image
+
+from config import WATERMARK_POSITIONS
+from logo_registry import LogoRegistry
+from watermark import WatermarkProcessor
+
+SIZES = {
+    "512": (512, 512),
+    "1024": (1024, 1024),
+    "2048": (2048, 2048),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320)
+}
+MODES = ("P", "LA", "RGBA", "RGB")
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+class PeakRSS:
+    """Sample RSS from a thread and keep the largest growth over the starting value"""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak_delta = 0
+
+    def __enter__(self):
+        self._start = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_delta = max(self.peak_delta, rss_bytes() - self._start)
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_delta = max(self.peak_delta, rss_bytes() - self._start)
+
+
+def synthetic_image(size, mode):
+    """Gradient plus noise, so encoders see something like a photo"""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    rgb = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if mode == "RGB":
+        return rgb
+    if mode == "P":
+        return rgb.convert("P", palette=Image.Palette.ADAPTIVE)
+    alpha = Image.linear_gradient("L").transpose(Image.Transpose.ROTATE_90).resize(size)
+    if mode == "LA":
+        return Image.merge("LA", (noise, alpha))
+    return Image.merge("RGBA", rgb.split() + (alpha,))
+
+
+def encode(image):
+    buffer = io.BytesIO()
+    if image.mode == "RGB":
+        image.save(buffer, format="JPEG", quality=90)
+    else:
+        image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def measure(func, repeat):
+    """
+    Time a case, then run it once more under tracemalloc and the RSS sampler
+
+    Tracing is kept out of the timed runs so it doesn't inflate them.
+    """
+    func()  # warm-up (Pillow plugin imports, block cache)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    stats_before = Image.core.get_stats()
+    tracemalloc.start()
+    with PeakRSS() as rss:
+        func()
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats_after = Image.core.get_stats()
+
+    return {
+        "ms_min": min(times) * 1000,
+        "ms_median": statistics.median(times) * 1000,
+        "py_peak_kb": py_peak / 1024,
+        "rss_peak_delta_mb": rss.peak_delta / 2**20,
+        "pillow_images": stats_after["new_count"] - stats_before["new_count"],
+        "pillow_blocks_allocated": stats_after["allocated_blocks"] - stats_before["allocated_blocks"]
+    }
+
+
+def cases_for_size(processor, size):
+    """Yield (case, variant, func) for one image size"""
+    for mode in MODES:
+        data = encode(synthetic_image(size, mode))
+        # load() forces the decode, which Image.open defers for RGB input
+        yield "download_image", mode, lambda data=data: processor.download_image(data).load()
+
+    base = synthetic_image(size, "RGB")
+    yield "calculate_watermark_size", "-", lambda: processor.calculate_watermark_size(base)
+
+    watermark_size = processor.calculate_watermark_size(base)
+    yield "logo_resize", f"{watermark_size[0]}x{watermark_size[1]}", lambda: processor.logo.resize(watermark_size, Image.Resampling.LANCZOS)
+
+    jpeg = encode(base)
+    for position in WATERMARK_POSITIONS.values():
+        yield "add_watermark", position["value"], lambda value=position["value"]: processor.add_watermark(jpeg, position=value)
+    yield "add_watermark", "bottom-right@0.5", lambda: processor.add_watermark(jpeg, position="bottom-right", opacity=0.5)
+    if processor.registry is not None:
+        # Should match the default logo: both resize from a cached pyramid
+        yield "add_watermark", "bottom-right/tenant", lambda: processor.add_watermark(jpeg, position="bottom-right", tenant="bench")
+    yield "tiled_overlay", "-", lambda: processor.tiled_overlay(base)
+
+    def jpeg_encode():
+        buffer = io.BytesIO()
+        base.save(buffer, format="JPEG", quality=95)
+        return buffer
+
+    yield "jpeg_encode", "q95", jpeg_encode
+
+
+def tiled_cost(results):
+    """add_watermark time of the tiled mode relative to a single bottom-right logo, per size"""
+    times = {(r["size"], r["variant"]): r["ms_median"] for r in results if r["case"] == "add_watermark"}
+    return {
+        size: times[(size, "tiled")] / times[(size, "bottom-right")]
+        for size, variant in times if variant == "tiled" and times.get((size, "bottom-right"))
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["case"], r["size"], r["variant"]): r for r in json.load(f)["results"]}
+    print("=" * 86)
+    print(f"Compared with {baseline_path} (median time, ratio < 1 is faster)")
+    print(f"{'case':26s} {'size':>6s} {'variant':18s} {'before ms':>10s} {'after ms':>10s} {'ratio':>7s}")
+    for result in results:
+        previous = baseline.get((result["case"], result["size"], result["variant"]))
+        if previous:
+            ratio = result["ms_median"] / previous["ms_median"] if previous["ms_median"] else float("nan")
+            print(
+                f"{result['case']:26s} {result['size']:>6s} {result['variant']:18s} "
+                f"{previous['ms_median']:10.2f} {result['ms_median']:10.2f} {ratio:7.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"Comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--logo", default="logo.png")
+    parser.add_argument("--output", default="bench_watermark.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    # Let 8K images through Pillow's decompression bomb check
+    Image.MAX_IMAGE_PIXELS = None
+    # A tenant with its own copy of the logo, stored in a throwaway registry
+    registry = LogoRegistry(tempfile.mkdtemp(prefix="bench_logos_"))
+    processor = WatermarkProcessor(args.logo, registry=registry)
+    if processor.logo is None:
+        raise SystemExit(f"❌ Logo not found: {args.logo}")
+    with open(args.logo, "rb") as f:
+        registry.put("bench", f.read())
+
+    print(f"🧪 Watermark benchmark (Pillow {PIL.__version__}, best of {args.repeat})")
+    print("=" * 86)
+    print(f"{'case':26s} {'size':>6s} {'variant':18s} {'min ms':>9s} {'median ms':>10s} {'py KB':>8s} {'RSS MB':>7s}")
+    results = []
+    for label in args.sizes.split(","):
+        size = SIZES[label]
+        for case, variant, func in cases_for_size(processor, size):
+            result = {"case": case, "size": label, "width": size[0], "height": size[1], "variant": variant}
+            result.update(measure(func, args.repeat))
+            results.append(result)
+            print(
+                f"{case:26s} {label:>6s} {variant:18s} {result['ms_min']:9.2f} {result['ms_median']:10.2f} "
+                f"{result['py_peak_kb']:8.0f} {result['rss_peak_delta_mb']:7.1f}"
+            )
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("=" * 86)
+    ratios = tiled_cost(results)
+    if ratios:
+        print("Tiled watermark vs one logo (add_watermark median): " + ", ".join(f"{size} {ratio:.2f}x" for size, ratio in ratios.items()))
+    print(f"💾 Results saved to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
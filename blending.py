@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+NumPy alpha blending backend for watermark compositing
+
+The logo is resized and premultiplied by its alpha (and the requested
+opacity) once; blending is then a single vectorized expression over a view
+of the base image region, with no mode conversions of the full image:
+
+    out = base * inverse_alpha + logo_premultiplied
+
+Several positions, or a stack of same-sized images, are blended in one call.
+NumPy is optional: check ``AVAILABLE`` before using this module. It is only
+imported on first use, so the Pillow backend doesn't pay for it at startup.
+"""
+
+import importlib.util
+
+from PIL import Image
+
+# Checked without importing NumPy, which takes ~100 ms
+AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+
+def load_numpy():
+    """Import NumPy on first use and return the module"""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+class PremultipliedLogo:
+    def __init__(self, logo, opacity=1.0):
+        """
+        Premultiply an RGBA logo for blending
+
+        Args:
+            logo (PIL.Image): RGBA logo, already resized to its final size
+            opacity (float): Extra opacity factor (0.0 to 1.0)
+        """
+        np = load_numpy()
+        rgba = np.asarray(logo.convert("RGBA"), dtype=np.float32)
+        # Truncate like the Pillow path (alpha.point(lambda x: int(x * opacity)))
+        alpha = np.floor(rgba[..., 3:4] * opacity) / 255.0
+        # The Pillow path pastes onto an RGBA copy, which also blends the alpha
+        # channel to 1 - a + a², then flattens onto white with it. Folding that
+        # into the coefficients keeps both backends pixel-identical:
+        #   out = base * flat * (1 - a) + flat * a * logo + 255 * (1 - flat)
+        flat = 1.0 - alpha + alpha * alpha
+        self.alpha = alpha
+        self.inverse_alpha = flat * (1.0 - alpha)
+        self.premultiplied = flat * alpha * rgba[..., :3] + 255.0 * (1.0 - flat)
+        self.height, self.width = rgba.shape[:2]
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+
+def _clip(logo, x, y, height, width):
+    """Region of the base and logo slices that overlap when the logo sits at (x, y)"""
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + logo.width, width), min(y + logo.height, height)
+    if left >= right or top >= bottom:
+        return None
+    return (
+        (slice(top, bottom), slice(left, right)),
+        (slice(top - y, bottom - y), slice(left - x, right - x))
+    )
+
+
+def blend(base, logo, positions):
+    """
+    Blend the logo into an image array in place
+
+    Args:
+        base (numpy.ndarray): uint8 array of shape (H, W, 3), or (N, H, W, 3)
+            for a batch of same-sized images that get the same positions
+        logo (PremultipliedLogo): Prepared logo
+        positions (list): (x, y) top-left corners; parts outside the image are clipped
+
+    Returns:
+        numpy.ndarray: ``base``, modified in place
+    """
+    np = load_numpy()
+    height, width = base.shape[-3], base.shape[-2]
+    for x, y in positions:
+        clipped = _clip(logo, x, y, height, width)
+        if clipped is None:
+            continue
+        (rows, cols), (logo_rows, logo_cols) = clipped
+        region = base[..., rows, cols, :]
+        blended = region * logo.inverse_alpha[logo_rows, logo_cols] + logo.premultiplied[logo_rows, logo_cols]
+        region[...] = (blended + 0.5).astype(np.uint8)
+    return base
+
+
+def blend_images(images, logo, positions):
+    """
+    Blend the logo into several PIL images
+
+    Images of the same size are stacked and blended in one vectorized call.
+
+    Args:
+        images (list): RGB PIL images
+        logo (PremultipliedLogo): Prepared logo
+        positions (list): (x, y) corners applied to every image
+
+    Returns:
+        list: New RGB PIL images in the input order
+    """
+    np = load_numpy()
+    results = [None] * len(images)
+    by_size = {}
+    for index, image in enumerate(images):
+        by_size.setdefault(image.size, []).append(index)
+    for indices in by_size.values():
+        stack = np.stack([np.asarray(images[index].convert("RGB")) for index in indices])
+        blend(stack, logo, positions)
+        for index, array in zip(indices, stack):
+            results[index] = Image.fromarray(array)
+    return results
@@ -1,39 +1,390 @@
+import time
+
+# Startup is measured from here to the moment polling starts
+_IMPORT_START = time.perf_counter()
+
 import logging
 import asyncio
-import requests
+import os
 import io
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import signal
+import threading
+from telegram import Update, InlineKeyboardButton
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
 from telegram.constants import ParseMode
 
-from config import TELEGRAM_TOKEN, PRODUCT_SHOT_TYPES, TEXT_CONTENT_TYPES, WATERMARK_POSITIONS
-from api_client import FalAPIClient
-from watermark import WatermarkProcessor
-
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from config import (
+    TELEGRAM_TOKEN,
+    PRODUCT_SHOT_TYPES,
+    TEXT_CONTENT_TYPES,
+    WATERMARK_POSITIONS,
+    TEXT_PROMPT_TEMPLATE,
+    CONTENT_PACK_TYPES,
+    PIPELINE_PRESETS,
+    TIERED_RENDER_MODE,
+    DRAFT_RENDER,
+    FINAL_RENDER,
+    PHASH_MAX_DISTANCE,
+    PHASH_INDEX_MAX_ENTRIES,
+    METRICS_PORT,
+    TRACE_FILE,
+    TRACE_SAMPLE_RATE,
+    RECORD_FILE,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_FILE,
+    LOG_MAX_FIELD_CHARS,
+    LOG_SAMPLE_RATES,
+    CONCURRENT_UPDATES,
+    CALLBACK_DEDUPE_SIZE,
+    SHUTDOWN_DRAIN_SECONDS,
+    PENDING_JOBS_FILE,
+    CONTENT_CREATOR_WORKFLOW,
+    VISION_SPECIALIST_WORKFLOW,
+    ADMIN_USER_IDS,
+    STATS_PROFILE_SECONDS,
+    STATS_MAX_PROFILE_SECONDS,
+    STATS_TOP_N
+)
+import tracing
+import recording
+from async_logging import setup_logging, parse_sample_rates
+from tracing import trace_update, run_in_context, span
+from callback_guard import CallbackGuard, guard_action, callback_action, versioned_markup
+from jobs import JobTracker
+from resilience import CircuitOpenError
+from metrics import (
+    start_metrics_server,
+    TELEGRAM_FILE_RESOLVE_SECONDS,
+    TELEGRAM_UPLOAD_SECONDS,
+    IMAGE_DOWNLOAD_SECONDS,
+    TIME_TO_FIRST_IMAGE_SECONDS,
+    ERRORS_TOTAL,
+    SESSIONS,
+    STARTUP_SECONDS,
+    RESUMED_JOBS_TOTAL,
+    JOBS_IN_FLIGHT,
+    DUPLICATE_ACTIONS_AVOIDED_TOTAL,
+    LOGO_CACHE_REQUESTS_TOTAL,
+    IMAGE_INDEX_LOOKUPS_TOTAL
 )
+
 logger = logging.getLogger(__name__)
 
 # Conversation states
-CHOOSING_OPTION, CHOOSING_SHOT_TYPE, CHOOSING_TEXT_TYPE, WAITING_FOR_TEXT_PROMPT, CHOOSING_WATERMARK_POSITION, ASKING_WATERMARK = range(6)
+CHOOSING_OPTION, CHOOSING_SHOT_TYPE, CHOOSING_TEXT_TYPE, WAITING_FOR_TEXT_PROMPT, CHOOSING_WATERMARK_POSITION, ASKING_WATERMARK, WAITING_FOR_LOGO = range(7)
+
+# Marker stored as content_type while waiting for a content pack brief
+CONTENT_PACK = "content_pack"
+
+# Product images: photos, plus animated GIF/WebP sent as files (Telegram
+# recompresses photos to a single JPEG frame)
+PRODUCT_IMAGE = filters.PHOTO | filters.Document.MimeType("image/gif") | filters.Document.MimeType("image/webp")
+
+def main_menu_markup(version):
+    """Inline keyboard with the main options shown after every action, stamped with a session version."""
+    keyboard = [
+        [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
+        [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
+        [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
+        [InlineKeyboardButton("⚡ پیش‌تنظیم‌های سریع", callback_data="presets")],
+        [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
+    ]
+    return versioned_markup(keyboard, version)
+
+# The heavy subsystems (fal_client, requests, Pillow, NumPy) are imported by
+# these factories on first use, so polling starts without waiting for them
+
+def new_api_client():
+    from api_client import FalAPIClient
+    return FalAPIClient()
+
+def new_watermark_processor():
+    from logo_registry import LogoRegistry
+    from watermark import WatermarkProcessor
+    return WatermarkProcessor(registry=LogoRegistry())
+
+def new_image_index():
+    from image_index import PerceptualHashIndex
+    return PerceptualHashIndex(
+        max_distance=PHASH_MAX_DISTANCE,
+        max_entries=PHASH_INDEX_MAX_ENTRIES
+    )
 
 class ContentCreatorBot:
-    def __init__(self):
-        self.api_client = FalAPIClient()
-        self.watermark_processor = WatermarkProcessor()
+    def __init__(self, api_client=None, watermark_processor=None):
+        """
+        Args:
+            api_client (FalAPIClient): Client for the fal workflows; defaults to
+                the real service (pass one backed by a FalStandIn for local runs)
+            watermark_processor (WatermarkProcessor): Defaults to logo.png, with
+                per-user logos from a LogoRegistry
+        
+        Subsystems that aren't passed in are created on first use, or by
+        warm_up() in the background once polling has started.
+        """
+        self._api_client = api_client
+        self._watermark_processor = watermark_processor
+        self._image_index = None
+        self._init_lock = threading.Lock()
+        self.warm_up_future = None
+        self.resume_future = None
+        self.drain_future = None
+        self.executor = None  # the event loop's default executor, set by on_startup()
+        self.metrics_server = None
         self.user_data = {}  # Store user data temporarily
+        
+        # Drops duplicate taps, stale buttons and taps while an action is running
+        self.callback_guard = CallbackGuard(self.session_version, max_seen_queries=CALLBACK_DEDUPE_SIZE)
+        
+        # Running generations, drained on shutdown and resumed after a restart
+        self.jobs = JobTracker(PENDING_JOBS_FILE, SHUTDOWN_DRAIN_SECONDS)
+        
+        # One /stats profile at a time; profiles of overlapping windows would disturb each other
+        self.profile_lock = asyncio.Lock()
+        
+        # Session store size is read when metrics are scraped
+        SESSIONS.set_function(lambda: len(self.user_data))
+    
+    def _subsystem(self, attribute, factory):
+        """Create a subsystem once, from whichever thread needs it first."""
+        value = getattr(self, attribute)
+        if value is None:
+            with self._init_lock:
+                value = getattr(self, attribute)
+                if value is None:
+                    start = time.perf_counter()
+                    value = factory()
+                    setattr(self, attribute, value)
+                    logger.info(f"Initialized {attribute.lstrip('_')} in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return value
+    
+    @property
+    def api_client(self):
+        return self._subsystem("_api_client", new_api_client)
+    
+    @property
+    def watermark_processor(self):
+        return self._subsystem("_watermark_processor", new_watermark_processor)
+    
+    @property
+    def image_index(self):
+        return self._subsystem("_image_index", new_image_index)
+    
+    def warm_up(self):
+        """Import and create every subsystem, so the first update doesn't pay for it."""
+        start = time.perf_counter()
+        try:
+            self.api_client
+            self.watermark_processor
+            self.image_index
+            import pipeline, requests  # noqa: F401 (used by presets and image delivery)
+        except Exception as e:
+            logger.error(f"Warm-up failed, subsystems will load on first use: {e}")
+            return
+        seconds = time.perf_counter() - start
+        STARTUP_SECONDS.labels(phase="warm_up").set(seconds)
+        logger.info(f"Warm-up finished in {seconds * 1000:.0f} ms", extra={"event": "startup.warm_up", "warm_up_ms": round(seconds * 1000, 1)})
     
+    async def ready(self):
+        """
+        Wait until the subsystems exist, without blocking the event loop.
+        
+        Coroutines call this before touching api_client, watermark_processor or
+        image_index: the properties take _init_lock, which warm_up() holds while
+        it builds them, so touching them from the event loop mid warm-up would
+        stall every update. Whatever warm-up didn't build (it failed, or never
+        ran) is built in a worker thread.
+        """
+        if self.warm_up_future is not None and not self.warm_up_future.done():
+            # Shielded: a cancelled handler mustn't cancel the warm-up others wait for
+            await asyncio.shield(self.warm_up_future)
+        if None in (self._api_client, self._watermark_processor, self._image_index):
+            await asyncio.get_running_loop().run_in_executor(None, self.warm_up)
+    
+    async def on_startup(self, application):
+        """post_init hook: warm up in a worker thread while polling starts, and take over shutdown."""
+        ready = time.perf_counter() - _IMPORT_START
+        STARTUP_SECONDS.labels(phase="ready").set(ready)
+        logger.info(f"Ready to poll {ready * 1000:.0f} ms after import", extra={"event": "startup.ready", "ready_ms": round(ready * 1000, 1)})
+        
+        # Our own default executor, so /stats can report how busy it is
+        from diagnostics import TrackedExecutor
+        
+        loop = asyncio.get_running_loop()
+        self.executor = TrackedExecutor(thread_name_prefix="worker")
+        loop.set_default_executor(self.executor)
+        self.warm_up_future = loop.run_in_executor(None, self.warm_up)
+        
+        # Stop signals drain running jobs before polling stops (run() disables
+        # python-telegram-bot's own handlers, which stop right away)
+        try:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, self.request_shutdown, application)
+        except (NotImplementedError, ValueError) as e:
+            logger.warning(f"Could not install stop signal handlers, running jobs won't be drained: {e}")
+        
+        # Jobs the previous run didn't get to finish
+        records = self.jobs.load()
+        if records:
+            logger.info(f"Resuming {len(records)} jobs from the last shutdown", extra={"event": "shutdown.resume", "jobs": len(records)})
+            self.resume_future = asyncio.ensure_future(self.resume_jobs(application, records))
+    
+    def request_shutdown(self, application):
+        """Stop signal handler: refuse new work, drain running jobs and stop polling."""
+        if self.drain_future is not None:
+            # A second signal doesn't wait for the deadline
+            logger.warning("Second stop signal, interrupting running jobs now")
+            self.jobs.hurry()
+            return
+        
+        logger.info(
+            f"Stop signal received, draining {len(self.jobs)} running jobs for up to {self.jobs.drain_seconds:.0f}s",
+            extra={"event": "shutdown.start", "jobs": len(self.jobs)}
+        )
+        self.callback_guard.close()
+        self.drain_future = asyncio.ensure_future(self.jobs.drain())
+        # Polling stops now; Application.stop() then waits for the handlers the drain lets finish
+        application.stop_running()
+    
+    async def on_stop(self, application):
+        """post_stop hook: save the jobs the drain interrupted."""
+        if self.drain_future is None:
+            # Stopped by something other than a signal
+            self.callback_guard.close()
+            self.drain_future = asyncio.ensure_future(self.jobs.drain())
+        self.jobs.save(await self.drain_future)
+    
+    async def on_shutdown(self, application):
+        """post_shutdown hook: close pooled connections and worker threads."""
+        if self._api_client is not None:
+            await self._api_client.close()
+        if self._watermark_processor is not None:
+            self._watermark_processor.encoder.close()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        # Flush sampled traces and the traffic recording
+        tracing.configure("", 0)
+        recording.configure("")
+    
+    async def resume_jobs(self, application, records):
+        """Run saved jobs again once the subsystems are warm."""
+        await self.ready()
+        context = application.context_types.context(application)
+        await asyncio.gather(*(self.resume_job(context, record) for record in records))
+    
+    async def resume_job(self, context, record):
+        """
+        Finish a job interrupted by the last shutdown
+        
+        Results produced before the shutdown are sent as they are; other jobs
+        are run again from their saved arguments (the user's session is gone).
+        
+        Args:
+            context: Context not tied to an update (only context.bot is used)
+            record (dict): Saved job, see Job.to_record()
+        """
+        user_id, kind, args, result = record["user_id"], record["kind"], record["args"], record.get("result")
+        job = self.jobs.start(user_id, kind, **args)
+        job.result = result
+        outcome = "error"
+        try:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="⏳ ربات دوباره راه‌اندازی شد. درخواست قبلی شما در حال تکمیل است..."
+            )
+            if kind == "shot":
+                shot_info = PRODUCT_SHOT_TYPES[args["shot_id"]]
+                if result:
+                    await self.send_generated_image(
+                        context, user_id, result,
+                        f"✅ تصویر {shot_info['name']} تولید شد!",
+                        f"generated_image_{args['shot_id']}.jpg"
+                    )
+                else:
+                    image_url = await self.job_image_url(context, args)
+                    await self.render_final(context, user_id, args["shot_id"], image_url)
+            elif kind == "text":
+                if result:
+                    await context.bot.send_message(
+                        chat_id=user_id,
+                        text=f"✅ محتوای {args['content_type']} تولید شد:\n\n{result}"
+                    )
+                else:
+                    image_url = await self.job_image_url(context, args)
+                    await self.send_text_content(context, user_id, image_url, args["content_type"], args["user_prompt"])
+            elif kind == "content_pack":
+                user_data = {"image_url": await self.job_image_url(context, args), "pack_delivery": args["delivery"]}
+                await self.send_content_pack(context, user_id, user_data, args["user_prompt"])
+            elif kind == "preset":
+                await self.run_preset(context, user_id, args["preset_id"], await self.job_image_url(context, args))
+            elif kind == "watermark":
+                await self.send_watermarked_image(context, user_id, await self.job_image_url(context, args), args["pos_id"])
+            else:
+                raise ValueError(f"Unknown job kind {kind!r}")
+            outcome = "ok"
+        except asyncio.CancelledError:
+            # Shut down again; the job is saved once more
+            outcome = "interrupted"
+            raise
+        except Exception as e:
+            logger.error(f"Error resuming {kind} job for user {user_id}: {e}")
+            ERRORS_TOTAL.labels(stage="resume").inc()
+        finally:
+            self.jobs.finish(job)
+            RESUMED_JOBS_TOTAL.labels(kind=kind, outcome=outcome).inc()
+    
+    def job_image(self, user_id, image_url):
+        """
+        Job argument naming an image to run a job on again after a restart
+        
+        The user's own photo is saved by its Telegram file id: its URL
+        contains the bot token and expires within the hour. Other images
+        (generated ones) are saved by their URL.
+        
+        Returns:
+            dict: {"file_id": ...} or {"image_url": ...}
+        """
+        session = self.user_data.get(user_id, {})
+        if session.get("file_id") and image_url == session.get("image_url"):
+            return {"file_id": session["file_id"]}
+        return {"image_url": image_url}
+    
+    async def job_image_url(self, context, args):
+        """Current URL of the image saved by job_image()"""
+        if "file_id" not in args:
+            return args["image_url"]
+        with TELEGRAM_FILE_RESOLVE_SECONDS.time(), span("telegram.get_file"):
+            file = await context.bot.get_file(args["file_id"])
+        return file.file_path
+    
+    def session_version(self, user_id):
+        """Version stamped on the user's buttons, or None if there is no session."""
+        return self.user_data.get(user_id, {}).get("session")
+    
+    def markup(self, user_id, keyboard):
+        """Inline keyboard whose buttons are only valid for the user's current session."""
+        return versioned_markup(keyboard, self.session_version(user_id))
+    
+    def hash_image(self, image_url):
+        """Compute the perceptual hash of an image, or None if it can't be loaded."""
+        from image_index import compute_phash
+        
+        image = self.watermark_processor.download_image(image_url)
+        if image is None:
+            return None
+        return compute_phash(image)
+    
+    @trace_update
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Send a message when the command /start is issued."""
         welcome_message = """
@@ -43,20 +394,47 @@ class ContentCreatorBot:
         """
         await update.message.reply_text(welcome_message, parse_mode=ParseMode.MARKDOWN)
     
+    @trace_update
     async def handle_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming product images and show options."""
         user_id = update.message.from_user.id
         
-        # Get the largest photo
-        photo = update.message.photo[-1]
-        file_id = photo.file_id
+        # Get the largest photo; animated GIF/WebP arrive as files so they stay animated
+        if update.message.document:
+            file_id = update.message.document.file_id
+        else:
+            file_id = update.message.photo[-1].file_id
         
         # Get file info to get the file URL
-        file = await context.bot.get_file(file_id)
+        with TELEGRAM_FILE_RESOLVE_SECONDS.time(), span("telegram.get_file"):
+            file = await context.bot.get_file(file_id)
         file_url = file.file_path
         
+        # A generation usually follows a new photo; start cold workflows while the user chooses
+        await self.ready()
+        self.api_client.prewarm()
+        
+        # Hash the image so near-duplicate uploads can reuse earlier results
+        loop = asyncio.get_running_loop()
+        try:
+            phash = await loop.run_in_executor(None, run_in_context(self.hash_image, file_url))
+        except Exception as e:
+            logger.error(f"Error hashing image: {e}")
+            ERRORS_TOTAL.labels(stage="image_hash").inc()
+            phash = None
+        
+        # A new photo means the user has moved on from any pending upgrade
+        self.cancel_upgrade(user_id)
+        
         # Clear any previous conversation state and store the new image URL
-        self.user_data[user_id] = {"image_url": file_url}
+        # A new session version invalidates the buttons sent for earlier photos
+        # The file id is kept for saved jobs: the URL contains the bot token and expires
+        self.user_data[user_id] = {
+            "image_url": file_url,
+            "file_id": file_id,
+            "phash": phash,
+            "session": self.callback_guard.new_session()
+        }
         
         # Send confirmation message
         await update.message.reply_text(
@@ -64,13 +442,7 @@ class ContentCreatorBot:
         )
         
         # Create inline keyboard for main options
-        keyboard = [
-            [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-            [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-            [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-            [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = main_menu_markup(self.session_version(user_id))
         
         await update.message.reply_text(
             "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
@@ -79,14 +451,17 @@ class ContentCreatorBot:
         
         return CHOOSING_OPTION
     
+    @trace_update
+    @guard_action
     async def handle_option_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle user's choice between product image or text content."""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
+        data = callback_action(query.data)
         
-        if query.data == "product_image":
+        if data == "product_image":
             # Preserve the image URL if it exists
             if user_id not in self.user_data:
                 self.user_data[user_id] = {}
@@ -99,14 +474,14 @@ class ContentCreatorBot:
             # Add back button
             keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")])
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = self.markup(user_id, keyboard)
             await query.edit_message_text(
                 "لطفاً نوع شات محصول را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_SHOT_TYPE
             
-        elif query.data == "text_content":
+        elif data == "text_content":
             # Preserve the image URL if it exists
             if user_id not in self.user_data:
                 self.user_data[user_id] = {}
@@ -116,32 +491,30 @@ class ContentCreatorBot:
             for content_type in TEXT_CONTENT_TYPES:
                 keyboard.append([InlineKeyboardButton(content_type, callback_data=f"text_{content_type}")])
             
+            # Full content pack: every text type from one brief
+            keyboard.append([InlineKeyboardButton("📦 بسته کامل محتوا (پیام‌های جداگانه)", callback_data="content_pack_messages")])
+            keyboard.append([InlineKeyboardButton("📄 بسته کامل محتوا (یک فایل)", callback_data="content_pack_document")])
+            
             # Add back button
             keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")])
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = self.markup(user_id, keyboard)
             await query.edit_message_text(
                 "لطفاً نوع محتوای متنی را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_TEXT_TYPE
         
-        elif query.data == "back_to_main":
+        elif data == "back_to_main":
             # Go back to main menu
-            keyboard = [
-                [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-                [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-                [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = main_menu_markup(self.session_version(user_id))
             await query.edit_message_text(
                 "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_OPTION
         
-        elif query.data == "watermark":
+        elif data == "watermark":
             # Show watermark position options
             keyboard = []
             for pos_id, pos_info in WATERMARK_POSITIONS.items():
@@ -150,16 +523,51 @@ class ContentCreatorBot:
             # Add back button
             keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")])
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = self.markup(user_id, keyboard)
             await query.edit_message_text(
                 "لطفاً موقعیت واترمارک را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_WATERMARK_POSITION
         
-        elif query.data == "back_to_start":
+        elif data == "presets":
+            # Show one-tap presets that chain generation, watermark and text
+            keyboard = []
+            for preset_id, preset in PIPELINE_PRESETS.items():
+                keyboard.append([InlineKeyboardButton(preset["name"], callback_data=f"preset_{preset_id}")])
+            
+            # Add back button
+            keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")])
+            
+            reply_markup = self.markup(user_id, keyboard)
+            await query.edit_message_text(
+                "لطفاً یکی از پیش‌تنظیم‌ها را انتخاب کنید:",
+                reply_markup=reply_markup
+            )
+            return CHOOSING_OPTION
+        
+        elif data.startswith("preset_"):
+            preset_id = data.replace("preset_", "", 1)
+            image_url = self.user_data.get(user_id, {}).get("image_url")
+            
+            if preset_id not in PIPELINE_PRESETS or not image_url:
+                await query.edit_message_text("❌ خطا: تصویر محصول یافت نشد. لطفاً دوباره تصویر را ارسال کنید.")
+                return ConversationHandler.END
+            
+            await query.edit_message_text("🔄 در حال اجرای پیش‌تنظیم... لطفاً صبر کنید.")
+            await self.run_preset(context, user_id, preset_id, image_url)
+            
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
+                reply_markup=main_menu_markup(self.session_version(user_id))
+            )
+            return CHOOSING_OPTION
+        
+        elif data == "back_to_start":
             # Clean up user data and go back to start
             user_id = query.from_user.id
+            self.cancel_upgrade(user_id)
             if user_id in self.user_data:
                 del self.user_data[user_id]
             
@@ -169,54 +577,97 @@ class ContentCreatorBot:
             )
             return ConversationHandler.END
     
+    @trace_update
+    @guard_action
     async def handle_shot_type_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle product shot type selection and generate image."""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
+        data = callback_action(query.data)
         
         # Handle back button
-        if query.data == "back_to_main":
+        if data == "back_to_main":
             # Go back to main menu
-            keyboard = [
-                [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-                [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = main_menu_markup(self.session_version(user_id))
             await query.edit_message_text(
                 "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_OPTION
         
-        shot_id = query.data.replace("shot_", "")
+        # Reuse/regenerate buttons are offered when a near-duplicate image was seen before
+        if data.startswith("reuse_shot_"):
+            shot_id = data.replace("reuse_shot_", "", 1)
+            reuse_mode = "reuse"
+        elif data.startswith("regen_shot_"):
+            shot_id = data.replace("regen_shot_", "", 1)
+            reuse_mode = "regenerate"
+        else:
+            shot_id = data.replace("shot_", "")
+            reuse_mode = None
         
         if shot_id in PRODUCT_SHOT_TYPES:
             shot_info = PRODUCT_SHOT_TYPES[shot_id]
             image_url = self.user_data.get(user_id, {}).get("image_url")
+            phash = self.user_data.get(user_id, {}).get("phash")
             
             if not image_url:
                 await query.edit_message_text("❌ خطا: تصویر محصول یافت نشد. لطفاً دوباره تصویر را ارسال کنید.")
                 return ConversationHandler.END
             
+            await self.ready()
+            previous_image_url = None
+            if phash is not None and reuse_mode != "regenerate":
+                previous_image_url = self.image_index.find(user_id, phash, "shot", shot_id)
+            
+            if previous_image_url and reuse_mode is None:
+                # Offer the earlier result before paying for a new generation
+                keyboard = [
+                    [InlineKeyboardButton("♻️ استفاده از نتیجه قبلی", callback_data=f"reuse_shot_{shot_id}")],
+                    [InlineKeyboardButton("🔄 تولید تصویر جدید", callback_data=f"regen_shot_{shot_id}")],
+                    [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")]
+                ]
+                reply_markup = self.markup(user_id, keyboard)
+                await query.edit_message_text(
+                    f"♻️ برای تصویر مشابهی قبلاً {shot_info['name']} تولید شده است. از نتیجه قبلی استفاده شود؟",
+                    reply_markup=reply_markup
+                )
+                return CHOOSING_SHOT_TYPE
+            
+            # A new generation supersedes any upgrade still running for this user
+            self.cancel_upgrade(user_id)
+            tiered = TIERED_RENDER_MODE != "off" and reuse_mode != "reuse"
+            start_time = time.perf_counter()
+            
             # Show processing message
-            await query.edit_message_text("🔄 در حال تولید تصویر محصول... لطفاً صبر کنید.")
+            if tiered:
+                await query.edit_message_text("🔄 در حال تولید پیش‌نمایش سریع... لطفاً صبر کنید.")
+            else:
+                await query.edit_message_text("🔄 در حال تولید تصویر محصول... لطفاً صبر کنید.")
             
+            # Saved and resumed if the bot shuts down before the image is sent
+            job = self.jobs.start(user_id, "shot", shot_id=shot_id, **self.job_image(user_id, image_url))
+            success = False
             try:
-                # Call the API
-                result = await self.api_client.generate_product_image(
-                    image_url=image_url,
-                    shot_type=shot_info["prompt"]
-                )
-                
-                # Debug: Log the result
-                logger.info(f"API Result: {result}")
+                if reuse_mode == "reuse" and previous_image_url:
+                    result = {"images": [{"url": previous_image_url}]}
+                else:
+                    # Call the API, with the fast draft settings first in tiered mode
+                    result = await self.api_client.generate_product_image(
+                        image_url=image_url,
+                        shot_type=shot_info["prompt"],
+                        **(DRAFT_RENDER if tiered else FINAL_RENDER)
+                    )
+                    
+                    # Debug: Log the result
+                    logger.info("API Result", extra={"event": "fal.result", "workflow": "content_creator", "payload": result})
                 
                 if result and result.get("images") and len(result["images"]) > 0:
                     # Store the generated image URL for watermarking
                     generated_image_url = result["images"][0]["url"]
+                    job.result = generated_image_url
                     logger.info(f"Generated image URL: {generated_image_url}")
                     
                     # Store the generated image URL in user data
@@ -225,49 +676,43 @@ class ContentCreatorBot:
                     self.user_data[user_id]["generated_image_url"] = generated_image_url
                     self.user_data[user_id]["shot_info"] = shot_info
                     
-                    try:
-                        # Download the image first
-                        response = requests.get(generated_image_url, timeout=30)
-                        response.raise_for_status()
-                        
-                        # Create a file-like object from the image data
-                        image_data = io.BytesIO(response.content)
-                        image_data.name = f"generated_image_{shot_id}.jpg"
-                        
-                        # Send the image as a file
-                        await context.bot.send_photo(
-                            chat_id=user_id,
-                            photo=image_data,
-                            caption=f"✅ تصویر {shot_info['name']} تولید شد!"
-                        )
-                        success = True
-                        
-                    except Exception as img_error:
-                        logger.error(f"Error downloading/sending image: {img_error}")
-                        # If downloading fails, send the URL as text
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=f"✅ تصویر {shot_info['name']} تولید شد!\n\n🔗 لینک تصویر: {generated_image_url}"
-                        )
-                        success = True
+                    # Remember the result for near-duplicate uploads (drafts are never reused)
+                    if phash is not None and not tiered:
+                        self.image_index.record(user_id, phash, "shot", shot_id, generated_image_url)
+                    
+                    if not tiered:
+                        caption = f"✅ تصویر {shot_info['name']} تولید شد!"
+                    elif TIERED_RENDER_MODE == "auto":
+                        caption = f"👀 پیش‌نمایش سریع {shot_info['name']} — نسخه با کیفیت بالا در حال آماده‌سازی است..."
+                    else:
+                        caption = f"👀 پیش‌نمایش سریع {shot_info['name']} — برای نسخه با کیفیت بالا از دکمه زیر استفاده کنید."
+                    
+                    await self.send_generated_image(context, user_id, generated_image_url, caption, f"generated_image_{shot_id}.jpg")
+                    self.record_time_to_first_image("draft" if tiered else "final", time.perf_counter() - start_time)
+                    success = True
+                    
+                    if tiered and TIERED_RENDER_MODE == "auto":
+                        self.start_upgrade(context, user_id, shot_id, image_url)
                 else:
-                    logger.warning(f"No valid result from API: {result}")
+                    logger.warning("No valid result from API", extra={"event": "fal.invalid_result", "payload": result})
                     await context.bot.send_message(
                         chat_id=user_id,
                         text="❌ خطا در تولید تصویر. لطفاً دوباره تلاش کنید."
                     )
-                    success = False
                     
+            except CircuitOpenError as e:
+                await self.send_unavailable(context, user_id, e)
             except Exception as e:
                 logger.error(f"Error generating product image: {e}")
+                ERRORS_TOTAL.labels(stage="product_image").inc()
                 await context.bot.send_message(
                     chat_id=user_id,
                     text="❌ خطا در تولید تصویر. لطفاً دوباره تلاش کنید."
                 )
-                success = False
+            finally:
+                self.jobs.finish(job)
             
             # Add a small delay to ensure image is sent first
-            import asyncio
             await asyncio.sleep(1)
             
             # Ask if user wants to add watermark
@@ -275,7 +720,9 @@ class ContentCreatorBot:
                 [InlineKeyboardButton("✅ بله، واترمارک اضافه کن", callback_data="watermark_yes")],
                 [InlineKeyboardButton("❌ نه، همین کافی است", callback_data="watermark_no")]
             ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            if success and tiered and TIERED_RENDER_MODE == "offer":
+                keyboard.insert(0, [InlineKeyboardButton("✨ تولید نسخه با کیفیت بالا", callback_data=f"upgrade_shot_{shot_id}")])
+            reply_markup = self.markup(user_id, keyboard)
             await context.bot.send_message(
                 chat_id=user_id,
                 text="🔒 آیا می‌خواهید واترمارک به این تصویر اضافه کنید؟",
@@ -284,14 +731,157 @@ class ContentCreatorBot:
             
             return ASKING_WATERMARK
     
+    async def send_generated_image(self, context, user_id, image_url, caption, file_name):
+        """Download a generated image and send it as a photo, falling back to its URL."""
+        import buffers
+        
+        image = None
+        try:
+            # Download the image first, streamed into a buffer
+            loop = asyncio.get_running_loop()
+            with IMAGE_DOWNLOAD_SECONDS.labels(source="url").time(), span("image.download", source="url"):
+                image = await loop.run_in_executor(None, run_in_context(buffers.fetch, image_url))
+            
+            # Shrink oversized results to the output byte budget
+            await self.ready()
+            encoder = self.watermark_processor.encoder
+            content = await loop.run_in_executor(None, run_in_context(encoder.reencode, image))
+            if content is not image:
+                file_name = f"{os.path.splitext(file_name)[0]}{encoder.extension}"
+            
+            # Send the image as a file, streamed from the buffer
+            with TELEGRAM_UPLOAD_SECONDS.labels(kind="photo").time(), span("telegram.send_photo"):
+                await context.bot.send_photo(
+                    chat_id=user_id,
+                    photo=buffers.upload(content, file_name),
+                    caption=caption
+                )
+        except Exception as img_error:
+            logger.error(f"Error downloading/sending image: {img_error}")
+            ERRORS_TOTAL.labels(stage="image_delivery").inc()
+            # If downloading fails, send the URL as text
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=f"{caption}\n\n🔗 لینک تصویر: {image_url}"
+            )
+        finally:
+            if image is not None:
+                image.close()
+    
+    async def send_unavailable(self, context, user_id, error):
+        """Tell the user right away that fal is failing instead of waiting on it."""
+        logger.warning(f"Fast-failed request for user {user_id}: {error}")
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=(
+                "⚠️ سرویس تولید در حال حاضر با اختلال مواجه است. "
+                f"لطفاً حدود {max(1, round(error.retry_after))} ثانیه دیگر دوباره تلاش کنید."
+            )
+        )
+    
+    def record_time_to_first_image(self, tier, seconds):
+        """Track how long users wait from choosing a shot to seeing an image."""
+        TIME_TO_FIRST_IMAGE_SECONDS.labels(tier=tier).observe(seconds)
+        logger.info(f"Time to first image ({tier}): {seconds:.2f}s")
+    
+    def start_upgrade(self, context, user_id, shot_id, image_url):
+        """Start the full-quality render for a shot in the background."""
+        self.cancel_upgrade(user_id)
+        task = asyncio.ensure_future(self.render_final(context, user_id, shot_id, image_url))
+        self.user_data.setdefault(user_id, {})["upgrade_task"] = task
+        return task
+    
+    def cancel_upgrade(self, user_id):
+        """Cancel a full-quality render the user has moved on from."""
+        task = self.user_data.get(user_id, {}).pop("upgrade_task", None)
+        if task is not None and not task.done():
+            task.cancel()
+            logger.info(f"Cancelled in-flight upgrade for user {user_id}")
+    
+    async def wait_for_upgrade(self, user_id):
+        """Let a pending full-quality render finish before its image is used."""
+        task = self.user_data.get(user_id, {}).get("upgrade_task")
+        if task is not None and not task.done():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    
+    async def render_final(self, context, user_id, shot_id, image_url):
+        """Run the full-quality render for a shot and replace the draft with it."""
+        await self.ready()
+        job = self.jobs.start(user_id, "shot", shot_id=shot_id, **self.job_image(user_id, image_url))
+        try:
+            shot_info = PRODUCT_SHOT_TYPES[shot_id]
+            try:
+                result = await self.api_client.generate_product_image(
+                    image_url=image_url,
+                    shot_type=shot_info["prompt"],
+                    **FINAL_RENDER
+                )
+            except CircuitOpenError as e:
+                await self.send_unavailable(context, user_id, e)
+                return
+            logger.info("Final API Result", extra={"event": "fal.result", "workflow": "content_creator", "payload": result})
+            
+            if not (result and result.get("images")):
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="❌ تولید نسخه با کیفیت بالا ناموفق بود. پیش‌نمایش همچنان قابل استفاده است."
+                )
+                return
+            
+            final_image_url = result["images"][0]["url"]
+            job.result = final_image_url
+            session = self.user_data.get(user_id)
+            if session is not None:
+                session["generated_image_url"] = final_image_url
+                if session.get("phash") is not None:
+                    self.image_index.record(user_id, session["phash"], "shot", shot_id, final_image_url)
+            
+            await self.send_generated_image(
+                context, user_id, final_image_url,
+                f"✨ نسخه با کیفیت بالای {shot_info['name']} آماده شد!",
+                f"generated_image_{shot_id}.jpg"
+            )
+        finally:
+            self.jobs.finish(job)
+    
+    @trace_update
+    @guard_action
     async def handle_watermark_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle user's response to watermark question."""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
+        data = callback_action(query.data)
+        
+        if data.startswith("upgrade_shot_"):
+            # Offered tiered mode: the user asked for the full-quality render
+            shot_id = data.replace("upgrade_shot_", "", 1)
+            image_url = self.user_data.get(user_id, {}).get("image_url")
+            if shot_id not in PRODUCT_SHOT_TYPES or not image_url:
+                await query.edit_message_text("❌ خطا: تصویر محصول یافت نشد. لطفاً دوباره تصویر را ارسال کنید.")
+                return ConversationHandler.END
+            
+            await query.edit_message_text("🔄 در حال تولید نسخه با کیفیت بالا... لطفاً صبر کنید.")
+            self.start_upgrade(context, user_id, shot_id, image_url)
+            await self.wait_for_upgrade(user_id)
+            
+            keyboard = [
+                [InlineKeyboardButton("✅ بله، واترمارک اضافه کن", callback_data="watermark_yes")],
+                [InlineKeyboardButton("❌ نه، همین کافی است", callback_data="watermark_no")]
+            ]
+            reply_markup = self.markup(user_id, keyboard)
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="🔒 آیا می‌خواهید واترمارک به این تصویر اضافه کنید؟",
+                reply_markup=reply_markup
+            )
+            return ASKING_WATERMARK
         
-        if query.data == "watermark_yes":
+        if data == "watermark_yes":
             # User wants to add watermark, show position options
             keyboard = []
             for pos_id, pos_info in WATERMARK_POSITIONS.items():
@@ -300,51 +890,99 @@ class ContentCreatorBot:
             # Add back button
             keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")])
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = self.markup(user_id, keyboard)
             await query.edit_message_text(
                 "لطفاً موقعیت واترمارک را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_WATERMARK_POSITION
             
-        elif query.data == "watermark_no":
+        elif data == "watermark_no":
             # User doesn't want watermark, show main menu
-            keyboard = [
-                [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-                [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-                [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = main_menu_markup(self.session_version(user_id))
             await query.edit_message_text(
                 "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_OPTION
 
+    @trace_update
+    @guard_action
     async def handle_text_type_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text content type selection and ask for prompt."""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
+        data = callback_action(query.data)
         
         # Handle back button
-        if query.data == "back_to_main":
+        if data == "back_to_main":
             # Go back to main menu
-            keyboard = [
-                [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-                [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = main_menu_markup(self.session_version(user_id))
             await query.edit_message_text(
                 "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_OPTION
         
-        content_type = query.data.replace("text_", "")
+        if data.startswith("content_pack_"):
+            # One brief, every text type generated concurrently
+            if user_id not in self.user_data:
+                self.user_data[user_id] = {}
+            self.user_data[user_id]["content_type"] = CONTENT_PACK
+            self.user_data[user_id]["pack_delivery"] = data.replace("content_pack_", "", 1)
+            
+            await query.edit_message_text(
+                f"لطفاً توضیح دهید که بسته محتوا ({', '.join(CONTENT_PACK_TYPES)}) برای چه منظوری تولید شود:\n\n"
+                "مثال: برای معرفی محصول، تبلیغات، شبکه‌های اجتماعی و غیره"
+            )
+            return WAITING_FOR_TEXT_PROMPT
+        
+        if data.startswith(("reuse_text_", "new_text_")):
+            # Answer to the reuse offer made by handle_text_prompt for the brief in the session
+            from image_index import text_key
+            
+            user_data = self.user_data.get(user_id, {})
+            phash = user_data.get("phash")
+            user_prompt = user_data.get("user_prompt")
+            image_url = user_data.get("image_url")
+            if user_prompt is None or not image_url:
+                await query.edit_message_text("❌ خطا: اطلاعات ناقص است. لطفاً دوباره تصویر را ارسال کنید.")
+                return ConversationHandler.END
+            
+            if data.startswith("new_text_"):
+                content_type = data.replace("new_text_", "", 1)
+                await query.edit_message_text(f"✍️ تولید متن جدید {content_type}...")
+                await self.send_text_content(context, user_id, image_url, content_type, user_prompt, phash=phash)
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
+                    reply_markup=main_menu_markup(self.session_version(user_id))
+                )
+                return CHOOSING_OPTION
+            
+            # Resend the text generated earlier for a near-duplicate image and the same brief
+            content_type = data.replace("reuse_text_", "", 1)
+            previous_text = None
+            await self.ready()
+            if phash is not None:
+                previous_text = self.image_index.find(user_id, phash, "text", text_key(content_type, user_prompt))
+            
+            if previous_text:
+                await query.edit_message_text(f"✅ محتوای {content_type} (نتیجه قبلی):\n\n{previous_text}")
+            else:
+                await query.edit_message_text("❌ نتیجه قبلی یافت نشد. لطفاً دوباره تلاش کنید.")
+            
+            reply_markup = main_menu_markup(self.session_version(user_id))
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
+                reply_markup=reply_markup
+            )
+            return CHOOSING_OPTION
+        
+        content_type = data.replace("text_", "")
         
         # Store the content type
         if user_id not in self.user_data:
@@ -358,8 +996,12 @@ class ContentCreatorBot:
         
         return WAITING_FOR_TEXT_PROMPT
     
+    @trace_update
+    @guard_action
     async def handle_text_prompt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text prompt and generate content."""
+        from image_index import text_key
+        
         user_id = update.message.from_user.id
         user_prompt = update.message.text
         
@@ -371,12 +1013,58 @@ class ContentCreatorBot:
             await update.message.reply_text("❌ خطا: اطلاعات ناقص است. لطفاً دوباره تصویر را ارسال کنید.")
             return ConversationHandler.END
         
+        await self.ready()
+        if content_type == CONTENT_PACK:
+            # Every pack type at once, delivered as each one finishes
+            await self.send_content_pack(context, user_id, user_data, user_prompt)
+        elif user_data.get("phash") is not None and self.image_index.find(
+            user_id, user_data["phash"], "text", text_key(content_type, user_prompt)
+        ):
+            # Offer the text written earlier for a near-duplicate image and the same brief
+            user_data["user_prompt"] = user_prompt
+            keyboard = [
+                [InlineKeyboardButton("♻️ استفاده از متن قبلی", callback_data=f"reuse_text_{content_type}")],
+                [InlineKeyboardButton("✍️ تولید متن جدید", callback_data=f"new_text_{content_type}")],
+                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main")]
+            ]
+            await update.message.reply_text(
+                f"♻️ برای تصویر مشابهی با همین توضیحات قبلاً محتوای {content_type} تولید شده است. از نتیجه قبلی استفاده شود؟",
+                reply_markup=self.markup(user_id, keyboard)
+            )
+            return CHOOSING_TEXT_TYPE
+        else:
+            await self.send_text_content(context, user_id, image_url, content_type, user_prompt, phash=user_data.get("phash"))
+        
+        # Add a small delay to ensure content is sent first
+        import asyncio
+        await asyncio.sleep(1)
+        
+        # Show main menu again for more actions
+        reply_markup = main_menu_markup(self.session_version(user_id))
+        await context.bot.send_message(
+            chat_id=user_id,
+            text="لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
+            reply_markup=reply_markup
+        )
+        
+        return CHOOSING_OPTION
+    
+    async def send_text_content(self, context, user_id, image_url, content_type, user_prompt, phash=None):
+        """Generate one TEXT_CONTENT_TYPES text for an image and send it."""
+        from image_index import text_key
+        
+        await self.ready()
+        
         # Show processing message
-        processing_msg = await update.message.reply_text("🔄 در حال تولید محتوای متنی... لطفاً صبر کنید.")
+        await context.bot.send_message(chat_id=user_id, text="🔄 در حال تولید محتوای متنی... لطفاً صبر کنید.")
         
+        # Saved and resumed if the bot shuts down before the text is sent
+        job = self.jobs.start(
+            user_id, "text", content_type=content_type, user_prompt=user_prompt, **self.job_image(user_id, image_url)
+        )
         try:
             # Create the full prompt
-            full_prompt = f"Generate {content_type} content for this product. User request: {user_prompt}"
+            full_prompt = TEXT_PROMPT_TEMPLATE.format(content_type=content_type, user_prompt=user_prompt)
             
             # Call the API
             result = await self.api_client.generate_text_content(
@@ -385,51 +1073,196 @@ class ContentCreatorBot:
             )
             
             # Debug: Log the result
-            logger.info(f"Text API Result: {result}")
+            logger.info("Text API Result", extra={"event": "fal.result", "workflow": "vision_specialist", "payload": result})
             
             if result and result.get("output"):
+                job.result = result["output"]
+                
                 # Send the generated text
                 await context.bot.send_message(
                     chat_id=user_id,
                     text=f"✅ محتوای {content_type} تولید شد:\n\n{result['output']}"
                 )
-                success = True
+                
+                # Remember the result for near-duplicate uploads with the same brief
+                if phash is not None:
+                    self.image_index.record(user_id, phash, "text", text_key(content_type, user_prompt), result["output"])
             else:
-                logger.warning(f"No valid text result from API: {result}")
+                logger.warning("No valid text result from API", extra={"event": "fal.invalid_result", "payload": result})
                 await context.bot.send_message(
                     chat_id=user_id,
                     text="❌ خطا در تولید محتوای متنی. لطفاً دوباره تلاش کنید."
                 )
-                success = False
-                
+        
+        except CircuitOpenError as e:
+            await self.send_unavailable(context, user_id, e)
         except Exception as e:
             logger.error(f"Error generating text content: {e}")
+            ERRORS_TOTAL.labels(stage="text_content").inc()
             await context.bot.send_message(
                 chat_id=user_id,
                 text="❌ خطا در تولید محتوای متنی. لطفاً دوباره تلاش کنید."
             )
-            success = False
+        finally:
+            self.jobs.finish(job)
+    
+    async def run_preset(self, context, user_id, preset_id, image_url):
+        """Run a PIPELINE_PRESETS entry as one pipeline and send its results."""
+        import buffers
+        from pipeline import build_preset_pipeline
         
-        # Add a small delay to ensure content is sent first
-        import asyncio
-        await asyncio.sleep(1)
+        await self.ready()
         
-        # Show main menu again for more actions
-        keyboard = [
-            [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-            [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-            [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-            [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(
+        # Saved and resumed if the bot shuts down before the results are sent
+        job = self.jobs.start(user_id, "preset", preset_id=preset_id, **self.job_image(user_id, image_url))
+        result = None
+        try:
+            preset = PIPELINE_PRESETS[preset_id]
+            try:
+                # Nothing of the preset is worth running if a workflow it needs is down
+                self.api_client.check_available(
+                    *([CONTENT_CREATOR_WORKFLOW] if preset.get("shot") else []),
+                    *([VISION_SPECIALIST_WORKFLOW] if preset.get("text") else [])
+                )
+            except CircuitOpenError as e:
+                await self.send_unavailable(context, user_id, e)
+                return
+            pipeline = build_preset_pipeline(preset, self.api_client, self.watermark_processor, tenant=user_id)
+            result = await pipeline.run(image_url=image_url)
+            logger.info(f"Preset {preset_id} timings: {result.format_timings()}")
+            
+            # Never the raw download in place of a watermark the preset asked for
+            image_data = None
+            if preset.get("watermark"):
+                if "watermark" not in result.errors:
+                    image_data = result.outputs.get("watermark")
+            elif "encode" not in result.errors:
+                image_data = result.outputs.get("encode") or result.outputs.get("download")
+            caption = result.outputs.get("caption")
+            
+            if "image" in result.outputs:
+                if user_id not in self.user_data:
+                    self.user_data[user_id] = {}
+                self.user_data[user_id]["generated_image_url"] = result.outputs["image"]
+            
+            if image_data:
+                # Telegram limits photo captions to 1024 characters
+                short_caption = caption if caption and len(caption) <= 1024 else None
+                with TELEGRAM_UPLOAD_SECONDS.labels(kind="photo").time(), span("telegram.send_photo"):
+                    await context.bot.send_photo(
+                        chat_id=user_id,
+                        photo=buffers.upload(image_data, f"{preset_id}{self.watermark_processor.encoder.extension}"),
+                        caption=short_caption or f"✅ {preset['name']}"
+                    )
+                if caption and not short_caption:
+                    await context.bot.send_message(chat_id=user_id, text=caption)
+            elif caption:
+                await context.bot.send_message(chat_id=user_id, text=caption)
+            
+            if result.errors:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="❌ بخشی از پیش‌تنظیم با خطا مواجه شد. لطفاً دوباره تلاش کنید."
+                )
+        finally:
+            if result is not None:
+                # The downloaded image may have spilled to a temporary file
+                for output in result.outputs.values():
+                    if isinstance(output, buffers.SpooledBuffer):
+                        output.close()
+            self.jobs.finish(job)
+    
+    async def send_content_pack(self, context, user_id, user_data, user_prompt):
+        """Generate every CONTENT_PACK_TYPES text concurrently and deliver the results."""
+        from image_index import text_key
+        
+        await self.ready()
+        
+        image_url = user_data.get("image_url")
+        delivery = user_data.get("pack_delivery", "messages")
+        phash = user_data.get("phash")
+        
+        progress_msg = await context.bot.send_message(
             chat_id=user_id,
-            text="لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
-            reply_markup=reply_markup
+            text=f"🔄 در حال تولید بسته محتوا (0 از {len(CONTENT_PACK_TYPES)})... لطفاً صبر کنید."
         )
         
-        return CHOOSING_OPTION
+        # Saved and resumed (the whole pack again) if the bot shuts down first
+        job = self.jobs.start(
+            user_id, "content_pack", delivery=delivery, user_prompt=user_prompt, **self.job_image(user_id, image_url)
+        )
+        try:
+            prompts = {
+                content_type: TEXT_PROMPT_TEMPLATE.format(content_type=content_type, user_prompt=user_prompt)
+                for content_type in CONTENT_PACK_TYPES
+            }
+            
+            start_time = asyncio.get_running_loop().time()
+            sections = {}
+            finished = 0
+            try:
+                async for content_type, result in self.api_client.generate_text_pack(image_url, prompts):
+                    finished += 1
+                    if not (result and result.get("output")):
+                        logger.warning(f"No valid text result from API for {content_type}", extra={"event": "fal.invalid_result", "payload": result})
+                        continue
+                    
+                    sections[content_type] = result["output"]
+                    if phash is not None:
+                        self.image_index.record(user_id, phash, "text", text_key(content_type, user_prompt), result["output"])
+                    
+                    if delivery == "messages":
+                        await context.bot.send_message(
+                            chat_id=user_id,
+                            text=f"✅ محتوای {content_type} تولید شد:\n\n{result['output']}"
+                        )
+                    else:
+                        await progress_msg.edit_text(
+                            f"🔄 در حال تولید بسته محتوا ({finished} از {len(CONTENT_PACK_TYPES)})... لطفاً صبر کنید."
+                        )
+            except CircuitOpenError as e:
+                await self.send_unavailable(context, user_id, e)
+                return
+            except Exception as e:
+                logger.error(f"Error generating content pack: {e}")
+                ERRORS_TOTAL.labels(stage="content_pack").inc()
+            
+            logger.info(
+                f"Content pack finished in {asyncio.get_running_loop().time() - start_time:.1f}s "
+                f"({len(sections)}/{len(CONTENT_PACK_TYPES)} succeeded)"
+            )
+            
+            if not sections:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="❌ خطا در تولید محتوای متنی. لطفاً دوباره تلاش کنید."
+                )
+                return
+            
+            if delivery == "document":
+                # Keep the pack in the order of CONTENT_PACK_TYPES, not completion order
+                document = "\n\n".join(
+                    f"# {content_type}\n\n{sections[content_type]}"
+                    for content_type in CONTENT_PACK_TYPES if content_type in sections
+                )
+                with TELEGRAM_UPLOAD_SECONDS.labels(kind="document").time(), span("telegram.send_document"):
+                    await context.bot.send_document(
+                        chat_id=user_id,
+                        document=io.BytesIO(document.encode("utf-8")),
+                        filename="content_pack.md",
+                        caption=f"✅ بسته محتوا تولید شد ({len(sections)} از {len(CONTENT_PACK_TYPES)})"
+                    )
+            
+            missing = [content_type for content_type in CONTENT_PACK_TYPES if content_type not in sections]
+            if missing:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=f"❌ خطا در تولید: {', '.join(missing)}. لطفاً دوباره تلاش کنید."
+                )
+        finally:
+            self.jobs.finish(job)
     
+    @trace_update
     async def handle_unexpected_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle unexpected text messages during conversation."""
         user_id = update.message.from_user.id
@@ -439,13 +1272,7 @@ class ContentCreatorBot:
         )
         
         # Show main menu again
-        keyboard = [
-            [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-            [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-            [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-            [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = main_menu_markup(self.session_version(user_id))
         
         await update.message.reply_text(
             "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
@@ -454,44 +1281,116 @@ class ContentCreatorBot:
         
         return CHOOSING_OPTION
     
+    @trace_update
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel the conversation."""
         user_id = update.message.from_user.id
         
         # Clean up user data
+        self.cancel_upgrade(user_id)
         if user_id in self.user_data:
             del self.user_data[user_id]
         
         await update.message.reply_text("❌ عملیات لغو شد.")
         return ConversationHandler.END
     
+    @trace_update
+    async def request_logo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ask for the user's own watermark logo (/logo), or remove it (/logo reset)."""
+        user_id = update.message.from_user.id
+        await self.ready()
+        registry = self.watermark_processor.registry
+        
+        if registry is None:
+            await update.message.reply_text("❌ امکان بارگذاری لوگو فعال نیست.")
+            return ConversationHandler.END
+        
+        if context.args and context.args[0] == "reset":
+            removed = registry.delete(user_id)
+            await update.message.reply_text(
+                "✅ لوگوی شما حذف شد و از لوگوی پیش‌فرض استفاده می‌شود." if removed else "ℹ️ لوگویی برای حذف وجود ندارد."
+            )
+            return ConversationHandler.END
+        
+        await update.message.reply_text(
+            "🖼️ لطفاً لوگوی خود را ارسال کنید.\n\n"
+            "برای حفظ پس‌زمینه شفاف، لوگو را به صورت فایل (PNG) ارسال کنید."
+        )
+        return WAITING_FOR_LOGO
+    
+    @trace_update
+    @guard_action
+    async def handle_logo_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Store an uploaded logo as the user's watermark."""
+        user_id = update.message.from_user.id
+        
+        # Documents keep transparency; photos are recompressed to JPEG by Telegram
+        if update.message.document:
+            file_id = update.message.document.file_id
+        else:
+            file_id = update.message.photo[-1].file_id
+        
+        try:
+            with TELEGRAM_FILE_RESOLVE_SECONDS.time(), span("telegram.get_file"):
+                file = await context.bot.get_file(file_id)
+            with IMAGE_DOWNLOAD_SECONDS.labels(source="telegram").time(), span("image.download", source="telegram"):
+                data = bytes(await file.download_as_bytearray())
+            
+            # Normalizing and writing the logo is blocking work
+            loop = asyncio.get_running_loop()
+            await self.ready()
+            await loop.run_in_executor(None, run_in_context(self.watermark_processor.registry.put, user_id, data))
+            await update.message.reply_text("✅ لوگوی شما ذخیره شد و از این پس برای واترمارک استفاده می‌شود.")
+        except ValueError as e:
+            logger.warning(f"Rejected logo from user {user_id}: {e}")
+            await update.message.reply_text("❌ این فایل تصویر معتبری نیست. لطفاً لوگو را به صورت PNG یا JPG ارسال کنید.")
+            return WAITING_FOR_LOGO
+        except Exception as e:
+            logger.error(f"Error storing logo: {e}")
+            ERRORS_TOTAL.labels(stage="logo_upload").inc()
+            await update.message.reply_text("❌ خطا در ذخیره لوگو. لطفاً دوباره تلاش کنید.")
+            return WAITING_FOR_LOGO
+        
+        if not self.user_data.get(user_id, {}).get("image_url"):
+            await update.message.reply_text("برای شروع، لطفاً تصویر محصول خود را ارسال کنید.")
+            return ConversationHandler.END
+        
+        # Back to the options for the current product image
+        await update.message.reply_text(
+            "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
+            reply_markup=main_menu_markup(self.session_version(user_id))
+        )
+        return CHOOSING_OPTION
+    
+    @trace_update
+    @guard_action
     async def handle_watermark_position_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle watermark position selection and add watermark to image."""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
+        data = callback_action(query.data)
         
         # Handle back button
-        if query.data == "back_to_main":
+        if data == "back_to_main":
             # Go back to main menu
-            keyboard = [
-                [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-                [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-                [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = main_menu_markup(self.session_version(user_id))
             await query.edit_message_text(
                 "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
                 reply_markup=reply_markup
             )
             return CHOOSING_OPTION
         
-        pos_id = query.data.replace("watermark_", "")
+        pos_id = data.replace("watermark_", "")
         
         if pos_id in WATERMARK_POSITIONS:
-            pos_info = WATERMARK_POSITIONS[pos_id]
+            # Watermark the full-quality render rather than its draft preview
+            upgrade_task = self.user_data.get(user_id, {}).get("upgrade_task")
+            if upgrade_task is not None and not upgrade_task.done():
+                await query.edit_message_text("🔄 در انتظار نسخه با کیفیت بالا... لطفاً صبر کنید.")
+                await self.wait_for_upgrade(user_id)
+            
             user_data = self.user_data.get(user_id, {})
             
             # Check if we have a generated image URL (from image generation) or original image URL
@@ -503,50 +1402,14 @@ class ContentCreatorBot:
             
             # Show processing message
             await query.edit_message_text("🔄 در حال افزودن واترمارک... لطفاً صبر کنید.")
-            
-            try:
-                # Add watermark
-                watermarked_image_data = self.watermark_processor.add_watermark(
-                    image_url=image_url,
-                    position=pos_info["value"],
-                    opacity=1.0
-                )
-                
-                if watermarked_image_data:
-                    # Send the watermarked image
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=watermarked_image_data,
-                        caption=f"✅ واترمارک با موفقیت در {pos_info['name']} اضافه شد!"
-                    )
-                    success = True
-                else:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="❌ خطا در افزودن واترمارک. لطفاً دوباره تلاش کنید."
-                    )
-                    success = False
-                    
-            except Exception as e:
-                logger.error(f"Error adding watermark: {e}")
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text="❌ خطا در افزودن واترمارک. لطفاً دوباره تلاش کنید."
-                )
-                success = False
+            await self.send_watermarked_image(context, user_id, image_url, pos_id)
             
             # Add a small delay to ensure image is sent first
             import asyncio
             await asyncio.sleep(1)
             
             # Show main menu again for more actions
-            keyboard = [
-                [InlineKeyboardButton("تولید تصویر محصول", callback_data="product_image")],
-                [InlineKeyboardButton("تولید محتوا متنی", callback_data="text_content")],
-                [InlineKeyboardButton("🔒 افزودن واترمارک", callback_data="watermark")],
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_start")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = main_menu_markup(self.session_version(user_id))
             await context.bot.send_message(
                 chat_id=user_id,
                 text="لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
@@ -555,56 +1418,338 @@ class ContentCreatorBot:
             
             return CHOOSING_OPTION
     
+    async def send_watermarked_image(self, context, user_id, image_url, pos_id):
+        """Watermark an image at a WATERMARK_POSITIONS position with the user's logo and send it."""
+        import buffers
+        from animation import animated_format
+        
+        pos_info = WATERMARK_POSITIONS[pos_id]
+        await self.ready()
+        
+        # Saved and resumed if the bot shuts down before the image is sent
+        job = self.jobs.start(user_id, "watermark", pos_id=pos_id, **self.job_image(user_id, image_url))
+        watermarked_image_data = None
+        try:
+            # Add watermark in a worker thread: the download and, for animations,
+            # every frame's decode/composite/encode would otherwise hold up all updates
+            loop = asyncio.get_running_loop()
+            watermarked_image_data = await loop.run_in_executor(None, run_in_context(
+                self.watermark_processor.add_watermark, image_url, pos_info["value"], 1.0, user_id
+            ))
+            
+            caption = f"✅ واترمارک با موفقیت در {pos_info['name']} اضافه شد!"
+            animated = watermarked_image_data and animated_format(watermarked_image_data)
+            if animated == "GIF":
+                # Sent as an animation; send_photo would keep only the first frame
+                with TELEGRAM_UPLOAD_SECONDS.labels(kind="animation").time(), span("telegram.send_animation"):
+                    await context.bot.send_animation(
+                        chat_id=user_id,
+                        animation=buffers.upload(watermarked_image_data, "watermarked.gif"),
+                        caption=caption
+                    )
+            elif animated:
+                # Telegram has no animated WebP message type; a file keeps the animation
+                with TELEGRAM_UPLOAD_SECONDS.labels(kind="document").time(), span("telegram.send_document"):
+                    await context.bot.send_document(
+                        chat_id=user_id,
+                        document=buffers.upload(watermarked_image_data, "watermarked.webp"),
+                        caption=caption
+                    )
+            elif watermarked_image_data:
+                # Send the watermarked image
+                with TELEGRAM_UPLOAD_SECONDS.labels(kind="photo").time(), span("telegram.send_photo"):
+                    await context.bot.send_photo(
+                        chat_id=user_id,
+                        photo=buffers.upload(watermarked_image_data, f"watermarked{self.watermark_processor.encoder.extension}"),
+                        caption=caption
+                    )
+            else:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="❌ خطا در افزودن واترمارک. لطفاً دوباره تلاش کنید."
+                )
+        
+        except Exception as e:
+            logger.error(f"Error adding watermark: {e}")
+            ERRORS_TOTAL.labels(stage="watermark").inc()
+            await context.bot.send_message(
+                chat_id=user_id,
+                text="❌ خطا در افزودن واترمارک. لطفاً دوباره تلاش کنید."
+            )
+        finally:
+            if isinstance(watermarked_image_data, buffers.SpooledBuffer):
+                watermarked_image_data.close()
+            self.jobs.finish(job)
+    
+    async def record_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Append an incoming update to the traffic recording (see recording.py)."""
+        recording.record_update(update)
+    
+    @trace_update
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Admin-only live diagnostics (/stats)
+        
+        /stats reports sessions, caches, running jobs and pools;
+        /stats profile [seconds] sends a sampling CPU profile and
+        /stats memory [seconds] a tracemalloc snapshot, both as text files.
+        Anyone not in ADMIN_USER_IDS is ignored, as if the command didn't exist.
+        """
+        import diagnostics
+        
+        user_id = update.message.from_user.id
+        if user_id not in ADMIN_USER_IDS:
+            logger.warning(f"/stats refused for user {user_id}", extra={"event": "stats.refused", "user_id": user_id})
+            return
+        
+        mode = context.args[0] if context.args else "report"
+        if mode == "report":
+            await update.message.reply_text(self.stats_report(context.application))
+            return
+        if mode not in ("profile", "memory"):
+            await update.message.reply_text("ℹ️ استفاده: /stats ، /stats profile [ثانیه] یا /stats memory [ثانیه]")
+            return
+        
+        try:
+            seconds = float(context.args[1]) if len(context.args) > 1 else STATS_PROFILE_SECONDS
+        except ValueError:
+            await update.message.reply_text("❌ مدت زمان باید عدد (ثانیه) باشد.")
+            return
+        seconds = min(max(seconds, 0.5), STATS_MAX_PROFILE_SECONDS)
+        if self.profile_lock.locked():
+            await update.message.reply_text("⏳ یک پروفایل دیگر در حال ثبت است. لطفاً کمی بعد دوباره امتحان کنید.")
+            return
+        
+        async with self.profile_lock:
+            await update.message.reply_text(f"🔬 در حال ثبت {'پروفایل پردازنده' if mode == 'profile' else 'تصویر حافظه'} به مدت {seconds:.0f} ثانیه...")
+            logger.info(f"Capturing a {seconds:.1f}s {mode} profile for /stats", extra={"event": "stats.profile", "mode": mode, "seconds": seconds})
+            if mode == "profile":
+                # The sampler blocks, so it gets a thread of its own instead of
+                # one from the default executor the handlers share
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                
+                def sample():
+                    try:
+                        result = diagnostics.sample_stacks(seconds, top=STATS_TOP_N)
+                    except BaseException as e:
+                        loop.call_soon_threadsafe(future.set_exception, e)
+                    else:
+                        loop.call_soon_threadsafe(future.set_result, result)
+                
+                threading.Thread(target=sample, name="stats-profiler", daemon=True).start()
+                report = await future
+            else:
+                report = await diagnostics.tracemalloc_top(seconds, limit=STATS_TOP_N)
+        
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        await update.message.reply_document(
+            document=io.BytesIO(report.encode("utf-8")),
+            filename=f"{'cpu_profile' if mode == 'profile' else 'memory'}_{stamp}.txt",
+            caption=f"✅ {'CPU profile' if mode == 'profile' else 'Memory snapshot'}, {seconds:.0f}s"
+        )
+    
+    def stats_report(self, application):
+        """
+        Text of the /stats report
+        
+        Only subsystems that already exist are inspected, so asking for
+        stats never loads one.
+        """
+        from diagnostics import process_memory, deep_sizeof, format_bytes
+        
+        def counts(counter, position=0):
+            totals = {}
+            for key, value in counter.samples().items():
+                totals[key[position]] = totals.get(key[position], 0) + value
+            return totals
+        
+        def hit_rate(hits, total):
+            return f"{hits / total:.0%}" if total else "-"
+        
+        memory = process_memory()
+        guard = self.callback_guard.stats()
+        lines = [
+            "📊 Bot stats",
+            "",
+            f"🧠 Memory: {format_bytes(memory['rss'])} RSS, {format_bytes(memory['peak_rss'])} peak"
+            + (f", {format_bytes(memory['traced'])} traced" if memory["traced"] is not None else ""),
+            f"👥 Sessions: {len(self.user_data)} (~{format_bytes(deep_sizeof(self.user_data))})",
+            f"🔐 Callback guard: {guard['seen_queries']} taps remembered, {guard['busy_users']} users running actions"
+        ]
+        avoided = counts(DUPLICATE_ACTIONS_AVOIDED_TOTAL)
+        if avoided:
+            lines.append("   Avoided: " + ", ".join(f"{reason} {count:.0f}" for reason, count in sorted(avoided.items())))
+        
+        lines.append("")
+        lines.append("🗂️ Caches")
+        if self._image_index is not None:
+            lookups = counts(IMAGE_INDEX_LOOKUPS_TOTAL, position=1)
+            total = sum(lookups.values())
+            lines.append(
+                f"   Image index: {len(self._image_index)} images, "
+                f"hit rate {hit_rate(lookups.get('hit', 0), total)} of {total:.0f} lookups"
+            )
+        registry = self._watermark_processor.registry if self._watermark_processor is not None else None
+        if registry is not None:
+            lookups = counts(LOGO_CACHE_REQUESTS_TOTAL)
+            loads = lookups.get("hit", 0) + lookups.get("miss", 0)
+            lines.append(
+                f"   Logos: {len(registry)} loaded, {format_bytes(registry.cache_bytes)} of {format_bytes(registry.max_bytes)}, "
+                f"hit rate {hit_rate(lookups.get('hit', 0), loads)} of {loads:.0f} lookups"
+            )
+        if self._image_index is None and registry is None:
+            lines.append("   Not loaded yet")
+        
+        lines.append("")
+        running = self.jobs.kinds()
+        lines.append(f"⚙️ Jobs: {len(self.jobs)} running" + (" (" + ", ".join(f"{kind} {count}" for kind, count in sorted(running.items())) + ")" if running else ""))
+        in_flight = {key[0]: value for key, value in JOBS_IN_FLIGHT.samples().items() if value}
+        if in_flight:
+            lines.append("   fal runs in flight: " + ", ".join(f"{kind} {count:.0f}" for kind, count in sorted(in_flight.items())))
+        if self._api_client is not None:
+            for workflow, breaker in sorted(self._api_client.breakers.items()):
+                limiter = self._api_client.limiters[workflow]
+                retry = breaker.retry_after()
+                lines.append(
+                    f"   {workflow}: {limiter.in_flight}/{int(limiter.limit)} slots used, {limiter.waiting} waiting, "
+                    f"circuit {breaker.state}" + (f" ({retry:.0f}s left)" if retry > 0 else "")
+                )
+        
+        lines.append("")
+        lines.append("🏊 Pools")
+        processor = application.update_processor
+        lines.append(f"   Updates: {processor.current_concurrent_updates}/{processor.max_concurrent_updates} being handled, {application.update_queue.qsize()} queued")
+        if self.executor is not None:
+            usage = self.executor.usage()
+            lines.append(f"   Worker threads: {usage[0]}/{usage[1]} busy, {usage[2]} tasks queued")
+        encoder = self._watermark_processor.encoder if self._watermark_processor is not None else None
+        usage = encoder.pool_usage() if encoder is not None else None
+        if usage is not None:
+            lines.append(f"   Encoder threads: {usage[0]}/{usage[1]} busy, {usage[2]} tasks queued")
+        lines.append(f"   Threads alive: {threading.active_count()}")
+        return "\n".join(lines)
+    
     def run(self):
         """Start the bot."""
-        # Create the Application
-        application = Application.builder().token(TELEGRAM_TOKEN).build()
+        # Enable logging (written by a background thread so handlers never wait on I/O)
+        log_listener = setup_logging(
+            level=LOG_LEVEL,
+            fmt=LOG_FORMAT,
+            path=LOG_FILE or None,
+            max_field_chars=LOG_MAX_FIELD_CHARS,
+            sample_rates=parse_sample_rates(LOG_SAMPLE_RATES)
+        )
+        
+        # Record anonymized traffic for replay.py (before building, so Bot API calls are timed)
+        recording.configure(RECORD_FILE)
+        
+        application = self.build_application()
+        
+        # Expose metrics on a local HTTP endpoint
+        if METRICS_PORT:
+            self.metrics_server = start_metrics_server(METRICS_PORT)
+        
+        # Record a sample of per-update traces
+        tracing.configure(TRACE_FILE, TRACE_SAMPLE_RATE)
+        
+        # Start the bot
+        print("🤖 Content Creator Bot is starting...")
+        try:
+            # Stop signals are handled by request_shutdown(), installed by on_startup()
+            application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
+        finally:
+            # Flush queued log records
+            log_listener.stop()
+    
+    def build_application(self, token=TELEGRAM_TOKEN, base_url=None, base_file_url=None):
+        """
+        Create the Application with the conversation handler
+        
+        Args:
+            token (str): Bot token
+            base_url (str): Bot API URL ending in '/bot' (default: api.telegram.org),
+                e.g. a local stand-in used by load_test.py
+            base_file_url (str): File download URL ending in '/file/bot'
+        
+        Returns:
+            Application: Ready to initialize and poll
+        """
+        # run_polling() calls post_init just before it starts polling, and
+        # post_stop/post_shutdown once it has stopped
+        builder = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .post_init(self.on_startup)
+            .post_stop(self.on_stop)
+            .post_shutdown(self.on_shutdown)
+        )
+        if base_url:
+            builder = builder.base_url(base_url)
+        if base_file_url:
+            builder = builder.base_file_url(base_file_url)
+        if recording.recorder.enabled:
+            # Times every Bot API call and counts the replies each chat gets
+            builder = builder.request(recording.TimedRequest())
+        application = builder.build()
+        
+        if recording.recorder.enabled:
+            # Sees every update before the conversation handler does
+            application.add_handler(TypeHandler(Update, self.record_update), group=-1)
         
         # Add conversation handler
         conv_handler = ConversationHandler(
             entry_points=[
                 CommandHandler("start", self.start),
-                MessageHandler(filters.PHOTO, self.handle_image)
+                CommandHandler("logo", self.request_logo),
+                MessageHandler(PRODUCT_IMAGE, self.handle_image)
             ],
             states={
                 CHOOSING_OPTION: [
                     CallbackQueryHandler(self.handle_option_choice),
-                    MessageHandler(filters.PHOTO, self.handle_image),
+                    MessageHandler(PRODUCT_IMAGE, self.handle_image),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_unexpected_text)
                 ],
                 CHOOSING_SHOT_TYPE: [
                     CallbackQueryHandler(self.handle_shot_type_choice),
-                    MessageHandler(filters.PHOTO, self.handle_image),
+                    MessageHandler(PRODUCT_IMAGE, self.handle_image),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_unexpected_text)
                 ],
                 CHOOSING_TEXT_TYPE: [
                     CallbackQueryHandler(self.handle_text_type_choice),
-                    MessageHandler(filters.PHOTO, self.handle_image),
+                    MessageHandler(PRODUCT_IMAGE, self.handle_image),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_unexpected_text)
                 ],
                 WAITING_FOR_TEXT_PROMPT: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_prompt),
-                    MessageHandler(filters.PHOTO, self.handle_image)
+                    MessageHandler(PRODUCT_IMAGE, self.handle_image)
                 ],
                 CHOOSING_WATERMARK_POSITION: [
                     CallbackQueryHandler(self.handle_watermark_position_choice),
-                    MessageHandler(filters.PHOTO, self.handle_image),
+                    MessageHandler(PRODUCT_IMAGE, self.handle_image),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_unexpected_text)
                 ],
                 ASKING_WATERMARK: [
                     CallbackQueryHandler(self.handle_watermark_question),
-                    MessageHandler(filters.PHOTO, self.handle_image),
+                    MessageHandler(PRODUCT_IMAGE, self.handle_image),
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_unexpected_text)
+                ],
+                WAITING_FOR_LOGO: [
+                    MessageHandler(filters.PHOTO | filters.Document.IMAGE, self.handle_logo_upload),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_unexpected_text)
                 ]
             },
-            fallbacks=[CommandHandler("cancel", self.cancel)]
+            fallbacks=[
+                CommandHandler("cancel", self.cancel),
+                CommandHandler("logo", self.request_logo)
+            ]
         )
         
         application.add_handler(conv_handler)
-        
-        # Start the bot
-        print("🤖 Content Creator Bot is starting...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Admin diagnostics work in any conversation state
+        application.add_handler(CommandHandler("stats", self.stats_command))
+        return application
 
 if __name__ == "__main__":
     bot = ContentCreatorBot()
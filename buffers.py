@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Image bytes on their way from a download to a Telegram upload
+
+A delivered image used to be held whole several times: requests joined the
+downloaded chunks into response.content, and python-telegram-bot handed the
+whole file to the HTTP layer, which copied it again while sending. Here:
+
+- fetch() streams a download into a SpooledBuffer chunk by chunk
+- SpooledBuffer keeps small images in memory and moves anything larger than
+  BUFFER_SPILL_BYTES to a temporary file, read back through a memory map
+- upload() gives Telegram a file handle to stream from instead of bytes, so
+  only one chunk at a time is copied into the request
+
+Pillow, the encoder and the watermark processor read a SpooledBuffer like
+any other file.
+"""
+
+import io
+import logging
+import mmap
+import os
+import tempfile
+
+import requests
+
+from config import BUFFER_SPILL_BYTES, BUFFER_DIR
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a download or written to an upload at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class SpooledBuffer(io.RawIOBase):
+    def __init__(self, spill_bytes=BUFFER_SPILL_BYTES, name=None, directory=BUFFER_DIR):
+        """
+        Args:
+            spill_bytes (int): Size above which the data moves to a temporary file
+                (0 keeps it in memory)
+            name (str): File name reported to Telegram (its extension sets the MIME type)
+            directory (str): Directory for temporary files; empty for the system default
+        """
+        super().__init__()
+        self.spill_bytes = spill_bytes
+        self.name = name
+        self.directory = directory or None
+        self.content_type = None  # set by fetch() from the response
+        self._file = io.BytesIO()
+        self._map = None
+
+    @property
+    def spilled(self):
+        return not isinstance(self._file, io.BytesIO)
+
+    def __len__(self):
+        position = self._file.tell()
+        size = self._file.seek(0, io.SEEK_END)
+        self._file.seek(position)
+        return size
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        # Raises io.UnsupportedOperation while in memory
+        return self._file.fileno()
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+
+    def write(self, data):
+        self._release_map()
+        if not self.spilled and self.spill_bytes and self._file.tell() + len(data) > self.spill_bytes:
+            self._spill()
+        return self._file.write(data)
+
+    def _spill(self):
+        file = tempfile.TemporaryFile(dir=self.directory)
+        position = self._file.tell()
+        file.write(self._file.getbuffer())
+        file.seek(position)
+        self._file = file
+        logger.debug(f"Buffer over {self.spill_bytes} bytes moved to a temporary file")
+
+    def view(self):
+        """
+        Read-only memoryview of the whole buffer, without copying
+
+        Spilled data is memory-mapped. Release the view before writing more.
+        """
+        if not self.spilled:
+            return self._file.getbuffer().toreadonly()
+        if self._map is None:
+            self._file.flush()
+            if not len(self):
+                return memoryview(b"")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)
+
+    def peek(self, size):
+        """The first size bytes, leaving the position where it is"""
+        with self.view() as view:
+            return bytes(view[:size])
+
+    def getvalue(self):
+        """
+        The whole buffer as bytes
+
+        In memory this shares the buffer's storage instead of copying it;
+        spilled data is read once from the memory map.
+        """
+        if not self.spilled:
+            return self._file.getvalue()
+        with self.view() as view:
+            return bytes(view)
+
+    def _release_map(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                raise BufferError("Release views of a SpooledBuffer before writing to it") from None
+            self._map = None
+
+    def close(self):
+        if not self.closed:
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    # A view is still alive; the map goes when it does
+                    pass
+                self._map = None
+            self._file.close()
+        super().close()
+
+
+def fetch(url, timeout=30, spill_bytes=BUFFER_SPILL_BYTES, name=None):
+    """
+    Download a URL into a SpooledBuffer without holding the whole body twice
+
+    Returns:
+        SpooledBuffer: The body, positioned at the start
+
+    Raises:
+        requests.RequestException: The request failed or returned an error status
+    """
+    buffer = SpooledBuffer(spill_bytes, name=name)
+    try:
+        with requests.get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            buffer.content_type = response.headers.get("Content-Type")
+            for chunk in response.iter_content(CHUNK_SIZE):
+                buffer.write(chunk)
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+def upload(data, filename=None):
+    """
+    Wrap image data for send_photo / send_document / send_animation so it is streamed
+
+    Args:
+        data (bytes or file-like): Encoded image; bytes are wrapped without
+            copying, file-likes are read from the start
+        filename (str): File name sent to Telegram (defaults to the file's name)
+
+    Returns:
+        telegram.InputFile: Reads the data in chunks while the request is sent
+    """
+    from telegram import InputFile
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = io.BytesIO(data)
+    else:
+        data.seek(0)
+    filename = filename or getattr(data, "name", None)
+    return InputFile(data, filename=os.path.basename(filename) if filename else None, read_file_handle=False)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Idempotent handling of button taps
+
+Three checks run before a guarded handler does any work:
+
+- Session versions: every inline keyboard is stamped with the version of
+  the user's session ("shot_lifestyle|1760871234"), and a new photo starts a
+  new version. Buttons left over from earlier photos, or from before a
+  restart, no longer match and are rejected without touching the session.
+- Callback query ids: a query Telegram delivers twice is handled once.
+- Per-user action locks: while one action of a user is running (a
+  generation, a watermark job, ...), further taps or briefs from that user
+  are answered with a short notice instead of starting the work again.
+- Shutdown: once the bot is shutting down (see close()), no new work is
+  started; users are told to try again after the restart.
+
+Every rejection is counted in DUPLICATE_ACTIONS_AVOIDED_TOTAL by reason.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from metrics import DUPLICATE_ACTIONS_AVOIDED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Separates the action from the session version in callback data
+SEPARATOR = "|"
+
+STALE_MESSAGE = "⌛ این دکمه منقضی شده است. لطفاً از آخرین منو استفاده کنید یا تصویر جدیدی ارسال کنید."
+BUSY_MESSAGE = "⏳ درخواست قبلی شما در حال پردازش است. لطفاً صبر کنید."
+SHUTDOWN_MESSAGE = "🔄 ربات در حال راه‌اندازی مجدد است. لطفاً چند لحظه دیگر دوباره تلاش کنید."
+
+
+def callback_action(data):
+    """Callback data without its session version"""
+    return (data or "").split(SEPARATOR, 1)[0]
+
+
+def callback_version(data):
+    """Session version stamped on callback data, or None for unversioned data"""
+    _, separator, version = (data or "").partition(SEPARATOR)
+    return version if separator else None
+
+
+def versioned_markup(keyboard, version):
+    """
+    Build an inline keyboard whose callback data carries a session version
+
+    Args:
+        keyboard (list): Rows of InlineKeyboardButton
+        version (str): Session version; None leaves the buttons unversioned,
+            so every tap on them is rejected as stale
+
+    Returns:
+        InlineKeyboardMarkup
+    """
+    if version is None:
+        return InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(button.text, callback_data=f"{button.callback_data}{SEPARATOR}{version}")
+            if button.callback_data else button
+            for button in row
+        ]
+        for row in keyboard
+    ])
+
+
+class CallbackGuard:
+    def __init__(self, session_version, max_seen_queries=10_000):
+        """
+        Args:
+            session_version (callable): Returns the current session version
+                of a user id, or None if the user has no session
+            max_seen_queries (int): Callback query ids remembered for dedupe
+        """
+        self.session_version = session_version
+        self.max_seen_queries = max_seen_queries
+        self._seen_queries = OrderedDict()
+        self._locks = {}
+        self.closed = False
+        # Start from the clock so versions don't repeat across restarts
+        self._versions = itertools.count(int(time.time()))
+
+    def new_session(self):
+        """Version for a new session; buttons from earlier sessions become stale"""
+        return str(next(self._versions))
+
+    def seen(self, query_id):
+        """Record a callback query id, returning True if it was seen before"""
+        if query_id in self._seen_queries:
+            return True
+        self._seen_queries[query_id] = None
+        if len(self._seen_queries) > self.max_seen_queries:
+            self._seen_queries.popitem(last=False)
+        return False
+
+    def is_stale(self, user_id, data):
+        current = self.session_version(user_id)
+        return current is None or callback_version(data) != current
+
+    def close(self):
+        """Reject every further action (the bot is shutting down)"""
+        self.closed = True
+
+    def stats(self):
+        """
+        Returns:
+            dict: seen_queries (callback query ids remembered) and
+                busy_users (users with an action running)
+        """
+        return {"seen_queries": len(self._seen_queries), "busy_users": len(self._locks)}
+
+    def busy(self, user_id):
+        lock = self._locks.get(user_id)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, user_id):
+        """Hold the user's action lock (check busy() first; this waits if it is held)"""
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            # Drop idle locks so the table only holds users with running actions
+            if not lock.locked() and self._locks.get(user_id) is lock:
+                del self._locks[user_id]
+
+    def check(self, update):
+        """
+        Decide whether an update may run its handler
+
+        Returns:
+            str: Rejection reason ('duplicate', 'stale', 'busy' or 'shutdown'), or None
+        """
+        user_id = update.effective_user.id
+        query = update.callback_query
+        if query is not None:
+            if self.seen(query.id):
+                return "duplicate"
+        if self.closed:
+            return "shutdown"
+        if query is not None:
+            if self.is_stale(user_id, query.data):
+                return "stale"
+        if self.busy(user_id):
+            return "busy"
+        return None
+
+
+async def _reject(update, reason):
+    """Tell the user why nothing happened (a redelivered query was already answered)"""
+    if reason == "duplicate":
+        return
+    text = {"stale": STALE_MESSAGE, "shutdown": SHUTDOWN_MESSAGE}.get(reason, BUSY_MESSAGE)
+    try:
+        if update.callback_query is not None:
+            await update.callback_query.answer(text)
+        else:
+            await update.message.reply_text(text)
+    except Exception as e:
+        logger.warning(f"Could not answer rejected update: {e}")
+
+
+def guard_action(func):
+    """
+    Decorator for ContentCreatorBot handlers that start work for a user
+
+    Duplicate, stale and concurrent updates are answered and dropped; the
+    handler then returns None, which leaves the conversation state as is.
+    The bot must have a ``callback_guard`` attribute.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, update, context):
+        guard = self.callback_guard
+        user_id = update.effective_user.id
+        reason = guard.check(update)
+        if reason is not None:
+            DUPLICATE_ACTIONS_AVOIDED_TOTAL.labels(reason=reason).inc()
+            logger.info(
+                f"Dropped {reason} update from user {user_id}",
+                extra={"event": "callback.rejected", "reason": reason, "handler": func.__name__}
+            )
+            await _reject(update, reason)
+            return None
+        async with guard.hold(user_id):
+            return await func(self, update, context)
+    return wrapper
@@ -37,6 +37,50 @@ PRODUCT_SHOT_TYPES = {
     }
 }
 
+# Product image render settings. In tiered mode a fast draft is sent first,
+# then the final render is started automatically ("auto") or offered ("offer").
+TIERED_RENDER_MODE = os.getenv('TIERED_RENDER_MODE', 'off')
+DRAFT_RENDER = {
+    "model": os.getenv('DRAFT_RENDER_MODEL', 'sd15'),
+    "reasoning": False
+}
+FINAL_RENDER = {
+    "model": os.getenv('FINAL_RENDER_MODEL', 'sd15'),
+    "reasoning": True
+}
+
+# Prompt sent to the vision specialist workflow for text content
+TEXT_PROMPT_TEMPLATE = "Generate {content_type} content for this product. User request: {user_prompt}"
+
+# Estimated cost (USD) per workflow run, used for batch cost reports
+WORKFLOW_COSTS = {
+    CONTENT_CREATOR_WORKFLOW: float(os.getenv('CONTENT_CREATOR_COST', '0.05')),
+    VISION_SPECIALIST_WORKFLOW: float(os.getenv('VISION_SPECIALIST_COST', '0.01'))
+}
+
+# Workflow warm-keeping (see warmer.py): keep-alive runs while traffic lasts
+# and pre-warming when a photo arrives, within an hourly cost ceiling
+FAL_WARMER = os.getenv('FAL_WARMER', 'off').lower() in ('on', 'true', '1')
+FAL_WARM_IDLE_SECONDS = float(os.getenv('FAL_WARM_IDLE_SECONDS', '300'))  # idle time after which fal scales a workflow down
+FAL_WARM_INTERVAL_SECONDS = float(os.getenv('FAL_WARM_INTERVAL_SECONDS', '240'))  # keep-alive after this much idle time
+FAL_WARM_WINDOW_SECONDS = float(os.getenv('FAL_WARM_WINDOW_SECONDS', '900'))  # keep warming this long after real traffic
+FAL_WARM_MAX_COST_PER_HOUR = float(os.getenv('FAL_WARM_MAX_COST_PER_HOUR', '0.5'))  # USD, at the WORKFLOW_COSTS estimates
+FAL_WARM_IMAGE_URL = os.getenv('FAL_WARM_IMAGE_URL', '')  # image for keep-alive runs; empty uploads a tiny one
+
+# fal backpressure (see resilience.py): runs slower than the latency target,
+# or failing, shrink the concurrency limit; a high error rate opens the circuit
+WORKFLOW_LATENCY_TARGETS = {
+    CONTENT_CREATOR_WORKFLOW: float(os.getenv('CONTENT_CREATOR_LATENCY_TARGET', '60')),
+    VISION_SPECIALIST_WORKFLOW: float(os.getenv('VISION_SPECIALIST_LATENCY_TARGET', '30'))
+}
+FAL_RUN_TIMEOUT_SECONDS = float(os.getenv('FAL_RUN_TIMEOUT_SECONDS', '180'))  # a run taking longer fails
+FAL_CONCURRENCY_MIN = int(os.getenv('FAL_CONCURRENCY_MIN', '2'))
+FAL_CONCURRENCY_MAX = int(os.getenv('FAL_CONCURRENCY_MAX', '64'))  # also the starting limit
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))  # of the last BREAKER_WINDOW runs
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))  # before a trial run
+
 # Text Content Types
 TEXT_CONTENT_TYPES = [
     "Product Description",
@@ -47,6 +91,9 @@ TEXT_CONTENT_TYPES = [
     "Other"
 ]
 
+# Text types generated together by the "full content pack" option
+CONTENT_PACK_TYPES = [content_type for content_type in TEXT_CONTENT_TYPES if content_type != "Other"]
+
 # Watermark Positions
 WATERMARK_POSITIONS = {
     "bottom_right": {
@@ -68,5 +115,97 @@ WATERMARK_POSITIONS = {
     "center": {
         "name": "وسط تصویر",
         "value": "center"
+    },
+    "tiled": {
+        "name": "تکرار مورب در کل تصویر",
+        "value": "tiled"
+    }
+}
+
+# One-tap generation presets run as a pipeline (see pipeline.py)
+PIPELINE_PRESETS = {
+    "hero_social": {
+        "name": "شات قهرمان + واترمارک + کپشن شبکه اجتماعی",
+        "shot": "product_only_hero",
+        "watermark": "bottom_right",
+        "text": "Social Media Post",
+        "brief": "A short, catchy caption for a product post"
+    },
+    "lifestyle_marketing": {
+        "name": "شات لایف‌استایل + واترمارک + متن تبلیغاتی",
+        "shot": "in_context_lifestyle",
+        "watermark": "bottom_left",
+        "text": "Marketing Copy",
+        "brief": "Persuasive copy for an advertising campaign"
     }
-} 
\ No newline at end of file
+}
+
+# Near-duplicate image reuse (perceptual hash index)
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', '6'))
+PHASH_INDEX_MAX_ENTRIES = int(os.getenv('PHASH_INDEX_MAX_ENTRIES', '100000'))
+
+# Local Prometheus-style metrics endpoint (0 disables it)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Per-update tracing: a sample of updates is written to a local JSONL file
+# (summarize with: python tracing.py summarize traces.jsonl)
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+
+# Anonymized traffic recording for replay.py (empty disables it; a .gz name compresses it)
+RECORD_FILE = os.getenv('RECORD_FILE', '')
+
+# Logging: records are written by a background thread, as JSON lines by default
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json or text
+LOG_FILE = os.getenv('LOG_FILE', '')  # empty logs to stderr
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', '2000'))
+# Fraction of records kept per event, e.g. "fal.result=0.1" (warnings and errors are always kept)
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'fal.result=0.1')
+
+# Updates processed at the same time (1 handles one update at a time, so a
+# long generation for one user holds up everyone else)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '1'))
+
+# Watermark compositing backend: pillow, or numpy (vectorized, needs NumPy installed)
+WATERMARK_BACKEND = os.getenv('WATERMARK_BACKEND', 'pillow')
+
+# Tiled watermark: the logo repeated diagonally across the whole image
+WATERMARK_TILE_OPACITY = float(os.getenv('WATERMARK_TILE_OPACITY', '0.25'))  # times the requested opacity
+WATERMARK_TILE_ANGLE = float(os.getenv('WATERMARK_TILE_ANGLE', '30'))  # degrees, counter-clockwise
+
+# Output encoding of images sent to Telegram
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'jpeg')  # jpeg, progressive_jpeg or webp
+OUTPUT_QUALITY = int(os.getenv('OUTPUT_QUALITY', '95'))
+OUTPUT_MIN_QUALITY = int(os.getenv('OUTPUT_MIN_QUALITY', '60'))
+# Byte budget per image, found by quality search (0 = always OUTPUT_QUALITY)
+OUTPUT_MAX_BYTES = int(os.getenv('OUTPUT_MAX_BYTES', '0'))
+OUTPUT_SUBSAMPLING = os.getenv('OUTPUT_SUBSAMPLING', '')  # 4:4:4, 4:2:2, 4:2:0 or empty for Pillow's default
+OUTPUT_PARALLEL_ENCODES = int(os.getenv('OUTPUT_PARALLEL_ENCODES', '1'))
+# Animated GIF/WebP keep their format; lossy quality of each re-encoded WebP frame
+ANIMATED_WATERMARK_QUALITY = int(os.getenv('ANIMATED_WATERMARK_QUALITY', '80'))
+
+# Downloaded and encoded images larger than this move from memory to a
+# memory-mapped temporary file (in BUFFER_DIR, default the system temp dir)
+BUFFER_SPILL_BYTES = int(os.getenv('BUFFER_SPILL_BYTES', str(4 * 1024 * 1024)))
+BUFFER_DIR = os.getenv('BUFFER_DIR', '')
+
+# Callback query ids remembered to drop redelivered button taps
+CALLBACK_DEDUPE_SIZE = int(os.getenv('CALLBACK_DEDUPE_SIZE', '10000'))
+
+# Per-tenant logos uploaded with /logo
+LOGO_DIR = os.getenv('LOGO_DIR', 'logos')
+LOGO_CACHE_MAX_MB = int(os.getenv('LOGO_CACHE_MAX_MB', '64'))  # memory for loaded logo pyramids
+LOGO_MAX_SIZE = int(os.getenv('LOGO_MAX_SIZE', '1024'))  # longest side of a stored logo, pixels
+
+# Graceful shutdown: seconds to let running jobs finish after SIGTERM/SIGINT;
+# jobs still running then are saved and resumed after the restart
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv('SHUTDOWN_DRAIN_SECONDS', '25'))
+PENDING_JOBS_FILE = os.getenv('PENDING_JOBS_FILE', 'pending_jobs.json')
+
+# Admin /stats command: Telegram user ids allowed to use it (comma-separated;
+# empty disables it), default and longest profile length, lines per profile
+ADMIN_USER_IDS = frozenset(int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip())
+STATS_PROFILE_SECONDS = float(os.getenv('STATS_PROFILE_SECONDS', '10'))
+STATS_MAX_PROFILE_SECONDS = float(os.getenv('STATS_MAX_PROFILE_SECONDS', '60'))
+STATS_TOP_N = int(os.getenv('STATS_TOP_N', '25'))
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Live process diagnostics for the admin /stats command
+
+Everything here inspects the running bot without restarting it or
+installing anything up front:
+
+- process_memory() reads resident and peak memory from /proc
+- deep_sizeof() estimates the memory held by plain containers (sessions)
+- TrackedExecutor is a thread pool that reports how busy it is
+- sample_stacks() is a sampling CPU profiler: it snapshots the stack of
+  every thread at a fixed interval from a thread of its own, so the event
+  loop pays nothing but the GIL for the snapshots
+- tracemalloc_top() traces allocations for a few seconds and reports the
+  source lines holding the most memory
+
+The profiles are plain text, ending with collapsed stacks that flamegraph.pl
+and speedscope read directly.
+"""
+
+import asyncio
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Leaf frames of a thread that is waiting, not working: (file name, function)
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socketserver.py", "serve_forever")
+}
+
+
+def process_memory():
+    """
+    Memory of this process
+
+    Returns:
+        dict: rss and peak_rss in bytes, and traced (bytes allocated by
+            Python, or None unless tracemalloc is running)
+    """
+    page_size = resource.getpagesize()
+    rss = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * page_size
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        # Not Linux; ru_maxrss is in kilobytes there too except on macOS
+        pass
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    return {"rss": rss if rss is not None else peak, "peak_rss": peak, "traced": traced}
+
+
+def deep_sizeof(obj, _seen=None):
+    """
+    Approximate memory held by an object and the containers inside it
+
+    Follows dicts, lists, tuples and sets; other objects count their own
+    size only. Objects reached twice are counted once.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, _seen) + deep_sizeof(value, _seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, _seen) for item in obj)
+    return size
+
+
+class TrackedExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that counts its running and queued work items"""
+
+    def __init__(self, max_workers=None, thread_name_prefix=""):
+        if max_workers is None:
+            # ThreadPoolExecutor's own default
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        super().__init__(max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_workers = max_workers
+        self._running = 0
+        self._queued = 0
+        self._usage_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._usage_lock:
+            self._queued += 1
+        try:
+            future = super().submit(self._run, fn, args, kwargs)
+        except BaseException:
+            with self._usage_lock:
+                self._queued -= 1
+            raise
+        future.add_done_callback(self._forget_cancelled)
+        return future
+
+    def _run(self, fn, args, kwargs):
+        with self._usage_lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._usage_lock:
+                self._running -= 1
+
+    def _forget_cancelled(self, future):
+        # Cancelled futures never started running
+        if future.cancelled():
+            with self._usage_lock:
+                self._queued -= 1
+
+    def usage(self):
+        """
+        How busy the pool is
+
+        Returns:
+            tuple: (work items running, max_workers, work items queued)
+        """
+        with self._usage_lock:
+            return self._running, self.max_workers, self._queued
+
+
+def format_bytes(size):
+    if size is None:
+        return "-"
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=0.005, top=25):
+    """
+    Sample the stacks of every other thread and summarize where time goes
+
+    Blocks for the given number of seconds; run it in a worker thread.
+
+    Args:
+        seconds (float): How long to sample
+        interval (float): Seconds between samples
+        top (int): Functions listed in the summary
+
+    Returns:
+        str: Busy share per thread, the top functions by inclusive and self
+            samples, then collapsed stacks ("thread;outer;...;inner count")
+    """
+    own = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                stack = None
+            else:
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack = tuple(reversed(stack))
+            stacks[(names.get(ident, str(ident)), stack)] += 1
+        samples += 1
+        time.sleep(interval)
+
+    per_thread = Counter()
+    busy = Counter()
+    inclusive = Counter()
+    own_samples = Counter()
+    for (thread, stack), count in stacks.items():
+        per_thread[thread] += count
+        if stack is None:
+            continue
+        busy[thread] += count
+        own_samples[stack[-1]] += count
+        for name in set(stack):
+            inclusive[name] += count
+    total_busy = sum(busy.values()) or 1
+
+    lines = [f"CPU profile: {samples} samples over {seconds:.1f}s, every {interval * 1000:.0f} ms", ""]
+    lines.append("Threads (share of samples not waiting):")
+    for thread, count in per_thread.most_common():
+        lines.append(f"  {busy[thread] / count:6.1%}  {thread}")
+    for title, counter in (("inclusive", inclusive), ("self", own_samples)):
+        lines.append("")
+        lines.append(f"Top {top} functions by {title} samples (share of busy samples):")
+        for name, count in counter.most_common(top):
+            lines.append(f"  {count:6d} {count / total_busy:6.1%}  {name}")
+    lines.append("")
+    lines.append("Collapsed stacks:")
+    for (thread, stack), count in stacks.most_common():
+        if stack is not None:
+            lines.append(f"{thread.replace(';', ':')};{';'.join(stack)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+async def tracemalloc_top(seconds, limit=25):
+    """
+    Trace allocations for a while and report the lines holding the most memory
+
+    Only allocations made while tracing are seen, so this shows what the
+    bot allocates (and keeps) during the window. Tracing slows allocation
+    down, and is stopped again afterwards unless it was already running.
+
+    Returns:
+        str: Top source lines by traced size, then the largest tracebacks
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(10)
+    try:
+        await asyncio.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+    ))
+
+    lines = [
+        f"Memory snapshot after tracing for {seconds:.1f}s: {format_bytes(current)} traced, {format_bytes(peak)} peak",
+        "",
+        f"Top {limit} lines by size:"
+    ]
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"  {format_bytes(stat.size):>10s} {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    lines.append("")
+    lines.append("Largest tracebacks:")
+    for stat in snapshot.statistics("traceback")[:5]:
+        lines.append(f"{format_bytes(stat.size)} in {stat.count} blocks")
+        lines.extend(f"  {line}" for line in stat.traceback.format())
+    return "\n".join(lines) + "\n"
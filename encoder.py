@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Size-budgeted output encoder for images sent to Telegram
+
+Encodes as JPEG, progressive JPEG or WebP. With a byte budget, the highest
+quality that fits is found by binary search over the quality range (falling
+back to downscaling if even the lowest quality is too large). In parallel
+mode several candidate qualities are encoded at once on a thread pool
+(Pillow releases the GIL while encoding), so the search takes fewer rounds.
+
+Encode a few files and see what each setting costs:
+    python encoder.py photo.jpg --format webp --max-bytes 300000 --parallel 4
+"""
+
+import argparse
+import io
+import logging
+import os
+import time
+
+from PIL import Image
+
+from config import (
+    OUTPUT_FORMAT,
+    OUTPUT_QUALITY,
+    OUTPUT_MIN_QUALITY,
+    OUTPUT_MAX_BYTES,
+    OUTPUT_SUBSAMPLING,
+    OUTPUT_PARALLEL_ENCODES
+)
+from diagnostics import TrackedExecutor
+from metrics import ENCODE_SECONDS, ENCODED_BYTES, ENCODE_BYTES_SAVED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+# Output formats and their file extensions
+FORMATS = {
+    "jpeg": ".jpg",
+    "progressive_jpeg": ".jpg",
+    "webp": ".webp"
+}
+
+# Downscale attempts when the lowest quality is still over budget
+MAX_DOWNSCALES = 3
+
+
+class EncodeResult:
+    def __init__(self, data, fmt, quality, size, seconds, attempts, original_bytes=None):
+        self.data = data
+        self.format = fmt
+        self.quality = quality
+        self.size = size
+        self.seconds = seconds
+        self.attempts = attempts
+        self.original_bytes = original_bytes
+
+    @property
+    def bytes(self):
+        return len(self.data)
+
+    @property
+    def bytes_saved(self):
+        if self.original_bytes is None:
+            return 0
+        return self.original_bytes - self.bytes
+
+    @property
+    def extension(self):
+        return FORMATS[self.format]
+
+    def describe(self):
+        saved = f", saved {self.bytes_saved / 1024:.0f} KB" if self.original_bytes is not None else ""
+        return (
+            f"{self.format} q{self.quality} {self.size[0]}x{self.size[1]}: {self.bytes / 1024:.0f} KB"
+            f"{saved} in {self.seconds * 1000:.0f} ms ({self.attempts} encodes)"
+        )
+
+
+class ImageEncoder:
+    def __init__(self, fmt="jpeg", quality=95, min_quality=60, max_bytes=0, subsampling=None, parallel=1):
+        """
+        Args:
+            fmt (str): 'jpeg', 'progressive_jpeg' or 'webp'
+            quality (int): Quality used when there is no budget, and the top of
+                the search range when there is one
+            min_quality (int): Lowest quality the search may pick
+            max_bytes (int): Byte budget per image; 0 disables the search
+            subsampling (str): JPEG chroma subsampling ('4:4:4', '4:2:2',
+                '4:2:0'); None keeps Pillow's default
+            parallel (int): Candidate qualities encoded at once during the search
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format {fmt!r}, choose from {', '.join(FORMATS)}")
+        self.format = fmt
+        self.quality = quality
+        self.min_quality = min(min_quality, quality)
+        self.max_bytes = max_bytes
+        self.subsampling = subsampling
+        self.parallel = max(1, parallel)
+        self._pool = TrackedExecutor(self.parallel, thread_name_prefix="encoder") if self.parallel > 1 else None
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            fmt=OUTPUT_FORMAT,
+            quality=OUTPUT_QUALITY,
+            min_quality=OUTPUT_MIN_QUALITY,
+            max_bytes=OUTPUT_MAX_BYTES,
+            subsampling=OUTPUT_SUBSAMPLING or None,
+            parallel=OUTPUT_PARALLEL_ENCODES
+        )
+
+    @property
+    def extension(self):
+        return FORMATS[self.format]
+
+    def pool_usage(self):
+        """(encodes running, threads, encodes queued) of the parallel encode pool, or None without one"""
+        pool = self._pool
+        return pool.usage() if pool is not None else None
+
+    def close(self):
+        """Stop the parallel encode threads"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _save(self, image, quality):
+        buffer = io.BytesIO()
+        if self.format == "webp":
+            image.save(buffer, format="WEBP", quality=quality, method=4)
+        else:
+            options = {"quality": quality}
+            if self.subsampling:
+                options["subsampling"] = self.subsampling
+            if self.format == "progressive_jpeg":
+                options.update(progressive=True, optimize=True)
+            image.save(buffer, format="JPEG", **options)
+        return buffer.getvalue()
+
+    def _encode_many(self, image, qualities):
+        if self._pool is None or len(qualities) == 1:
+            return [self._save(image, quality) for quality in qualities]
+        return list(self._pool.map(lambda quality: self._save(image, quality), qualities))
+
+    def _search(self, image):
+        """
+        Highest quality in [min_quality, quality] that fits the budget
+
+        Returns:
+            tuple: (quality, data, attempts); data is None if nothing fits
+        """
+        data = self._save(image, self.quality)
+        attempts = 1
+        if len(data) <= self.max_bytes:
+            return self.quality, data, attempts
+
+        best = (None, None)
+        low, high = self.min_quality, self.quality - 1
+        while low <= high:
+            # One midpoint in serial mode, evenly spaced candidates in parallel mode
+            count = min(self.parallel, high - low + 1)
+            step = (high - low + 1) / (count + 1)
+            candidates = sorted({low + int(step * (i + 1)) for i in range(count)})
+            results = self._encode_many(image, candidates)
+            attempts += len(candidates)
+
+            fits = [(quality, data) for quality, data in zip(candidates, results) if len(data) <= self.max_bytes]
+            if fits:
+                best = max(fits, key=lambda item: item[0])
+                low = best[0] + 1
+            # Size grows with quality, so the smallest failing candidate above the best fit caps the range
+            too_big = [quality for quality, data in zip(candidates, results) if len(data) > self.max_bytes and quality >= low]
+            if too_big:
+                high = min(too_big) - 1
+        return best[0], best[1], attempts
+
+    def encode(self, image, original_bytes=None):
+        """
+        Encode an image within the byte budget
+
+        Args:
+            image (PIL.Image): Image to encode (converted to RGB if needed)
+            original_bytes (int): Size of the source, to report bytes saved
+
+        Returns:
+            EncodeResult
+        """
+        start = time.perf_counter()
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        attempts = 0
+        if not self.max_bytes:
+            quality, data = self.quality, self._save(image, self.quality)
+            attempts = 1
+        else:
+            for _ in range(MAX_DOWNSCALES + 1):
+                quality, data, tries = self._search(image)
+                attempts += tries
+                if data is not None:
+                    break
+                # Even the lowest quality is too big: shrink so the area roughly matches the budget
+                smallest = len(self._save(image, self.min_quality))
+                attempts += 1
+                scale = max(0.25, min(0.9, (self.max_bytes / smallest) ** 0.5))
+                image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.Resampling.LANCZOS)
+            if data is None:
+                quality, data = self.min_quality, self._save(image, self.min_quality)
+                attempts += 1
+
+        result = EncodeResult(data, self.format, quality, image.size, time.perf_counter() - start, attempts, original_bytes)
+        ENCODE_SECONDS.labels(format=self.format).observe(result.seconds)
+        ENCODED_BYTES.labels(format=self.format).observe(result.bytes)
+        if original_bytes is not None:
+            ENCODE_BYTES_SAVED_TOTAL.labels(format=self.format).inc(max(0, result.bytes_saved))
+        logger.info(
+            f"Encoded image: {result.describe()}",
+            extra={"event": "image.encode", "format": self.format, "quality": quality, "bytes": result.bytes,
+                   "bytes_saved": result.bytes_saved, "encode_ms": round(result.seconds * 1000, 1)}
+        )
+        return result
+
+    def reencode(self, data):
+        """
+        Re-encode downloaded image bytes if that makes them smaller
+
+        Images already within the budget (or any image, when there is no
+        budget) are passed through untouched, as is any re-encode that
+        doesn't come out smaller.
+        
+        Args:
+            data (bytes or buffers.SpooledBuffer): Encoded image
+        
+        Returns:
+            bytes or buffers.SpooledBuffer: The smaller of the original and the re-encoded image
+        """
+        if not self.max_bytes or len(data) <= self.max_bytes:
+            return data
+        try:
+            if hasattr(data, "read"):
+                data.seek(0)
+                source = data
+            else:
+                source = io.BytesIO(data)
+            # Closing the image leaves a buffer passed in open for the caller
+            with Image.open(source) as image:
+                result = self.encode(image, original_bytes=len(data))
+        except Exception as e:
+            logger.error(f"Error re-encoding image: {e}")
+            return data
+        return result.data if result.bytes < len(data) else data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="Image files to encode")
+    parser.add_argument("--format", choices=list(FORMATS), nargs="+", default=list(FORMATS))
+    parser.add_argument("--max-bytes", type=int, default=300_000, help="Byte budget (0 for a fixed quality)")
+    parser.add_argument("--quality", type=int, default=95)
+    parser.add_argument("--min-quality", type=int, default=60)
+    parser.add_argument("--subsampling", choices=["4:4:4", "4:2:2", "4:2:0"])
+    parser.add_argument("--parallel", type=int, default=1, help="Candidate qualities encoded at once")
+    args = parser.parse_args()
+
+    print(f"{'image':28s} {'format':17s} {'quality':>7s} {'KB':>8s} {'saved':>7s} {'ms':>8s} {'encodes':>8s}")
+    print("=" * 88)
+    for path in args.images:
+        original_bytes = os.path.getsize(path)
+        image = Image.open(path)
+        image.load()
+        for fmt in args.format:
+            encoder = ImageEncoder(fmt, args.quality, args.min_quality, args.max_bytes, args.subsampling, args.parallel)
+            result = encoder.encode(image, original_bytes=original_bytes)
+            print(
+                f"{os.path.basename(path)[:28]:28s} {fmt:17s} {result.quality:7d} {result.bytes / 1024:8.0f} "
+                f"{result.bytes_saved / original_bytes:7.0%} {result.seconds * 1000:8.1f} {result.attempts:8d}"
+            )
+
+
+if __name__ == "__main__":
+    main()
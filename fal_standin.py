@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the fal workflow and storage endpoints
+
+Implements the part of the fal_client async API that FalAPIClient uses, so the
+bot and batch tools can run end-to-end without credentials or network access.
+Generated images and uploads are served from a small local HTTP server; the
+least recently used uploads are dropped once they exceed max_upload_bytes.
+"""
+
+import asyncio
+import io
+import itertools
+import logging
+import os
+import random
+import threading
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from config import CONTENT_CREATOR_WORKFLOW
+
+logger = logging.getLogger(__name__)
+
+
+class FalStandIn:
+    def __init__(
+        self, latency=(0.5, 2.0), failure_rate=0.0, image_size=(1024, 1024), seed=None, draft_factor=0.3,
+        cold_start=0.0, idle_timeout=60.0, max_upload_bytes=64 * 1024 * 1024
+    ):
+        """
+        Args:
+            latency (float, tuple, callable or dict): Seconds per workflow run, a
+                (min, max) range, or a function of a random.Random returning seconds;
+                a dict gives one of these per workflow
+            draft_factor (float): Latency multiplier for draft runs (reasoning=False)
+            cold_start (float): Extra seconds for the first run of a workflow
+                after it has been idle for idle_timeout; runs arriving while
+                it starts wait for the same start
+            idle_timeout (float): Seconds without runs after which a workflow goes cold
+            failure_rate (float): Fraction of runs that end with an error event
+            image_size (tuple): Size of the generated images
+            seed (int): Random seed for reproducible latency and failures
+            max_upload_bytes (int): Uploads kept for download; past this the least
+                recently used are dropped (generated images take no space)
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.image_size = image_size
+        self.draft_factor = draft_factor
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.calls = Counter()
+        self.cold_starts = Counter()
+        self._ready_at = {}  # application -> loop time its worker is (or was) up
+        self._last_active = {}  # application -> loop time its last run ended
+        self._running = Counter()
+        self.uploads = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self.max_upload_bytes = max_upload_bytes
+        self._blobs = OrderedDict()  # name -> (content_type, data), least recently used first
+        self._blob_bytes = 0
+        self._blobs_lock = threading.Lock()  # the storage server reads from its own threads
+        self._generated_image = None
+        self._server = None
+        self.base_url = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start the local storage server"""
+        if self._server is not None:
+            return
+
+        standin = self
+
+        class StorageHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                blob = standin._fetch(self.path.rsplit("/", 1)[-1])
+                if blob is None:
+                    self.send_error(404)
+                    return
+                content_type, data = blob
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), StorageHandler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"fal stand-in storage listening on {self.base_url}")
+
+    def stop(self):
+        """Stop the local storage server"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _store(self, data, content_type, file_name=None):
+        self.start()
+        extension = os.path.splitext(file_name or "")[1] or ".bin"
+        name = f"{next(self._ids)}{extension}"
+        with self._blobs_lock:
+            self._blobs[name] = (content_type, data)
+            self._blob_bytes += len(data)
+            # The newest upload stays even if it alone is over the limit
+            while self._blob_bytes > self.max_upload_bytes and len(self._blobs) > 1:
+                _, (_, dropped) = self._blobs.popitem(last=False)
+                self._blob_bytes -= len(dropped)
+        return f"{self.base_url}/files/{name}"
+
+    def _fetch(self, name):
+        """Return (content_type, data) for a served file name, or None"""
+        if name.startswith("generated-"):
+            return "image/jpeg", self._generated_image
+        with self._blobs_lock:
+            blob = self._blobs.get(name)
+            if blob is not None:
+                self._blobs.move_to_end(name)
+        return blob
+
+    def _sample_latency(self, application):
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency[application]
+        if callable(latency):
+            return latency(self._random)
+        if isinstance(latency, (tuple, list)):
+            return self._random.uniform(*latency)
+        return latency
+
+    def _render_image(self):
+        # Every generated image shares the same bytes, only the URL differs
+        if self._generated_image is None:
+            width, height = self.image_size
+            image = Image.linear_gradient("L").resize(self.image_size).convert("RGB")
+            image.paste((40, 90, 160), (width // 4, height // 4, width * 3 // 4, height * 3 // 4))
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=90)
+            self._generated_image = buffer.getvalue()
+        self.start()
+        return f"{self.base_url}/files/generated-{next(self._ids)}.jpg"
+
+    def _start_delay(self, application):
+        """Seconds until a worker for the application is up, starting one if it went cold"""
+        if not self.cold_start:
+            return 0.0
+        now = asyncio.get_running_loop().time()
+        idle = now - self._last_active.get(application, float("-inf"))
+        if not self._running[application] and idle > self.idle_timeout and self._ready_at.get(application, 0) <= now:
+            self.cold_starts[application] += 1
+            self._ready_at[application] = now + self.cold_start
+        return max(0.0, self._ready_at.get(application, 0) - now)
+    
+    async def stream_async(self, application, arguments, **kwargs):
+        """Stream events for a workflow run, mirroring fal_client.stream_async"""
+        self.calls[application] += 1
+        yield {"type": "submit", "app_id": application}
+        
+        latency = self._sample_latency(application)
+        if arguments.get("reasoning") is False:
+            latency *= self.draft_factor
+        latency += self._start_delay(application)
+        self._running[application] += 1
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            self._running[application] -= 1
+            self._last_active[application] = asyncio.get_running_loop().time()
+
+        if self._random.random() < self.failure_rate:
+            yield {"type": "error", "error": {"message": "Injected stand-in failure"}}
+            return
+
+        if application == CONTENT_CREATOR_WORKFLOW:
+            output = {"images": [{"url": self._render_image()}]}
+        else:
+            output = {"output": f"[stand-in] {arguments.get('prompt', '')}"}
+        yield {"type": "output", "output": output}
+
+    async def upload_async(self, data, content_type, file_name=None, **kwargs):
+        """Store bytes and return their URL, mirroring fal_client.upload_async"""
+        self.uploads += 1
+        return self._store(data, content_type, file_name)
+
+    async def upload_file_async(self, path, **kwargs):
+        """Store a local file and return its URL, mirroring fal_client.upload_file_async"""
+        with open(path, "rb") as f:
+            data = f.read()
+        return await self.upload_async(data, "application/octet-stream", str(path))
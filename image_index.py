@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash index for reusing earlier generations on near-duplicate product images
+
+Results are recorded per tenant (the same id the logo registry uses), so
+one seller is never offered another seller's generations.
+"""
+
+import hashlib
+import logging
+from itertools import combinations
+
+from PIL import Image
+
+from metrics import IMAGE_INDEX_LOOKUPS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+
+def compute_phash(image, hash_size=8):
+    """
+    Compute a 64-bit difference hash (dHash) of an image
+
+    Args:
+        image (PIL.Image): Image to hash
+        hash_size (int): Number of rows in the hash grid (hash_size ** 2 bits)
+
+    Returns:
+        int: Perceptual hash of the image
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+
+    phash = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            phash = (phash << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return phash
+
+
+# int.bit_count is only available on Python 3.10+
+_popcount = getattr(int, "bit_count", None) or (lambda value: bin(value).count("1"))
+
+
+def text_key(content_type, user_prompt):
+    """
+    Result key of a generated text: its content type and a digest of the brief
+    
+    The same photo with a different brief is a different text.
+    """
+    digest = hashlib.sha256(" ".join(user_prompt.split()).encode("utf-8")).hexdigest()[:16]
+    return f"{content_type}:{digest}"
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return _popcount(a ^ b)
+
+
+class PerceptualHashIndex:
+    def __init__(self, max_distance=6, num_chunks=4, max_entries=None):
+        """
+        Multi-index hash table over 64-bit perceptual hashes
+
+        Every hash is split into ``num_chunks`` chunks and each chunk is indexed
+        in its own table. Two hashes within ``max_distance`` bits of each other
+        must agree on at least one chunk up to ``max_distance // num_chunks``
+        bits, so a lookup only probes those few chunk variants instead of
+        scanning every stored hash.
+
+        Args:
+            max_distance (int): Largest Hamming distance that counts as a match
+            num_chunks (int): Number of chunks each hash is split into
+            max_entries (int): Oldest entries are evicted beyond this size
+        """
+        if HASH_BITS % num_chunks:
+            raise ValueError("num_chunks must divide 64")
+
+        self.max_distance = max_distance
+        self.num_chunks = num_chunks
+        self.max_entries = max_entries
+        self.chunk_bits = HASH_BITS // num_chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._tables = [{} for _ in range(num_chunks)]
+        # Insertion ordered, oldest first; values hold recorded results
+        self._entries = {}
+
+        # Every chunk variant within the per-chunk radius
+        chunk_radius = max_distance // num_chunks
+        self._probe_masks = [0]
+        for radius in range(1, chunk_radius + 1):
+            for bits in combinations(range(self.chunk_bits), radius):
+                mask = 0
+                for bit in bits:
+                    mask |= 1 << bit
+                self._probe_masks.append(mask)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _chunks(self, phash):
+        for i in range(self.num_chunks):
+            yield i, (phash >> (i * self.chunk_bits)) & self._chunk_mask
+
+    def add(self, phash):
+        """
+        Add a hash to the index
+
+        Args:
+            phash (int): Perceptual hash to add
+        """
+        if phash in self._entries:
+            return
+
+        self._entries[phash] = None
+        for i, chunk in self._chunks(phash):
+            self._tables[i].setdefault(chunk, []).append(phash)
+
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, phash):
+        """Remove a hash and its recorded results from the index"""
+        if phash not in self._entries:
+            return
+
+        del self._entries[phash]
+        for i, chunk in self._chunks(phash):
+            bucket = self._tables[i][chunk]
+            bucket.remove(phash)
+            if not bucket:
+                del self._tables[i][chunk]
+
+    def lookup(self, phash):
+        """
+        Find stored hashes within max_distance of the given hash
+
+        Args:
+            phash (int): Perceptual hash to look up
+
+        Returns:
+            list: (distance, stored_hash) pairs, closest first
+        """
+        popcount = _popcount
+        max_distance = self.max_distance
+        found = {}
+        for i, chunk in self._chunks(phash):
+            table = self._tables[i]
+            for mask in self._probe_masks:
+                bucket = table.get(chunk ^ mask)
+                if not bucket:
+                    continue
+                for candidate in bucket:
+                    if popcount(phash ^ candidate) <= max_distance:
+                        found[candidate] = None
+
+        return sorted((hamming_distance(phash, candidate), candidate) for candidate in found)
+
+    def record(self, tenant, phash, kind, key, value):
+        """
+        Remember a generation result for an image
+        
+        Args:
+            tenant: Whose result it is (e.g. a Telegram user id)
+            phash (int): Perceptual hash of the input image
+            kind (str): Result kind, e.g. 'shot' or 'text'
+            key (str): Shot type id, or text_key() of a text
+            value: Result to remember (image URL or generated text)
+        """
+        self.add(phash)
+        results = self._entries[phash]
+        if results is None:
+            results = self._entries[phash] = {}
+        results.setdefault(kind, {})[(tenant, key)] = value
+    
+    def find(self, tenant, phash, kind, key):
+        """
+        Find the closest previous result of a tenant for a near-duplicate image
+        
+        Args:
+            tenant: Whose results to search
+            phash (int): Perceptual hash of the input image
+            kind (str): Result kind, e.g. 'shot' or 'text'
+            key (str): Shot type id, or text_key() of a text
+        
+        Returns:
+            Previous result or None if no near-duplicate has one
+        """
+        for distance, candidate in self.lookup(phash):
+            results = self._entries.get(candidate) or {}
+            value = results.get(kind, {}).get((tenant, key))
+            if value is not None:
+                logger.info(f"Reusable {kind} result found for {key} (distance: {distance})")
+                IMAGE_INDEX_LOOKUPS_TOTAL.labels(kind=kind, result="hit").inc()
+                return value
+        IMAGE_INDEX_LOOKUPS_TOTAL.labels(kind=kind, result="miss").inc()
+        return None
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+In-flight job tracking for graceful shutdown
+
+Handlers register the paid work they start (a fal generation, a watermark
+job, ...) as a Job, with the arguments needed to run it again and, once
+known, its result. On shutdown, drain() waits for the running jobs up to a
+deadline and cancels the rest. The cancelled jobs are saved to a file and
+handed back by load() after the restart, so their results can still be
+delivered.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+from metrics import SHUTDOWN_JOBS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, user_id, kind, args, task):
+        self.user_id = user_id
+        self.kind = kind
+        self.args = args
+        self.task = task
+        self.result = None
+        self.started = time.time()
+        self.interrupted = False
+        self._depth = 1
+
+    def to_record(self):
+        return {
+            "user_id": self.user_id,
+            "kind": self.kind,
+            "args": self.args,
+            "result": self.result,
+            "started": self.started
+        }
+
+
+class JobTracker:
+    def __init__(self, path, drain_seconds):
+        """
+        Args:
+            path (str): JSON file that unfinished jobs are saved to on shutdown
+            drain_seconds (float): How long drain() waits for running jobs
+        """
+        self.path = path
+        self.drain_seconds = drain_seconds
+        self._jobs = {}  # task -> Job
+        self._interrupted = []
+        self._hurry = asyncio.Event()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def kinds(self):
+        """Number of running jobs of each kind"""
+        return Counter(job.kind for job in self._jobs.values())
+
+    def start(self, user_id, kind, **args):
+        """
+        Register the job the current task is starting
+
+        A task that already runs a job (e.g. a resumed job calling the
+        method that normally starts it) keeps that job instead of starting
+        a second one; pair every start() with a finish().
+
+        Args:
+            user_id (int): Who the result goes to
+            kind (str): What to run again after a restart (see ContentCreatorBot.resume_job)
+            **args: JSON-serializable arguments for running it again; keep
+                secrets out (e.g. a Telegram file id rather than its URL,
+                which contains the bot token)
+
+        Returns:
+            Job: Set job.result as soon as a paid result is known
+        """
+        task = asyncio.current_task()
+        job = self._jobs.get(task)
+        if job is not None:
+            job._depth += 1
+            return job
+        job = self._jobs[task] = Job(user_id, kind, args, task)
+        return job
+
+    def finish(self, job):
+        """Unregister a job; jobs cancelled by drain() are kept for saving"""
+        job._depth -= 1
+        if job._depth > 0:
+            return
+        self._jobs.pop(job.task, None)
+        if job.interrupted:
+            self._interrupted.append(job)
+
+    def hurry(self):
+        """Stop waiting in drain() and cancel the remaining jobs now (second signal)"""
+        self._hurry.set()
+
+    async def drain(self, timeout=None):
+        """
+        Wait for the running jobs, cancelling those still running at the deadline
+
+        Args:
+            timeout (float): Seconds to wait (default: drain_seconds)
+
+        Returns:
+            list: Records of the jobs that didn't finish
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.drain_seconds if timeout is None else timeout)
+        drained = len(self._jobs)
+        hurry = asyncio.ensure_future(self._hurry.wait())
+        try:
+            # Jobs can start other jobs while they finish (e.g. a draft starting its upgrade)
+            while self._jobs and not self._hurry.is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                logger.info(f"Draining {len(self._jobs)} jobs, {remaining:.0f}s left")
+                await asyncio.wait(set(self._jobs) | {hurry}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                drained = max(drained, len(self._jobs))
+        finally:
+            hurry.cancel()
+
+        for job in list(self._jobs.values()):
+            job.interrupted = True
+            job.task.cancel()
+        if self._jobs:
+            # Let the cancelled handlers unwind and call finish()
+            await asyncio.wait(set(self._jobs), timeout=5)
+        for job in list(self._jobs.values()):
+            # Never finished unwinding; keep it anyway
+            self._jobs.pop(job.task, None)
+            self._interrupted.append(job)
+
+        records = [job.to_record() for job in self._interrupted]
+        SHUTDOWN_JOBS_TOTAL.labels(outcome="interrupted").inc(len(records))
+        SHUTDOWN_JOBS_TOTAL.labels(outcome="drained").inc(max(0, drained - len(records)))
+        logger.info(
+            f"Drain finished: {len(records)} unfinished jobs",
+            extra={"event": "shutdown.drain", "unfinished": len(records)}
+        )
+        return records
+
+    def save(self, records):
+        """
+        Write unfinished jobs for the next start (an empty list removes the file)
+
+        The file holds what users asked for (their prompts), so only the
+        bot's own user may read it.
+        """
+        if not records:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temporary = f"{self.path}.tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(temporary, self.path)
+        logger.info(f"Saved {len(records)} unfinished jobs to {self.path}")
+
+    def load(self):
+        """
+        Take the jobs saved by the previous run
+
+        The file is removed, so each job is handed out once.
+
+        Returns:
+            list: Job records (user_id, kind, args, result, started)
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read unfinished jobs from {self.path}: {e}")
+            return []
+        os.remove(self.path)
+        return records
@@ -0,0 +1,741 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of ContentCreatorBot against local stand-ins
+
+A fake Telegram Bot API (getUpdates long polling, sendMessage, sendPhoto,
+file downloads, ...) and the fal stand-in replace the real services, so the
+bot runs unmodified through python-telegram-bot and its ConversationHandler.
+Synthetic users send photos, tap buttons and type briefs, waiting for the
+bot's replies like a person would. Latency and failure rates of both
+stand-ins are configurable.
+
+Reports throughput, per-step latency percentiles, event loop lag and memory.
+Save a run with --save and compare later runs against it with --compare to
+catch regressions.
+
+Examples:
+    python load_test.py --users 2000 --ramp 60
+    python load_test.py --users 500 --fal-latency lognormal:2:0.5 --telegram-failure-rate 0.01
+    python load_test.py --users 1000 --save baseline.json
+    python load_test.py --users 1000 --compare baseline.json
+    python load_test.py --users 200 --double-tap 0.5
+    python load_test.py --users 200 --record recording.jsonl.gz  (traffic for replay.py)
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import math
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from collections import Counter, defaultdict
+
+# Synthetic users overlap, so the bot under test handles updates concurrently
+# (config reads this on import; the bot's own default is one at a time)
+os.environ.setdefault("CONCURRENT_UPDATES", "64")
+
+from aiohttp import web
+from PIL import Image
+
+import recording
+from api_client import FalAPIClient
+from async_logging import setup_logging
+from bot import ContentCreatorBot
+from callback_guard import SEPARATOR, callback_version
+from config import PRODUCT_SHOT_TYPES, TEXT_CONTENT_TYPES, WATERMARK_POSITIONS, PIPELINE_PRESETS
+from fal_standin import FalStandIn
+from metrics import DUPLICATE_ACTIONS_AVOIDED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+TOKEN = "123456:LOAD-TEST"
+MAIN_MENU_BUTTON = "product_image"
+PROMPT_MARKER = "لطفاً توضیح دهید"
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution
+
+    Accepted forms (seconds):
+        '0.2'                 constant
+        '0.1-0.5'             uniform between the two values
+        'lognormal:MEDIAN:SIGMA'  long-tailed, e.g. 'lognormal:2:0.5'
+        'exp:MEAN'            exponential
+
+    Returns:
+        float, tuple or callable taking a random.Random (as FalStandIn accepts)
+    """
+    if spec.startswith("lognormal:"):
+        _, median, sigma = spec.split(":")
+        mu, sigma = math.log(float(median)), float(sigma)
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if spec.startswith("exp:"):
+        rate = 1.0 / float(spec.split(":")[1])
+        return lambda rng: rng.expovariate(rate)
+    if "-" in spec:
+        low, high = spec.split("-")
+        return (float(low), float(high))
+    return float(spec)
+
+
+def sample(latency, rng):
+    if callable(latency):
+        return latency(rng)
+    if isinstance(latency, tuple):
+        return rng.uniform(*latency)
+    return latency
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def rss_mb():
+    """Current resident set size in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def make_photos(count, size=512, seed=0):
+    """Distinct JPEG product photos (random color blocks give distinct perceptual hashes)"""
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+        for _ in range(12):
+            x, y = rng.randrange(size), rng.randrange(size)
+            w, h = rng.randrange(size // 8, size // 2), rng.randrange(size // 8, size // 2)
+            image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, min(size, x + w), min(size, y + h)))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+class FakeTelegramAPI:
+    def __init__(self, photos, latency=0.0, failure_rate=0.0, seed=None, poll_timeout=1.0):
+        """
+        Local stand-in for the Telegram Bot API
+
+        Serves the methods the bot uses under /bot<token>/<method> and photo
+        downloads under /file/bot<token>/<path>. Every bot call except polling
+        is delayed by ``latency`` and fails with a 502 at ``failure_rate``.
+
+        Args:
+            photos (list): JPEG bytes the synthetic users send
+            latency: Seconds per call (see parse_latency)
+            failure_rate (float): Fraction of calls answered with an error
+            seed (int): Random seed for latency and failures
+            poll_timeout (float): Longest a getUpdates call waits for updates
+        """
+        self.photos = photos
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.poll_timeout = poll_timeout
+        self.calls = Counter()
+        self.failures = Counter()
+        self.updates_pushed = 0
+        self._random = random.Random(seed)
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._inboxes = defaultdict(asyncio.Queue)
+        self._runner = None
+        self.base_url = None
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 2**20)
+        app.router.add_post(f"/bot{TOKEN}/{{method}}", self._handle_method)
+        app.router.add_get(f"/file/bot{TOKEN}/photos/{{index}}.jpg", self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self._runner, sock).start()
+        self.base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    async def stop(self):
+        self._new_updates.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def inbox(self, chat_id):
+        """Queue of the bot's messages, edits and photos for one chat"""
+        return self._inboxes[chat_id]
+
+    def push_update(self, payload):
+        payload["update_id"] = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(payload)
+        self.updates_pushed += 1
+        self._new_updates.set()
+
+    def new_message_id(self):
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    async def _handle_file(self, request):
+        self.calls["file_download"] += 1
+        await asyncio.sleep(sample(self.latency, self._random))
+        return web.Response(body=self.photos[int(request.match_info["index"])], content_type="image/jpeg")
+
+    async def _handle_method(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+
+        await asyncio.sleep(sample(self.latency, self._random))
+        if method not in ("getMe", "deleteWebhook") and self._random.random() < self.failure_rate:
+            self.failures[method] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 502, "description": "Bad Gateway (injected)"}, status=502
+            )
+
+        handler = getattr(self, f"_method_{method}", None)
+        return self._ok(handler(params) if handler else True)
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = min(float(params.get("timeout") or 0), self.poll_timeout)
+
+        # Updates below the offset have been confirmed by the bot
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _message(self, params, **fields):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": int(params.get("message_id") or self.new_message_id()),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields
+        }
+        buttons = []
+        if params.get("reply_markup"):
+            markup = params["reply_markup"]
+            markup = json.loads(markup) if isinstance(markup, str) else markup
+            buttons = [button.get("callback_data") for row in markup.get("inline_keyboard", []) for button in row]
+        self._inboxes[chat_id].put_nowait({
+            "kind": fields.get("kind_hint", "message"),
+            "message_id": message["message_id"],
+            "text": params.get("text") or params.get("caption") or "",
+            "buttons": buttons,
+            "time": time.perf_counter()
+        })
+        message.pop("kind_hint", None)
+        return message
+
+    def _method_getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "Load Test", "username": "load_test_bot"}
+
+    def _method_getFile(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_path": f"photos/{file_id.split('-')[1]}.jpg"}
+
+    def _method_sendMessage(self, params):
+        return self._message(params, text=params.get("text", ""))
+
+    def _method_editMessageText(self, params):
+        return self._message(params, text=params.get("text", ""), kind_hint="edit")
+
+    def _method_sendPhoto(self, params):
+        photo = {"file_id": "sent", "file_unique_id": "sent", "width": 1, "height": 1}
+        return self._message(params, photo=[photo], kind_hint="photo")
+
+    def _method_sendDocument(self, params):
+        document = {"file_id": "sent", "file_unique_id": "sent"}
+        return self._message(params, document=document, kind_hint="document")
+    
+    def _method_sendAnimation(self, params):
+        animation = {"file_id": "sent", "file_unique_id": "sent", "width": 1, "height": 1, "duration": 1}
+        return self._message(params, animation=animation, kind_hint="animation")
+
+
+class UserTimeout(Exception):
+    pass
+
+
+class SyntheticUser:
+    def __init__(self, chat_id, telegram, rng, think, timeout, double_tap=0.0):
+        self.chat_id = chat_id
+        self.telegram = telegram
+        self.rng = rng
+        self.think = think
+        self.timeout = timeout
+        self.double_tap = double_tap
+        self.inbox = telegram.inbox(chat_id)
+        self.last_message_id = None
+        # Session version of the latest keyboard, stamped on taps like a real button would be
+        self.session_version = None
+        self.errors = 0
+        self.timings = []
+
+    def _sender(self):
+        return {"id": self.chat_id, "is_bot": False, "first_name": f"User {self.chat_id}"}
+
+    def _chat(self):
+        return {"id": self.chat_id, "type": "private"}
+
+    async def pause(self):
+        await asyncio.sleep(sample(self.think, self.rng))
+
+    def send_photo(self, photo_index):
+        file_id = f"photo-{photo_index}-{self.chat_id}"
+        self.telegram.push_update({"message": {
+            "message_id": self.telegram.new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(),
+            "from": self._sender(),
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 512, "height": 512}]
+        }})
+
+    def send_document(self, file_index, mime_type):
+        """Send a photo as a file (e.g. an animated GIF or a logo); the bytes are those of the photo"""
+        file_id = f"photo-{file_index}-{self.chat_id}"
+        self.telegram.push_update({"message": {
+            "message_id": self.telegram.new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(),
+            "from": self._sender(),
+            "document": {"file_id": file_id, "file_unique_id": file_id, "mime_type": mime_type}
+        }})
+    
+    def send_text(self, text):
+        self.telegram.push_update({"message": {
+            "message_id": self.telegram.new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(),
+            "from": self._sender(),
+            "text": text
+        }})
+    
+    def send_command(self, command, args=()):
+        text = " ".join((f"/{command}", *args))
+        self.telegram.push_update({"message": {
+            "message_id": self.telegram.new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(),
+            "from": self._sender(),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command) + 1}]
+        }})
+
+    def click(self, data):
+        if self.session_version is not None:
+            data = f"{data}{SEPARATOR}{self.session_version}"
+        self._push_callback(data)
+        if self.rng.random() < self.double_tap:
+            # Impatient second tap on the same button
+            self._push_callback(data)
+
+    def _push_callback(self, data):
+        self.telegram.push_update({"callback_query": {
+            "id": f"{self.chat_id}-{self.telegram.updates_pushed}",
+            "from": self._sender(),
+            "chat_instance": str(self.chat_id),
+            "data": data,
+            "message": {
+                "message_id": self.last_message_id or 1,
+                "date": int(time.time()),
+                "chat": self._chat(),
+                "text": ""
+            }
+        }})
+
+    async def expect(self, predicate):
+        """Wait for the first bot output matching predicate"""
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise UserTimeout()
+            try:
+                event = await asyncio.wait_for(self.inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                raise UserTimeout()
+            self.observe(event)
+            if predicate(event):
+                return event
+    
+    def observe(self, event):
+        """Take note of a bot output: errors, and the keyboard the next tap comes from"""
+        if event["text"].startswith(("❌", "⚠️")):
+            # An error, or a fast-fail notice while a circuit is open
+            self.errors += 1
+        if event["buttons"]:
+            self.last_message_id = event["message_id"]
+            self.session_version = callback_version(event["buttons"][0])
+
+    async def step(self, name, action, predicate):
+        """Perform an action and time it until the expected reply arrives"""
+        await self.pause()
+        start = time.perf_counter()
+        action()
+        event = await self.expect(predicate)
+        self.timings.append((name, event["time"] - start))
+        return event
+
+
+def has_button(*prefixes):
+    return lambda event: any(button and button.startswith(prefixes) for button in event["buttons"])
+
+
+def is_photo(event):
+    return event["kind"] == "photo"
+
+
+def is_prompt(event):
+    return PROMPT_MARKER in event["text"]
+
+
+async def upload(user, photos):
+    await user.step("upload_photo", lambda: user.send_photo(user.rng.randrange(len(photos))), has_button(MAIN_MENU_BUTTON))
+
+
+async def scenario_image(user, photos):
+    await upload(user, photos)
+    shot_id = user.rng.choice(list(PRODUCT_SHOT_TYPES))
+    await user.step("open_menu", lambda: user.click("product_image"), has_button("shot_"))
+
+    event = await user.step("generate_image", lambda: user.click(f"shot_{shot_id}"), lambda e: is_photo(e) or has_button("reuse_shot_")(e))
+    if not is_photo(event):
+        # A near-duplicate photo was seen before: reuse or regenerate
+        choice = user.rng.choice(("reuse_shot_", "regen_shot_"))
+        await user.step("generate_image_" + choice.split("_")[0], lambda: user.click(f"{choice}{shot_id}"), is_photo)
+    await user.expect(has_button("watermark_no"))
+
+    if user.rng.random() < 0.5:
+        position = user.rng.choice(list(WATERMARK_POSITIONS))
+        await user.step("open_menu", lambda: user.click("watermark_yes"), has_button("watermark_"))
+        await user.step("watermark", lambda: user.click(f"watermark_{position}"), is_photo)
+        await user.expect(has_button(MAIN_MENU_BUTTON))
+    else:
+        await user.step("open_menu", lambda: user.click("watermark_no"), has_button(MAIN_MENU_BUTTON))
+
+
+async def scenario_text(user, photos):
+    await upload(user, photos)
+    content_type = user.rng.choice(TEXT_CONTENT_TYPES)
+    await user.step("open_menu", lambda: user.click("text_content"), has_button("text_"))
+
+    await user.step("open_menu", lambda: user.click(f"text_{content_type}"), is_prompt)
+    
+    # The same brief for a near-duplicate photo is offered the earlier text first
+    is_text = lambda e: e["text"].startswith(("✅", "❌", "⚠️"))
+    event = await user.step("generate_text", lambda: user.send_text("برای معرفی محصول در شبکه‌های اجتماعی"), lambda e: is_text(e) or has_button("reuse_text_")(e))
+    if not is_text(event):
+        if user.rng.random() < 0.5:
+            await user.step("reuse_text", lambda: user.click(f"reuse_text_{content_type}"), has_button(MAIN_MENU_BUTTON))
+            return
+        await user.step("generate_text", lambda: user.click(f"new_text_{content_type}"), is_text)
+    await user.expect(has_button(MAIN_MENU_BUTTON))
+
+
+async def scenario_preset(user, photos):
+    await upload(user, photos)
+    preset_id = user.rng.choice(list(PIPELINE_PRESETS))
+    await user.step("open_menu", lambda: user.click("presets"), has_button("preset_"))
+    await user.step("preset", lambda: user.click(f"preset_{preset_id}"), is_photo)
+    await user.expect(has_button(MAIN_MENU_BUTTON))
+
+
+SCENARIOS = {
+    "image": scenario_image,
+    "text": scenario_text,
+    "preset": scenario_preset
+}
+
+
+def parse_mix(spec):
+    """Parse 'image=5,text=3,preset=2' into scenario weights"""
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run_user(user, scenario, photos, results):
+    start = time.perf_counter()
+    try:
+        await SCENARIOS[scenario](user, photos)
+        outcome = "error" if user.errors else "ok"
+    except UserTimeout:
+        outcome = "timeout"
+    except Exception as e:
+        logger.error(f"Synthetic user {user.chat_id} failed: {e}")
+        outcome = "exception"
+    results.append({
+        "scenario": scenario,
+        "outcome": outcome,
+        "seconds": time.perf_counter() - start,
+        "timings": user.timings
+    })
+
+
+async def monitor(stats, stop):
+    """Sample event loop lag and memory until stopped"""
+    interval = 0.05
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats["loop_lag"].append(time.perf_counter() - start - interval)
+        stats["rss"].append(rss_mb())
+
+
+async def run_load_test(args):
+    rng = random.Random(args.seed)
+    photos = make_photos(args.photos, seed=args.seed)
+    mix = parse_mix(args.mix)
+
+    telegram = FakeTelegramAPI(
+        photos,
+        latency=parse_latency(args.telegram_latency),
+        failure_rate=args.telegram_failure_rate,
+        seed=args.seed
+    )
+    await telegram.start()
+
+    with FalStandIn(latency=parse_latency(args.fal_latency), failure_rate=args.fal_failure_rate, seed=args.seed) as fal:
+        bot = ContentCreatorBot(api_client=FalAPIClient(backend=fal))
+        # Recording is set up before building, so the bot's Bot API calls are timed
+        recording.configure(args.record)
+        application = bot.build_application(
+            token=TOKEN,
+            base_url=f"{telegram.base_url}/bot",
+            base_file_url=f"{telegram.base_url}/file/bot"
+        )
+
+        # run_polling() would warm up in the background; here it's done up front
+        # so the first users don't skew the step latencies
+        bot.warm_up()
+        rss_start = rss_mb()
+        stats = defaultdict(list)
+        stop = asyncio.Event()
+        results = []
+
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0.0, timeout=1)
+            monitor_task = asyncio.ensure_future(monitor(stats, stop))
+
+            print(f"🚀 {args.users} users over {args.ramp:.0f}s, concurrent updates: {application.update_processor.max_concurrent_updates}")
+            start = time.perf_counter()
+            tasks = []
+            scenarios, weights = zip(*mix.items())
+            for i in range(args.users):
+                # Spread arrivals evenly over the ramp
+                delay = start + args.ramp * i / max(1, args.users) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                user = SyntheticUser(
+                    10_000 + i, telegram, random.Random(rng.random()), parse_latency(args.think), args.user_timeout,
+                    double_tap=args.double_tap
+                )
+                scenario = rng.choices(scenarios, weights)[0]
+                tasks.append(asyncio.ensure_future(run_user(user, scenario, photos, results)))
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - start
+
+            stop.set()
+            await monitor_task
+            sessions = len(bot.user_data)
+            await application.updater.stop()
+            await application.stop()
+        
+        recording.configure("")
+        fal_calls = dict(fal.calls)
+    await telegram.stop()
+
+    return summarize(args, results, stats, duration, {
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": max(stats["rss"], default=rss_start),
+        "rss_end_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb(),
+        "sessions": sessions,
+        "updates": telegram.updates_pushed,
+        "telegram_calls": dict(telegram.calls),
+        "telegram_failures": dict(telegram.failures),
+        "fal_calls": fal_calls,
+        "duplicates_avoided": {
+            key[0]: child.value for key, child in DUPLICATE_ACTIONS_AVOIDED_TOTAL._children.items()
+        }
+    })
+
+
+def summarize(args, results, stats, duration, extra):
+    outcomes = Counter(result["outcome"] for result in results)
+    steps = defaultdict(list)
+    for result in results:
+        for name, seconds in result["timings"]:
+            steps[name].append(seconds)
+    scenario_times = defaultdict(list)
+    for result in results:
+        if result["outcome"] == "ok":
+            scenario_times[result["scenario"]].append(result["seconds"])
+
+    def latency_summary(values):
+        return {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": max(values, default=float("nan"))
+        }
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "compare", "record")},
+        "duration_s": duration,
+        "users": len(results),
+        "outcomes": dict(outcomes),
+        "success_rate": outcomes["ok"] / max(1, len(results)),
+        "throughput": {
+            "scenarios_per_s": outcomes["ok"] / duration,
+            "updates_per_s": extra["updates"] / duration
+        },
+        "steps": {name: latency_summary(values) for name, values in sorted(steps.items())},
+        "scenarios": {name: latency_summary(values) for name, values in sorted(scenario_times.items())},
+        "loop_lag": latency_summary(stats["loop_lag"]),
+        "memory": {key: extra[key] for key in ("rss_start_mb", "rss_peak_mb", "rss_end_mb", "peak_rss_mb")},
+        "sessions": extra["sessions"],
+        "telegram_calls": extra["telegram_calls"],
+        "telegram_failures": extra["telegram_failures"],
+        "fal_calls": extra["fal_calls"],
+        "duplicates_avoided": extra["duplicates_avoided"]
+    }
+
+
+def print_report(report):
+    print("=" * 72)
+    print(f"⏱️  {report['users']} users in {report['duration_s']:.1f}s — outcomes: {report['outcomes']}")
+    print(f"📈 Throughput: {report['throughput']['scenarios_per_s']:.1f} scenarios/s, {report['throughput']['updates_per_s']:.1f} updates/s")
+    print("=" * 72)
+    print(f"{'step':26s} {'count':>7s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for section in ("steps", "scenarios"):
+        for name, summary in report[section].items():
+            label = name if section == "steps" else f"scenario:{name}"
+            print(
+                f"{label:26s} {summary['count']:7d} {summary['p50'] * 1000:9.0f} {summary['p95'] * 1000:9.0f} "
+                f"{summary['p99'] * 1000:9.0f} {summary['max'] * 1000:9.0f}"
+            )
+    lag = report["loop_lag"]
+    print(f"{'event loop lag':26s} {lag['count']:7d} {lag['p50'] * 1000:9.1f} {lag['p95'] * 1000:9.1f} {lag['p99'] * 1000:9.1f} {lag['max'] * 1000:9.1f}")
+    print("=" * 72)
+    memory = report["memory"]
+    print(f"💾 RSS: {memory['rss_start_mb']:.0f} MB at start, {memory['rss_peak_mb']:.0f} MB peak, {memory['rss_end_mb']:.0f} MB at end ({report['sessions']} sessions kept)")
+    print(f"📨 Telegram calls: {report['telegram_calls']}")
+    if report["telegram_failures"]:
+        print(f"💥 Injected Telegram failures: {report['telegram_failures']}")
+    print(f"🤖 fal calls: {report['fal_calls']}")
+    if report["duplicates_avoided"]:
+        print(f"🛑 Duplicate actions avoided: {report['duplicates_avoided']}")
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compare a run with a saved baseline
+
+    Returns:
+        list: Human-readable regressions (empty if none)
+    """
+    regressions = []
+    old, new = baseline["throughput"]["scenarios_per_s"], report["throughput"]["scenarios_per_s"]
+    if new < old * (1 - tolerance):
+        regressions.append(f"throughput {old:.2f} → {new:.2f} scenarios/s")
+    if report["success_rate"] < baseline["success_rate"] - tolerance / 10:
+        regressions.append(f"success rate {baseline['success_rate']:.1%} → {report['success_rate']:.1%}")
+    for name, summary in report["steps"].items():
+        previous = baseline["steps"].get(name)
+        if previous and summary["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{name} p95 {previous['p95'] * 1000:.0f} → {summary['p95'] * 1000:.0f} ms")
+    if report["memory"]["rss_peak_mb"] > baseline["memory"]["rss_peak_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {baseline['memory']['rss_peak_mb']:.0f} → {report['memory']['rss_peak_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="Synthetic users to run")
+    parser.add_argument("--ramp", type=float, default=30.0, help="Seconds over which users arrive")
+    parser.add_argument("--mix", default="image=5,text=3,preset=2", help="Scenario weights")
+    parser.add_argument("--think", default="0.2-1.0", help="User think time between actions")
+    parser.add_argument("--user-timeout", type=float, default=120.0, help="Longest a user waits for a reply")
+    parser.add_argument("--photos", type=int, default=200, help="Distinct product photos shared by the synthetic users")
+    parser.add_argument("--fal-latency", default="lognormal:1.5:0.4", help="fal workflow run time")
+    parser.add_argument("--fal-failure-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", default="0.01-0.05", help="Telegram Bot API call time")
+    parser.add_argument("--telegram-failure-rate", type=float, default=0.0)
+    parser.add_argument("--double-tap", type=float, default=0.0, help="Chance that a user taps each button twice")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="ERROR", help="Bot log level during the run")
+    parser.add_argument("--record", default="", help="Record the synthetic traffic to this file, as RECORD_FILE does (see replay.py)")
+    parser.add_argument("--save", help="Write the report to this JSON file")
+    parser.add_argument("--compare", help="Baseline report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    log_listener = setup_logging(level=args.log_level, fmt="text")
+    try:
+        report = asyncio.run(run_load_test(args))
+    finally:
+        log_listener.stop()
+    print_report(report)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Report saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressions against the baseline:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            return 1
+        print("✅ No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Per-tenant logo registry for watermarks
+
+Each tenant (a user or business) can upload its own logo. Logos are
+normalized once on upload (RGBA, transparent border trimmed, longest side at
+most LOGO_MAX_SIZE) and stored as optimized PNG files in LOGO_DIR. Loaded
+logos are kept as LogoPyramid objects in an LRU bounded by LOGO_CACHE_MAX_MB.
+
+A LogoPyramid holds the logo premultiplied by its alpha ("RGBa") at
+halving resolutions. A watermark of any size is resized from the nearest
+larger level instead of the full logo, and the result is cached per size
+and opacity. After the first image of a given size, watermarking with a
+tenant's logo costs the same as with the preloaded default logo.
+"""
+
+import io
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+import blending
+from config import LOGO_DIR, LOGO_CACHE_MAX_MB, LOGO_MAX_SIZE
+from metrics import LOGO_CACHE_REQUESTS_TOTAL, LOGO_CACHE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Smallest pyramid level kept (shorter side, pixels)
+MIN_LEVEL_SIZE = 16
+
+# Resized logos cached per pyramid, keyed by (size, opacity, kind)
+MAX_RESIZED = 8
+
+
+class LogoPyramid:
+    def __init__(self, logo):
+        """
+        Args:
+            logo (PIL.Image): Logo in any mode; converted to RGBA
+        """
+        rgba = logo.convert("RGBA")
+        self.size = rgba.size
+        # Filtering premultiplied pixels keeps transparent areas from bleeding
+        # their (invisible) color into the edges of the logo
+        level = rgba.convert("RGBa")
+        self.levels = [level]
+        while min(level.size) // 2 >= MIN_LEVEL_SIZE:
+            level = level.reduce(2)
+            self.levels.append(level)
+        self._resized = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Memory held by the levels (resized copies are bounded by MAX_RESIZED)"""
+        return sum(level.width * level.height * 4 for level in self.levels)
+
+    def _level_for(self, size):
+        """Smallest level at least as large as the target size"""
+        for level in reversed(self.levels):
+            if level.width >= size[0] and level.height >= size[1]:
+                return level
+        return self.levels[0]
+
+    def _cached(self, key, build):
+        with self._lock:
+            value = self._resized.get(key)
+            if value is not None:
+                self._resized.move_to_end(key)
+                return value
+        value = build()
+        with self._lock:
+            self._resized[key] = value
+            if len(self._resized) > MAX_RESIZED:
+                self._resized.popitem(last=False)
+        return value
+
+    def resized(self, size, opacity=1.0):
+        """
+        RGBA logo at the given size and opacity (cached; don't modify it)
+
+        Args:
+            size (tuple): (width, height)
+            opacity (float): Opacity of the logo (0.0 to 1.0)
+        """
+        def build():
+            logo = self._level_for(size).resize(size, Image.Resampling.LANCZOS).convert("RGBA")
+            if opacity < 1.0:
+                logo.putalpha(logo.getchannel("A").point(lambda x: int(x * opacity)))
+            return logo
+
+        return self._cached((size, round(opacity, 3), "rgba"), build)
+
+    def tile(self, size, opacity=1.0, angle=30, spacing=0.25):
+        """
+        Repeating unit of a diagonal tiled watermark (cached; don't modify it)
+        
+        The logo is rotated and placed twice, with every other row shifted by
+        half a cell, so copies of the tile laid edge to edge give a staggered
+        pattern with no seams.
+        
+        Args:
+            size (tuple): (width, height) of each logo before rotation
+            opacity (float): Opacity of the logo (0.0 to 1.0)
+            angle (float): Counter-clockwise rotation in degrees
+            spacing (float): Gap between logos, as a fraction of the rotated logo size
+        
+        Returns:
+            PIL.Image: RGBA tile
+        """
+        def build():
+            # Rotating premultiplied pixels keeps the edges free of dark fringes
+            logo = self.resized(size, opacity).convert("RGBa").rotate(angle, Image.Resampling.BICUBIC, expand=True)
+            cell = (int(logo.width * (1 + spacing)), int(logo.height * (1 + spacing)))
+            pad = ((cell[0] - logo.width) // 2, (cell[1] - logo.height) // 2)
+            tile = Image.new("RGBa", (cell[0], cell[1] * 2))
+            tile.paste(logo, pad)
+            # Second row, half a cell to the right, wrapping around the left edge
+            for x in (pad[0] + cell[0] // 2, pad[0] + cell[0] // 2 - cell[0]):
+                tile.paste(logo, (x, pad[1] + cell[1]))
+            return tile.convert("RGBA")
+        
+        return self._cached((size, round(opacity, 3), "tile", angle, spacing), build)
+    
+    def premultiplied(self, size, opacity=1.0):
+        """blending.PremultipliedLogo at the given size and opacity (cached)"""
+        return self._cached(
+            (size, round(opacity, 3), "numpy"),
+            lambda: blending.PremultipliedLogo(self.resized(size), opacity)
+        )
+
+
+class LogoRegistry:
+    def __init__(self, directory=LOGO_DIR, max_bytes=LOGO_CACHE_MAX_MB * 2**20, max_size=LOGO_MAX_SIZE, max_missing=100_000):
+        """
+        Args:
+            directory (str): Where tenant logos are stored
+            max_bytes (int): Memory budget for loaded pyramids
+            max_size (int): Longest side of a stored logo, in pixels
+            max_missing (int): Tenants without a logo remembered, so most
+                lookups for them skip the file system
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        self.max_missing = max_missing
+        self._cache = OrderedDict()  # tenant -> (pyramid, nbytes)
+        self._cache_bytes = 0
+        self._missing = OrderedDict()  # tenants known to have no logo, least recently asked first
+        self._lock = threading.Lock()
+
+        # Pyramid memory is read when metrics are scraped
+        LOGO_CACHE_BYTES.set_function(lambda: self._cache_bytes)
+
+    def path(self, tenant):
+        """File of a tenant's logo; the id is reduced to safe file name characters"""
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", str(tenant))
+        return os.path.join(self.directory, f"{name}.png")
+
+    def _remember(self, tenant, pyramid):
+        nbytes = pyramid.nbytes
+        with self._lock:
+            self._missing.pop(tenant, None)
+            previous = self._cache.pop(tenant, None)
+            if previous is not None:
+                self._cache_bytes -= previous[1]
+            self._cache[tenant] = (pyramid, nbytes)
+            self._cache_bytes += nbytes
+            # Evict least recently used logos, but always keep the newest one
+            while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+                _, (_, evicted_bytes) = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted_bytes
+
+    def _forget(self, tenant):
+        with self._lock:
+            self._missing.pop(tenant, None)
+            previous = self._cache.pop(tenant, None)
+            if previous is not None:
+                self._cache_bytes -= previous[1]
+
+    def get(self, tenant):
+        """
+        Logo pyramid of a tenant
+        
+        Tenants found without a logo are remembered until put() or delete()
+        is called for them, so a logo file added by another process isn't
+        seen before then.
+        
+        Returns:
+            LogoPyramid: The tenant's logo, or None if it hasn't uploaded one
+        """
+        with self._lock:
+            entry = self._cache.get(tenant)
+            if entry is not None:
+                self._cache.move_to_end(tenant)
+            missing = entry is None and tenant in self._missing
+            if missing:
+                self._missing.move_to_end(tenant)
+        if entry is not None:
+            LOGO_CACHE_REQUESTS_TOTAL.labels(result="hit").inc()
+            return entry[0]
+        if missing:
+            LOGO_CACHE_REQUESTS_TOTAL.labels(result="none").inc()
+            return None
+        
+        path = self.path(tenant)
+        if not os.path.exists(path):
+            with self._lock:
+                # Unless put() stored a logo in the meantime
+                if tenant not in self._cache:
+                    self._missing[tenant] = None
+                    if len(self._missing) > self.max_missing:
+                        self._missing.popitem(last=False)
+            LOGO_CACHE_REQUESTS_TOTAL.labels(result="none").inc()
+            return None
+        try:
+            with Image.open(path) as logo:
+                pyramid = LogoPyramid(logo)
+        except Exception as e:
+            logger.error(f"Error loading logo for tenant {tenant}: {e}")
+            return None
+        LOGO_CACHE_REQUESTS_TOTAL.labels(result="miss").inc()
+        self._remember(tenant, pyramid)
+        return pyramid
+
+    def normalize(self, data):
+        """
+        Prepare an uploaded logo for storage
+
+        Args:
+            data (bytes): Encoded image
+
+        Returns:
+            PIL.Image: RGBA logo, trimmed and at most max_size on its longest side
+
+        Raises:
+            ValueError: If the data isn't a usable image
+        """
+        try:
+            logo = Image.open(io.BytesIO(data))
+            logo.load()
+        except Exception as e:
+            raise ValueError(f"Not an image: {e}") from e
+        logo = logo.convert("RGBA")
+
+        # Trim the fully transparent border so the logo fills its watermark box
+        bbox = logo.getchannel("A").getbbox()
+        if bbox is None:
+            raise ValueError("Logo is fully transparent")
+        logo = logo.crop(bbox)
+        if max(logo.size) > self.max_size:
+            logo.thumbnail((self.max_size, self.max_size), Image.Resampling.LANCZOS)
+        return logo
+
+    def put(self, tenant, data):
+        """
+        Store a tenant's logo, replacing any earlier one
+
+        Args:
+            tenant: Tenant id (e.g. a Telegram user id)
+            data (bytes): Encoded image
+
+        Returns:
+            LogoPyramid: The stored logo
+
+        Raises:
+            ValueError: If the data isn't a usable image
+        """
+        logo = self.normalize(data)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(tenant)
+        # Write then rename, so readers never see a half-written file
+        temporary = f"{path}.tmp"
+        logo.save(temporary, format="PNG", optimize=True)
+        os.replace(temporary, path)
+
+        pyramid = LogoPyramid(logo)
+        self._remember(tenant, pyramid)
+        logger.info(f"Stored logo for tenant {tenant}: {logo.size[0]}x{logo.size[1]}, {os.path.getsize(path) / 1024:.0f} KB")
+        return pyramid
+
+    def delete(self, tenant):
+        """Remove a tenant's logo, returning True if there was one"""
+        self._forget(tenant)
+        try:
+            os.remove(self.path(tenant))
+            return True
+        except FileNotFoundError:
+            return False
+
+    @property
+    def cache_bytes(self):
+        return self._cache_bytes
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Lightweight Prometheus-style metrics for every stage of a generation
+
+Counters, gauges and histograms are kept in process and rendered in the
+Prometheus text exposition format by a small HTTP endpoint (/metrics).
+Recording a value is a dict lookup plus a locked add, so instrumenting the
+hot path costs a microsecond or two per call (see bench_metrics.py).
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) covering fast local work up to multi-minute workflow runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class _GaugeChild(_CounterChild):
+    def __init__(self):
+        super().__init__()
+        self._function = None
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function):
+        """Compute the value when scraped instead of tracking it"""
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def track_inprogress(self):
+        """Context manager that counts the block as in progress"""
+        return _InProgress(self)
+
+
+class _InProgress:
+    def __init__(self, gauge):
+        self._gauge = gauge
+
+    def __enter__(self):
+        self._gauge.inc()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._gauge.dec()
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager that observes the duration of the block"""
+        return _Timer(self)
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def sum(self):
+        return self._sum
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        # Children keyed by the label values exactly as passed, to skip str() on the hot path
+        self._lookup = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        """Return the child for one combination of label values"""
+        if labels:
+            values = tuple([labels[name] for name in self.labelnames])
+        child = self._lookup.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            key = tuple(str(value) for value in values)
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+                self._lookup[values] = child
+        return child
+
+    def samples(self):
+        """Value of every child, keyed by its label values (as strings)"""
+        with self._lock:
+            children = list(self._children.items())
+        return {key: child.value for key, child in children}
+
+    def _only_child(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels, use .labels()")
+        return self.labels()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.value}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self._only_child().inc(amount)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1.0):
+        self._only_child().inc(amount)
+
+    def dec(self, amount=1.0):
+        self._only_child().dec(amount)
+
+    def set(self, value):
+        self._only_child().set(value)
+
+    def set_function(self, function):
+        self._only_child().set_function(function)
+
+    def track_inprogress(self):
+        return self._only_child().track_inprogress()
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def samples(self):
+        """(count, sum) of every child, keyed by its label values (as strings)"""
+        with self._lock:
+            children = list(self._children.items())
+        return {key: (child.count, child.sum) for key, child in children}
+
+    def observe(self, value):
+        self._only_child().observe(value)
+
+    def time(self):
+        return self._only_child().time()
+
+    def _render_child(self, key, child):
+        with child._lock:
+            counts = list(child._counts)
+            total = child._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.labelnames, key, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=REGISTRY):
+    """
+    Serve the registry on http://host:port/metrics from a daemon thread
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it)
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+# Generation stages
+TELEGRAM_FILE_RESOLVE_SECONDS = Histogram(
+    "telegram_file_resolve_seconds", "Time to resolve a Telegram file_id to a download URL"
+)
+TELEGRAM_UPLOAD_SECONDS = Histogram(
+    "telegram_upload_seconds", "Time to upload a photo or document to Telegram", ["kind"]
+)
+FAL_STREAM_SECONDS = Histogram(
+    "fal_stream_seconds", "Duration of a fal workflow stream", ["workflow", "shot_type"]
+)
+FAL_REQUESTS_TOTAL = Counter(
+    "fal_requests_total", "fal workflow runs by outcome", ["workflow", "outcome"]
+)
+FAL_RUN_SECONDS = Histogram(
+    "fal_run_seconds", "Duration of fal workflow runs by whether the workflow was idle long enough to be cold", ["workflow", "state"]
+)
+FAL_WARM_REQUESTS_TOTAL = Counter(
+    "fal_warm_requests_total", "Keep-alive runs by reason (keepalive, prewarm) and outcome (ok, error, timeout, cancelled, over_budget, circuit_open)", ["workflow", "reason", "outcome"]
+)
+FAL_WARM_SPEND_USD = Gauge(
+    "fal_warm_spend_usd", "Estimated keep-alive spend over the last hour"
+)
+FAL_CIRCUIT_STATE = Gauge(
+    "fal_circuit_state", "Circuit breaker state per workflow (0 closed, 1 half-open, 2 open)", ["workflow"]
+)
+FAL_CIRCUIT_TRANSITIONS_TOTAL = Counter(
+    "fal_circuit_transitions_total", "Circuit breaker state changes by the state entered", ["workflow", "state"]
+)
+FAL_CONCURRENCY_LIMIT = Gauge(
+    "fal_concurrency_limit", "Adaptive limit on concurrent runs per workflow", ["workflow"]
+)
+IMAGE_DOWNLOAD_SECONDS = Histogram(
+    "image_download_seconds", "Time to download an image", ["source"]
+)
+WATERMARK_SECONDS = Histogram(
+    "watermark_seconds", "Time spent in each watermark stage", ["stage"]
+)
+TIME_TO_FIRST_IMAGE_SECONDS = Histogram(
+    "time_to_first_image_seconds", "Time from choosing a shot to receiving the first image", ["tier"]
+)
+
+# Health
+ERRORS_TOTAL = Counter(
+    "errors_total", "Errors by stage", ["stage"]
+)
+JOBS_IN_FLIGHT = Gauge(
+    "jobs_in_flight", "Generation jobs currently running", ["kind"]
+)
+SESSIONS = Gauge(
+    "sessions", "Users with conversation data in the session store"
+)
+STARTUP_SECONDS = Gauge(
+    "startup_seconds", "Startup time by phase (ready: import to polling, warm_up: background subsystem loading)", ["phase"]
+)
+LOG_RECORDS_DROPPED_TOTAL = Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full"
+)
+SHUTDOWN_JOBS_TOTAL = Counter(
+    "shutdown_jobs_total", "Jobs running at shutdown, by outcome (drained before the deadline, interrupted and saved)", ["outcome"]
+)
+RESUMED_JOBS_TOTAL = Counter(
+    "resumed_jobs_total", "Saved jobs resumed after a restart, by kind and outcome", ["kind", "outcome"]
+)
+DUPLICATE_ACTIONS_AVOIDED_TOTAL = Counter(
+    "duplicate_actions_avoided_total", "Button taps and briefs dropped instead of repeating work", ["reason"]
+)
+
+# Output encoding
+ENCODE_SECONDS = Histogram(
+    "image_encode_seconds", "Time to encode an output image, including the quality search", ["format"]
+)
+ENCODED_BYTES = Histogram(
+    "image_encoded_bytes", "Size of encoded output images", ["format"],
+    buckets=(50_000, 100_000, 200_000, 300_000, 500_000, 1_000_000, 2_000_000, 5_000_000, 10_000_000)
+)
+ENCODE_BYTES_SAVED_TOTAL = Counter(
+    "image_encode_bytes_saved_total", "Bytes saved by re-encoding downloaded images", ["format"]
+)
+
+# Tenant logos
+LOGO_CACHE_REQUESTS_TOTAL = Counter(
+    "logo_cache_requests_total", "Tenant logo lookups by result (hit, miss loaded from disk, none uploaded)", ["result"]
+)
+LOGO_CACHE_BYTES = Gauge(
+    "logo_cache_bytes", "Memory held by loaded tenant logo pyramids"
+)
+
+# Near-duplicate reuse
+IMAGE_INDEX_LOOKUPS_TOTAL = Counter(
+    "image_index_lookups_total", "Lookups of earlier results for near-duplicate images, by kind and result (hit, miss)", ["kind", "result"]
+)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Declarative generation pipelines run as a dependency graph
+
+A pipeline is a set of named stages. Each stage starts as soon as the stages
+it depends on have finished, so independent stages (e.g. image and text
+generation) run concurrently. Stage outputs are handed to dependent stages in
+memory.
+"""
+
+import asyncio
+import logging
+import time
+
+import buffers
+from config import PRODUCT_SHOT_TYPES, WATERMARK_POSITIONS, TEXT_PROMPT_TEMPLATE
+from tracing import run_in_context, span
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), blocking=False):
+        """
+        Args:
+            name (str): Unique stage name; its output is stored under this key
+            func (callable): Called with a dict of pipeline inputs and dependency
+                outputs. May be a coroutine function.
+            deps (tuple): Names of the stages this stage needs
+            blocking (bool): Run a plain function in the default executor
+                instead of on the event loop (CPU or blocking I/O work)
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.blocking = blocking
+
+
+class PipelineResult:
+    def __init__(self):
+        self.outputs = {}
+        self.timings = {}
+        self.errors = {}
+        self.total_time = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def format_timings(self):
+        parts = [f"{name}={seconds:.2f}s" for name, seconds in self.timings.items()]
+        parts.append(f"total={self.total_time:.2f}s")
+        return " ".join(parts)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        """
+        Args:
+            stages (list): Stage objects; dependencies must name other stages
+                and must not form a cycle
+        """
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage: {stage.name}")
+            self.stages[stage.name] = stage
+
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a cycle through stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self, **inputs):
+        """
+        Run every stage as soon as its dependencies are done
+
+        A stage whose dependency failed is skipped and recorded as an error.
+
+        Returns:
+            PipelineResult: Outputs, per-stage timings and errors
+        """
+        result = PipelineResult()
+        futures = {}
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+
+        async def run_stage(stage):
+            for dep in stage.deps:
+                await futures[dep]
+            failed = [dep for dep in stage.deps if dep in result.errors]
+            if failed:
+                result.errors[stage.name] = f"skipped, dependency failed: {', '.join(failed)}"
+                return
+
+            args = dict(inputs)
+            args.update({dep: result.outputs[dep] for dep in stage.deps})
+
+            stage_start = time.perf_counter()
+            try:
+                with span(f"pipeline.{stage.name}"):
+                    if stage.blocking:
+                        output = await loop.run_in_executor(None, run_in_context(stage.func, args))
+                    else:
+                        output = stage.func(args)
+                        if asyncio.iscoroutine(output):
+                            output = await output
+                    if output is None:
+                        raise RuntimeError("stage produced no output")
+                result.outputs[stage.name] = output
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed: {e}")
+                result.errors[stage.name] = str(e)
+            finally:
+                result.timings[stage.name] = time.perf_counter() - stage_start
+
+        for stage in self.stages.values():
+            futures[stage.name] = asyncio.ensure_future(run_stage(stage))
+        try:
+            await asyncio.gather(*futures.values())
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+        result.total_time = time.perf_counter() - start
+        return result
+
+
+def build_preset_pipeline(preset, api_client, watermark_processor, tenant=None):
+    """
+    Build the pipeline for a PIPELINE_PRESETS entry
+
+    Stages: 'image' generates the shot, 'download' streams it into a
+    buffers.SpooledBuffer, 'watermark' composites the logo (or 'encode' fits
+    the raw image to the output byte budget) and 'caption' writes the text.
+    'caption' only needs the input image, so it runs alongside image
+    generation.
+
+    Run with ``image_url`` as the only input. ``tenant`` picks whose logo
+    the watermark uses (see WatermarkProcessor.logo_for).
+    """
+    stages = []
+
+    if preset.get("shot"):
+        shot_prompt = PRODUCT_SHOT_TYPES[preset["shot"]]["prompt"]
+
+        async def generate_image(args):
+            output = await api_client.generate_product_image(image_url=args["image_url"], shot_type=shot_prompt)
+            if not (output and output.get("images")):
+                raise RuntimeError(f"No valid result from API: {output}")
+            return output["images"][0]["url"]
+
+        def download(args):
+            return buffers.fetch(args["image"])
+
+        stages.append(Stage("image", generate_image))
+        stages.append(Stage("download", download, deps=("image",), blocking=True))
+
+        if preset.get("watermark"):
+            position = WATERMARK_POSITIONS[preset["watermark"]]["value"]
+
+            def watermark(args):
+                output = watermark_processor.add_watermark(image_url=args["download"], position=position, tenant=tenant)
+                if output is None:
+                    raise RuntimeError("Watermarking failed")
+                return output
+
+            stages.append(Stage("watermark", watermark, deps=("download",), blocking=True))
+        else:
+            def encode(args):
+                # Shrink the raw result to the output byte budget
+                return watermark_processor.encoder.reencode(args["download"])
+
+            stages.append(Stage("encode", encode, deps=("download",), blocking=True))
+
+    if preset.get("text"):
+        text_prompt = TEXT_PROMPT_TEMPLATE.format(content_type=preset["text"], user_prompt=preset.get("brief", ""))
+
+        async def generate_caption(args):
+            output = await api_client.generate_text_content(image_url=args["image_url"], prompt=text_prompt)
+            if not (output and output.get("output")):
+                raise RuntimeError(f"No valid text result from API: {output}")
+            return output["output"]
+
+        stages.append(Stage("caption", generate_caption))
+
+    return Pipeline(stages)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Opt-in recording of production traffic, for replay.py
+
+With RECORD_FILE set, the bot appends three kinds of events to a compact
+JSONL file (gzip-compressed if the name ends in .gz), one object per line:
+
+- update: what a user did, anonymized. Users and photos become small
+  numbers in order of first appearance (the same photo sent again keeps its
+  number, so near-duplicate reuse replays faithfully); texts keep only their
+  length, commands their name and plain-word arguments, button taps their
+  action without the session version. Names, chats, captions and file ids
+  are never written. Each update also carries how many bot messages the
+  chat received since the user's previous update ("r") and how long the
+  user waited after the last of them ("g"), so a replay can wait for the
+  bot's answers like the user did.
+- fal: workflow, run time and outcome of every fal run
+- tg: method, time and success of every Bot API call
+
+Fields use short names and times are seconds since the recording started
+("t"). Events are queued and written by a background thread, so recording
+costs a handler a dict and a queue put.
+
+Replay a recording against the local stand-ins:
+    python replay.py recording.jsonl.gz --speed 4
+"""
+
+import gzip
+import itertools
+import json
+import logging
+import queue
+import re
+import threading
+import time
+
+from telegram.request import HTTPXRequest
+
+from callback_guard import callback_action
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Bot API methods that show the user something (counted as replies per chat)
+REPLY_METHODS = ("sendMessage", "editMessageText", "sendPhoto", "sendDocument", "sendAnimation")
+
+# Commands that are not replayed (admin diagnostics)
+SKIPPED_COMMANDS = ("stats",)
+
+# Command arguments that are kept; anything else a user typed is dropped
+_PLAIN_ARGUMENT = re.compile(r"^(?:[a-z_]{1,16}|\d{1,6}(?:\.\d+)?)$")
+
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, event):
+        self._queue.put(event)
+
+    def _run(self):
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "at", encoding="utf-8") as f:
+            while True:
+                event = self._queue.get()
+                if event is None:
+                    break
+                f.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+                # Flush once the queue is drained rather than after every event
+                if self._queue.empty():
+                    f.flush()
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class TrafficRecorder:
+    def __init__(self, writer=None):
+        """
+        Args:
+            writer: Object with write(event) and shutdown(); None disables recording
+        """
+        self.writer = writer
+        self._start = time.monotonic()
+        self._users = {}  # Telegram user id -> pseudonym
+        self._files = {}  # file_unique_id -> number
+        self._user_ids = itertools.count(1)
+        self._file_ids = itertools.count(0)
+        self._replies = {}  # chat id -> [replies since the user's last update, time of the last one]
+        if writer is not None:
+            writer.write({"e": "start", "v": FORMAT_VERSION, "time": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    @property
+    def enabled(self):
+        return self.writer is not None
+
+    def _now(self):
+        return round(time.monotonic() - self._start, 3)
+
+    def _pseudonym(self, user_id):
+        pseudonym = self._users.get(user_id)
+        if pseudonym is None:
+            pseudonym = self._users[user_id] = next(self._user_ids)
+        return pseudonym
+
+    def _file(self, file_unique_id):
+        number = self._files.get(file_unique_id)
+        if number is None:
+            number = self._files[file_unique_id] = next(self._file_ids)
+        return number
+
+    def record_update(self, update):
+        """Append an incoming update, anonymized"""
+        if self.writer is None or update.effective_user is None:
+            return
+        event = {"e": "update", "t": self._now(), "u": self._pseudonym(update.effective_user.id)}
+        message = update.message
+        if update.callback_query is not None:
+            event["k"] = "tap"
+            event["d"] = callback_action(update.callback_query.data)
+        elif message is not None and message.photo:
+            event["k"] = "photo"
+            event["f"] = self._file(message.photo[-1].file_unique_id)
+        elif message is not None and message.document:
+            event["k"] = "document"
+            event["f"] = self._file(message.document.file_unique_id)
+            event["m"] = message.document.mime_type
+        elif message is not None and message.text and message.text.startswith("/"):
+            command, *args = message.text[1:].split()
+            command = command.split("@", 1)[0]
+            if command in SKIPPED_COMMANDS:
+                return
+            event["k"] = "command"
+            event["c"] = command
+            args = [arg for arg in args if _PLAIN_ARGUMENT.match(arg)]
+            if args:
+                event["a"] = args
+        elif message is not None and message.text:
+            event["k"] = "text"
+            event["n"] = len(message.text)
+        else:
+            event["k"] = "other"
+
+        # What the user saw since their previous update, and how long they waited after it
+        replies = self._replies.pop(update.effective_user.id, None)
+        if replies is not None:
+            event["r"] = replies[0]
+            event["g"] = round(time.monotonic() - replies[1], 3)
+        self.writer.write(event)
+
+    def record_fal(self, workflow, seconds, outcome, draft=False):
+        """Append a fal workflow run"""
+        if self.writer is None:
+            return
+        event = {"e": "fal", "t": self._now(), "w": workflow, "s": round(seconds, 3), "o": outcome}
+        if draft:
+            event["d"] = 1
+        self.writer.write(event)
+
+    def record_telegram(self, method, seconds, ok, chat_id=None):
+        """Append a Bot API call; replies are also counted for the chat's next update"""
+        if self.writer is None:
+            return
+        event = {"e": "tg", "t": self._now(), "m": method, "s": round(seconds, 4)}
+        if not ok:
+            event["ok"] = 0
+        self.writer.write(event)
+        if ok and chat_id is not None and method in REPLY_METHODS:
+            try:
+                chat_id = int(chat_id)
+            except (TypeError, ValueError):
+                return
+            replies = self._replies.setdefault(chat_id, [0, 0.0])
+            replies[0] += 1
+            replies[1] = time.monotonic()
+
+
+class TimedRequest(HTTPXRequest):
+    """python-telegram-bot request that records the time of every Bot API call"""
+
+    def __init__(self, **kwargs):
+        # python-telegram-bot's default pool size for the bot's requests
+        kwargs.setdefault("connection_pool_size", 256)
+        super().__init__(**kwargs)
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            code, payload = await super().do_request(url, method, request_data=request_data, **kwargs)
+            ok = code < 400
+            return code, payload
+        finally:
+            api_method = url.rsplit("/", 1)[-1] if "/file/bot" not in url else "file_download"
+            chat_id = request_data.parameters.get("chat_id") if request_data is not None else None
+            recorder.record_telegram(api_method, time.perf_counter() - start, ok, chat_id)
+
+
+def load_recording(path):
+    """
+    Read a recording
+
+    Every restart of the bot appends a new segment whose times, users and
+    photos start from zero again; later segments are shifted to follow the
+    earlier ones, with users and photos of their own.
+
+    Returns:
+        dict: Events of each kind ('update', 'fal', 'tg'), in file order
+    """
+    events = {"update": [], "fal": [], "tg": []}
+    offset = {"t": 0.0, "u": 0, "f": 0}
+    last = {"t": 0.0, "u": 0, "f": -1}
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("e") == "start":
+                offset = {"t": last["t"], "u": last["u"], "f": last["f"] + 1}
+                continue
+            if event.get("e") not in events:
+                continue
+            for key in ("t", "u", "f"):
+                if key in event:
+                    event[key] += offset[key]
+                    last[key] = max(last[key], event[key])
+            events[event["e"]].append(event)
+    return events
+
+
+# Disabled until configure() is called
+recorder = TrafficRecorder()
+
+
+def configure(path):
+    """
+    Enable recording to a file for the module recorder
+
+    Args:
+        path (str): Recording file; empty disables recording
+    """
+    global recorder
+    if recorder.writer is not None:
+        recorder.writer.shutdown()
+    if not path:
+        recorder = TrafficRecorder()
+    else:
+        recorder = TrafficRecorder(_Writer(path))
+        logger.info(f"Recording anonymized traffic to {path}")
+    return recorder
+
+
+def record_update(update):
+    recorder.record_update(update)
+
+
+def record_fal(workflow, seconds, outcome, draft=False):
+    recorder.record_fal(workflow, seconds, outcome, draft)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Replay recorded production traffic against local stand-ins
+
+Reads a recording made with RECORD_FILE (see recording.py) and runs every
+recorded user again through an unmodified ContentCreatorBot, with the fake
+Telegram Bot API from load_test.py and the fal stand-in in place of the real
+services. Each user's first update arrives at its recorded time. Every later
+update waits until the chat has received as many bot messages as it had when
+it was recorded, then follows after the user's recorded think time. So
+menu hopping, back buttons and repeated watermark tries keep their order,
+while the bot's own speed decides how fast each user gets through them.
+
+--speed divides user arrival and think times (4 replays an hour of traffic
+in 15 minutes); the stand-ins answer with the fal run times and Bot API
+call times of the recording unless --fal-latency / --telegram-latency give
+a distribution (see load_test.py). Photos are synthetic, one per recorded
+photo, so a photo sent again is the same image again.
+
+Reports per-action latency (time until the bot had answered an update),
+throughput in replayed users and updates per second, event loop lag and
+memory, in the load test's report format: --save a run and --compare a
+later release against it.
+
+Examples:
+    python replay.py recording.jsonl.gz
+    python replay.py recording.jsonl.gz --speed 10 --save release_1.json
+    python replay.py recording.jsonl.gz --speed 10 --compare release_1.json
+    python replay.py recording.jsonl.gz --fal-latency 0.05 --speed 50  (bot overhead only)
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+from api_client import FalAPIClient
+from async_logging import setup_logging
+from bot import ContentCreatorBot
+from config import CONTENT_CREATOR_WORKFLOW, VISION_SPECIALIST_WORKFLOW
+from fal_standin import FalStandIn
+from load_test import (
+    TOKEN, FakeTelegramAPI, SyntheticUser, make_photos, parse_latency, monitor, rss_mb, peak_rss_mb,
+    summarize, print_report, compare
+)
+from metrics import DUPLICATE_ACTIONS_AVOIDED_TOTAL
+from recording import load_recording
+
+logger = logging.getLogger(__name__)
+
+# Replayed users get chat ids from here up, so they never collide with load test users
+FIRST_CHAT_ID = 30_000
+
+# fal outcomes that end with an error event; timeouts replay as long run times instead
+FAL_ERROR_OUTCOMES = ("error", "empty")
+
+# Stands in for a brief of the recorded length
+BRIEF = "معرفی محصول برای شبکه‌های اجتماعی با لحن دوستانه و جذاب "
+
+# Button actions grouped into report steps: exact actions first, then prefixes
+TAP_ACTIONS = (
+    "product_image", "text_content", "watermark", "presets", "back_to_main", "back_to_start",
+    "watermark_yes", "watermark_no"
+)
+TAP_PREFIXES = (
+    "reuse_shot_", "regen_shot_", "upgrade_shot_", "content_pack_", "reuse_text_", "new_text_",
+    "preset_", "shot_", "text_", "watermark_"
+)
+
+
+def step_name(event):
+    """Report step of a recorded update, e.g. 'photo', '/logo' or 'tap:shot'"""
+    kind = event["k"]
+    if kind == "command":
+        return f"/{event['c']}"
+    if kind != "tap":
+        return kind
+    action = event.get("d", "")
+    if action in TAP_ACTIONS:
+        return f"tap:{action}"
+    for prefix in TAP_PREFIXES:
+        if action.startswith(prefix):
+            return f"tap:{prefix.rstrip('_')}"
+    return "tap:other"
+
+
+def empirical(samples):
+    """Latency distribution drawing from recorded samples (see parse_latency)"""
+    return lambda rng: rng.choice(samples)
+
+
+def recorded_services(events, args):
+    """
+    Stand-in latency and failure rates from the recording, unless overridden
+
+    Returns:
+        dict: fal_latency (per workflow), fal_failure_rate, telegram_latency,
+            telegram_failure_rate
+    """
+    default = parse_latency(args.fal_latency if args.fal_latency != "recorded" else "lognormal:1.5:0.4")
+    runs = defaultdict(list)
+    failures = total = 0
+    for event in events["fal"]:
+        if event["o"] == "cancelled":
+            continue
+        total += 1
+        failures += event["o"] in FAL_ERROR_OUTCOMES
+        if not event.get("d"):
+            # Drafts are scaled down by the stand-in's draft_factor
+            runs[event["w"]].append(event["s"])
+
+    fal_latency = defaultdict(lambda: default)
+    fal_latency.update({workflow: default for workflow in (CONTENT_CREATOR_WORKFLOW, VISION_SPECIALIST_WORKFLOW)})
+    if args.fal_latency == "recorded":
+        fal_latency.update({workflow: empirical(samples) for workflow, samples in runs.items()})
+
+    calls = [event for event in events["tg"] if event["m"] != "getUpdates"]
+    if args.telegram_latency == "recorded" and calls:
+        telegram_latency = empirical([event["s"] for event in calls])
+    else:
+        telegram_latency = parse_latency(args.telegram_latency if args.telegram_latency != "recorded" else "0.01-0.05")
+
+    def rate(value, failed, count):
+        if value != "recorded":
+            return float(value)
+        return failed / count if count else 0.0
+
+    return {
+        "fal_latency": fal_latency,
+        "fal_failure_rate": rate(args.fal_failure_rate, failures, total),
+        "telegram_latency": telegram_latency,
+        "telegram_failure_rate": rate(args.telegram_failure_rate, sum(not event.get("ok", 1) for event in calls), len(calls))
+    }
+
+
+def send(user, event, photo_numbers):
+    """Push one recorded update from a replayed user"""
+    kind = event["k"]
+    if kind == "photo":
+        user.send_photo(photo_numbers[event["f"]])
+    elif kind == "document":
+        user.send_document(photo_numbers[event["f"]], event.get("m") or "image/png")
+    elif kind == "command":
+        user.send_command(event["c"], event.get("a", ()))
+    elif kind == "text":
+        length = max(1, event.get("n", len(BRIEF)))
+        user.send_text((BRIEF * (length // len(BRIEF) + 1))[:length])
+    elif kind == "tap":
+        user.click(event["d"])
+
+
+async def replay_user(user, updates, photo_numbers, start, args, results):
+    """
+    Replay one user's updates, waiting for the bot's answers as recorded
+
+    An update whose recorded answers don't all arrive within --reply-timeout
+    is sent anyway; the user then counts as 'timeout'.
+    """
+    timings = []
+    replies = []  # output times since the last update
+    desynced = False
+
+    async def collect(count, deadline):
+        # Take outputs until there are count of them and nothing more is
+        # waiting; False if they didn't all arrive by the deadline
+        while True:
+            try:
+                if len(replies) >= count:
+                    event = user.inbox.get_nowait()
+                else:
+                    event = await asyncio.wait_for(user.inbox.get(), max(0.0, deadline - time.perf_counter()))
+            except asyncio.QueueEmpty:
+                return True
+            except asyncio.TimeoutError:
+                return False
+            user.observe(event)
+            replies.append(event["time"])
+
+    first = start + updates[0]["t"] / args.speed
+    await asyncio.sleep(max(0.0, first - time.perf_counter()))
+    user_start = time.perf_counter()
+    previous = None
+    sent_at = None
+    for event in updates:
+        if previous is not None:
+            if not await collect(event.get("r", 0), time.perf_counter() + args.reply_timeout):
+                desynced = True
+            if replies:
+                timings.append((step_name(previous), replies[-1] - sent_at))
+            # The user's think time after the last answer, or the gap between
+            # two updates sent without waiting for one (e.g. a double tap)
+            think = event.get("g") if event.get("r") else event["t"] - previous["t"]
+            await asyncio.sleep(max(0.0, think or 0.0) / args.speed)
+            await collect(0, 0)
+        replies.clear()
+        send(user, event, photo_numbers)
+        sent_at = time.perf_counter()
+        previous = event
+
+    # The last update has no recorded answer count: take what arrives until the bot is quiet
+    while await collect(len(replies) + 1, time.perf_counter() + args.settle):
+        pass
+    if replies:
+        timings.append((step_name(previous), replies[-1] - sent_at))
+    results.append({
+        "scenario": "replay",
+        "outcome": "timeout" if desynced else ("error" if user.errors else "ok"),
+        "seconds": time.perf_counter() - user_start,
+        "timings": timings
+    })
+
+
+async def run_replay(args, events):
+    updates_by_user = defaultdict(list)
+    for event in events["update"]:
+        if event["k"] != "other":
+            updates_by_user[event["u"]].append(event)
+    if args.users:
+        updates_by_user = dict(list(updates_by_user.items())[:args.users])
+    photo_numbers = {}
+    for updates in updates_by_user.values():
+        for event in updates:
+            if "f" in event:
+                photo_numbers.setdefault(event["f"], len(photo_numbers))
+    photos = make_photos(max(1, len(photo_numbers)), seed=args.seed)
+    services = recorded_services(events, args)
+    recorded_seconds = max((event["t"] for event in events["update"]), default=0.0)
+
+    telegram = FakeTelegramAPI(
+        photos,
+        latency=services["telegram_latency"],
+        failure_rate=services["telegram_failure_rate"],
+        seed=args.seed
+    )
+    await telegram.start()
+
+    with FalStandIn(latency=services["fal_latency"], failure_rate=services["fal_failure_rate"], seed=args.seed) as fal:
+        bot = ContentCreatorBot(api_client=FalAPIClient(backend=fal))
+        application = bot.build_application(
+            token=TOKEN,
+            base_url=f"{telegram.base_url}/bot",
+            base_file_url=f"{telegram.base_url}/file/bot"
+        )
+        bot.warm_up()
+        rss_start = rss_mb()
+        stats = defaultdict(list)
+        stop = asyncio.Event()
+        results = []
+
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0.0, timeout=1)
+            monitor_task = asyncio.ensure_future(monitor(stats, stop))
+
+            print(
+                f"🔁 Replaying {len(updates_by_user)} users, {sum(map(len, updates_by_user.values()))} updates "
+                f"({recorded_seconds:.0f}s recorded) at {args.speed:g}×"
+            )
+            start = time.perf_counter()
+            rng = random.Random(args.seed)
+            tasks = [
+                asyncio.ensure_future(replay_user(
+                    SyntheticUser(FIRST_CHAT_ID + pseudonym, telegram, random.Random(rng.random()), 0.0, args.reply_timeout),
+                    updates, photo_numbers, start, args, results
+                ))
+                for pseudonym, updates in updates_by_user.items()
+            ]
+            await asyncio.gather(*tasks)
+            duration = time.perf_counter() - start
+
+            stop.set()
+            await monitor_task
+            sessions = len(bot.user_data)
+            await application.updater.stop()
+            await application.stop()
+
+        fal_calls = dict(fal.calls)
+    await telegram.stop()
+
+    report = summarize(args, results, stats, duration, {
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": max(stats["rss"], default=rss_start),
+        "rss_end_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb(),
+        "sessions": sessions,
+        "updates": telegram.updates_pushed,
+        "telegram_calls": dict(telegram.calls),
+        "telegram_failures": dict(telegram.failures),
+        "fal_calls": fal_calls,
+        "duplicates_avoided": {
+            key[0]: child.value for key, child in DUPLICATE_ACTIONS_AVOIDED_TOTAL._children.items()
+        }
+    })
+    report["replay"] = {
+        "recorded_seconds": recorded_seconds,
+        "speed": args.speed,
+        "fal_failure_rate": services["fal_failure_rate"],
+        "telegram_failure_rate": services["telegram_failure_rate"]
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="Recording written by the bot with RECORD_FILE (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay user arrival and think times this many times faster")
+    parser.add_argument("--users", type=int, default=0, help="Replay only the first N recorded users (0 replays all)")
+    parser.add_argument("--fal-latency", default="recorded", help="fal run time: 'recorded', or a distribution as in load_test.py")
+    parser.add_argument("--fal-failure-rate", default="recorded", help="'recorded' or a fraction of runs that fail")
+    parser.add_argument("--telegram-latency", default="recorded", help="Bot API call time: 'recorded', or a distribution")
+    parser.add_argument("--telegram-failure-rate", default="0", help="'recorded' or a fraction of Bot API calls that fail")
+    parser.add_argument("--reply-timeout", type=float, default=120.0, help="Longest a user waits for the recorded answers")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds without output after which a user's last update counts as answered")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="ERROR", help="Bot log level during the replay")
+    parser.add_argument("--save", help="Write the report to this JSON file")
+    parser.add_argument("--compare", help="Baseline report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    events = load_recording(args.recording)
+    if not events["update"]:
+        print(f"❌ No updates in {args.recording}")
+        return 1
+
+    log_listener = setup_logging(level=args.log_level, fmt="text")
+    try:
+        report = asyncio.run(run_replay(args, events))
+    finally:
+        log_listener.stop()
+    print_report(report)
+    replay = report["replay"]
+    print(
+        f"🔁 {replay['recorded_seconds']:.0f}s of recorded traffic replayed in {report['duration_s']:.0f}s at {replay['speed']:g}×; "
+        f"failure rates fal {replay['fal_failure_rate']:.1%}, Telegram {replay['telegram_failure_rate']:.1%}"
+    )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Report saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressions against the baseline:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            return 1
+        print("✅ No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Circuit breaking and adaptive concurrency for the fal workflows
+
+When fal degrades, waiting for every run to fail makes latency and resource
+use grow exactly when capacity is lowest. FalAPIClient guards each workflow
+with:
+
+- CircuitBreaker: opens once the error rate over the last calls passes a
+  threshold. While open, calls fail immediately with CircuitOpenError, so
+  users get an answer right away. After a cool-down, a few trial calls
+  (half-open) decide whether to close it again or stay open.
+- AdaptiveLimiter: caps the runs in flight with an AIMD limit. Every call
+  that succeeds within the latency target raises the limit by 1/limit, so
+  it grows by about one per round of calls. A failure or a slow call halves
+  it, at most once for the calls started before the previous decrease.
+  Calls above the limit wait their turn, and fail at once if the circuit
+  opens while they wait.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import FAL_CIRCUIT_STATE, FAL_CIRCUIT_TRANSITIONS_TOTAL, FAL_CONCURRENCY_LIMIT
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+# Value of the fal_circuit_state gauge per state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a workflow whose circuit is open"""
+
+    def __init__(self, workflow, retry_after):
+        super().__init__(f"Circuit for {workflow} is open, retry in {retry_after:.0f}s")
+        self.workflow = workflow
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, open_seconds=30.0, probes=1):
+        """
+        Args:
+            name (str): Workflow the breaker guards (metrics label)
+            failure_rate (float): Fraction of failed calls in the window that opens the circuit
+            window (int): Recent calls the failure rate is computed over
+            min_calls (int): Calls needed in the window before it can open
+            open_seconds (float): How long the circuit stays open before trial calls
+            probes (int): Trial calls allowed at once while half-open
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True for a failure
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        FAL_CIRCUIT_STATE.labels(workflow=name).set(STATE_VALUES[CLOSED])
+
+    def _transition(self, state):
+        if state == self.state:
+            return
+        logger.warning(
+            f"Circuit for {self.name}: {self.state} -> {state}",
+            extra={"event": "fal.circuit", "workflow": self.name, "state": state}
+        )
+        self.state = state
+        FAL_CIRCUIT_STATE.labels(workflow=self.name).set(STATE_VALUES[state])
+        FAL_CIRCUIT_TRANSITIONS_TOTAL.labels(workflow=self.name, state=state).inc()
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._outcomes.clear()
+
+    def retry_after(self):
+        """Seconds until the circuit lets a trial call through (0 unless open)"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def check(self):
+        """
+        Let a call through or refuse it
+        
+        Pair every check() that returns with a record() or cancel(), passing
+        back what it returned.
+        
+        Returns:
+            bool: True if the call is a trial call of the half-open circuit
+        
+        Raises:
+            CircuitOpenError: The circuit is open, or half-open with its trial calls in use
+        """
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                raise CircuitOpenError(self.name, self.retry_after())
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.probes:
+                raise CircuitOpenError(self.name, self.open_seconds)
+            self._probes_in_flight += 1
+            return True
+        return False
+    
+    def record(self, failed, probe=False):
+        """
+        Outcome of a call let through by check()
+        
+        Args:
+            failed (bool): The call failed
+            probe (bool): What check() returned for the call
+        """
+        if probe:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if self.state == HALF_OPEN:
+                self._transition(OPEN if failed else CLOSED)
+                return
+            if self.state == OPEN:
+                # Another trial call already failed
+                return
+        elif self.state != CLOSED:
+            # A call from before the circuit opened; only trial calls decide
+            return
+        self._outcomes.append(failed)
+        failures = sum(self._outcomes)
+        if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+            self._transition(OPEN)
+
+    def cancel(self, probe=False):
+        """A call let through by check() ended without an outcome (e.g. it was cancelled)"""
+        if probe:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, latency_target, minimum=1, maximum=64, backoff=0.5):
+        """
+        Args:
+            name (str): Workflow the limiter guards (metrics label)
+            latency_target (float): Calls slower than this count as congestion
+            minimum (int): Lowest limit
+            maximum (int): Highest limit, and the starting one
+            backoff (float): Factor the limit is multiplied by on congestion
+        """
+        self.name = name
+        self.latency_target = latency_target
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._waiters = deque()
+        self._last_decrease = float("-inf")
+        FAL_CONCURRENCY_LIMIT.labels(workflow=name).set_function(lambda: int(self.limit))
+
+    @property
+    def waiting(self):
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self):
+        """
+        Wait for a slot
+
+        Returns:
+            float: Monotonic time the slot was granted; pass it to release()
+        """
+        if self.in_flight < int(self.limit) and not self.waiting:
+            self.in_flight += 1
+            return time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as it was cancelled: hand the slot on
+                self.in_flight -= 1
+                self._wake()
+            raise
+        return time.monotonic()
+
+    def release(self, started, failed=False, latency=None):
+        """
+        Give a slot back and adjust the limit
+
+        Args:
+            started (float): Value returned by acquire()
+            failed (bool): The call failed
+            latency (float): How long the call took; None (e.g. a cancelled
+                call) leaves the limit unchanged
+        """
+        self.in_flight -= 1
+        if latency is not None:
+            if failed or latency > self.latency_target:
+                # One decrease per congestion event: calls started before the
+                # last decrease saw the old limit
+                if started > self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = time.monotonic()
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def fail_waiting(self, error):
+        """Make every call waiting for a slot raise error, e.g. when the circuit opens"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(error)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Fault injection check for the fal circuit breakers and concurrency limits
+
+Concurrent callers run text generations through FalAPIClient against the fal
+stand-in while its behaviour is changed between phases:
+
+- healthy: fast runs; the circuit stays closed and the limit stays high
+- slow: runs take longer than the latency target but still succeed; the
+  adaptive limit has to come down
+- outage: runs hang until the run timeout; the circuit has to open, after
+  which calls must fail within --fast-fail-ms instead of waiting
+- recovery: runs are fast again; after the cool-down a trial call has to
+  close the circuit, and the limit has to grow back
+
+While the circuit is open, the bot's text handler is called with a fake
+context to check that the user is told right away. The check fails if any of
+these doesn't happen.
+
+Examples:
+    python resilience_check.py
+    python resilience_check.py --callers 32 --phase-seconds 3
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+from api_client import FalAPIClient
+from async_logging import setup_logging
+from config import VISION_SPECIALIST_WORKFLOW
+from fal_standin import FalStandIn
+from metrics import FAL_CIRCUIT_TRANSITIONS_TOTAL
+from resilience import CLOSED, OPEN, AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from warmer import WorkflowWarmer
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+
+class FakeContext:
+    def __init__(self):
+        self.bot = FakeBot()
+
+
+async def caller(client, breaker, stop_at, samples):
+    """
+    Run generations back to back until stop_at, recording (outcome, seconds)
+    
+    A call refused by the circuit is a 'fast_fail' if the circuit was already
+    open when it started, and 'rejected' if it was waiting for a slot when
+    the circuit opened.
+    """
+    while time.monotonic() < stop_at:
+        start = time.monotonic()
+        open_at_start = breaker.retry_after() > 0
+        try:
+            result = await client.generate_text_content("https://example.com/product.jpg", "Product Description")
+            outcome = "ok" if result else "failed"
+        except CircuitOpenError:
+            outcome = "fast_fail" if open_at_start else "rejected"
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        samples.append((outcome, time.monotonic() - start))
+        if outcome in ("fast_fail", "rejected"):
+            # A user would not retry instantly
+            await asyncio.sleep(0.05)
+
+
+async def run_phase(client, args, name, seconds):
+    breaker, limiter = client.guards(VISION_SPECIALIST_WORKFLOW)
+    samples = []
+    limits = []
+    stop_at = time.monotonic() + seconds
+
+    async def watch():
+        while time.monotonic() < stop_at:
+            limits.append(limiter.limit)
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(watch(), *(caller(client, breaker, stop_at, samples) for _ in range(args.callers)))
+    outcomes = Counter(outcome for outcome, _ in samples)
+    fast_fails = [seconds for outcome, seconds in samples if outcome == "fast_fail"]
+    phase = {
+        "phase": name,
+        "calls": len(samples),
+        "outcomes": dict(outcomes),
+        "state": breaker.state,
+        "limit_min": min(limits) if limits else limiter.limit,
+        "limit_end": limiter.limit,
+        "fast_fail_ms_max": max(fast_fails) * 1000 if fast_fails else None,
+        "fast_fail_ms_median": statistics.median(fast_fails) * 1000 if fast_fails else None
+    }
+    print(
+        f"{name:9s} {phase['calls']:6d} {outcomes['ok']:5d} {outcomes['timeout'] + outcomes['failed']:7d} "
+        f"{outcomes['fast_fail'] + outcomes['rejected']:10d} {phase['limit_min']:7.1f} {phase['limit_end']:7.1f} {breaker.state:>10s}"
+    )
+    return phase
+
+
+async def check_bot_message(client):
+    """The bot's text handler answers at once while the circuit is open"""
+    from bot import ContentCreatorBot
+    bot = ContentCreatorBot(api_client=client)
+    context = FakeContext()
+    start = time.monotonic()
+    await bot.send_text_content(context, 1, "https://example.com/product.jpg", "Product Description", "check")
+    seconds = time.monotonic() - start
+    return seconds, context.bot.messages
+
+
+async def run(args):
+    with FalStandIn(latency=args.healthy_latency, seed=args.seed) as fal:
+        client = FalAPIClient(backend=fal, warmer=WorkflowWarmer(fal, enabled=False), run_timeout=args.run_timeout)
+        # Settings scaled down so the phases take seconds, not minutes
+        client.breakers[VISION_SPECIALIST_WORKFLOW] = CircuitBreaker(
+            VISION_SPECIALIST_WORKFLOW, failure_rate=0.5, window=10, min_calls=5, open_seconds=args.open_seconds
+        )
+        client.limiters[VISION_SPECIALIST_WORKFLOW] = AdaptiveLimiter(
+            VISION_SPECIALIST_WORKFLOW, latency_target=args.latency_target, minimum=2, maximum=args.callers
+        )
+        breaker = client.breakers[VISION_SPECIALIST_WORKFLOW]
+
+        print(f"{'phase':9s} {'calls':>6s} {'ok':>5s} {'failed':>7s} {'fast-fail':>10s} {'min lim':>7s} {'end lim':>7s} {'circuit':>10s}")
+        phases = [await run_phase(client, args, "healthy", args.phase_seconds)]
+
+        fal.latency = (args.latency_target * 1.5, args.latency_target * 2)
+        phases.append(await run_phase(client, args, "slow", args.phase_seconds))
+
+        fal.latency = args.run_timeout * 20
+        phases.append(await run_phase(client, args, "outage", args.phase_seconds * 2))
+        bot_seconds, bot_messages = (None, [])
+        if breaker.state == OPEN:
+            bot_seconds, bot_messages = await check_bot_message(client)
+
+        fal.latency = args.healthy_latency
+        # Wait out the cool-down so the recovery phase starts with a trial call
+        await asyncio.sleep(breaker.retry_after())
+        phases.append(await run_phase(client, args, "recovery", args.phase_seconds * 2))
+        await client.close()
+
+    healthy, slow, outage, recovery = phases
+    transitions = {state: child.value for (workflow, state), child in FAL_CIRCUIT_TRANSITIONS_TOTAL._children.items() if workflow == VISION_SPECIALIST_WORKFLOW}
+    checks = [
+        ("circuit stayed closed while healthy", healthy["state"] == CLOSED and not healthy["outcomes"].get("fast_fail")),
+        (
+            "limit came down under slow runs",
+            slow["limit_min"] <= args.callers / 2 and slow["state"] == CLOSED and not slow["outcomes"].get("fast_fail")
+        ),
+        ("circuit opened during the outage", transitions.get(OPEN, 0) >= 1 and outage["outcomes"].get("fast_fail", 0) > 0),
+        (
+            f"open circuit failed calls within {args.fast_fail_ms:.0f} ms",
+            outage["fast_fail_ms_max"] is not None and outage["fast_fail_ms_max"] < args.fast_fail_ms
+        ),
+        (
+            "bot told the user at once",
+            bot_seconds is not None and bot_seconds < args.fast_fail_ms / 1000 and any(message.startswith("⚠️") for message in bot_messages)
+        ),
+        ("circuit closed after recovery", recovery["state"] == CLOSED and transitions.get(CLOSED, 0) >= 1),
+        ("limit grew back after recovery", recovery["limit_end"] > slow["limit_min"])
+    ]
+    return phases, transitions, checks
+
+
+def parse_range(value):
+    low, _, high = value.partition("-")
+    return (float(low), float(high or low))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callers", type=int, default=16, help="Concurrent callers")
+    parser.add_argument("--phase-seconds", type=float, default=2.0, help="Length of each phase (outage and recovery run twice as long)")
+    parser.add_argument("--healthy-latency", type=parse_range, default=(0.02, 0.05), help="Run time range while healthy")
+    parser.add_argument("--latency-target", type=float, default=0.2, help="Latency target of the limiter")
+    parser.add_argument("--run-timeout", type=float, default=0.6, help="FAL_RUN_TIMEOUT_SECONDS")
+    parser.add_argument("--open-seconds", type=float, default=0.5, help="BREAKER_OPEN_SECONDS")
+    parser.add_argument("--fast-fail-ms", type=float, default=50.0, help="Longest a call may take while the circuit is open")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="CRITICAL", help="Log level during the run (timeouts are logged as errors)")
+    args = parser.parse_args()
+
+    log_listener = setup_logging(level=args.log_level, fmt="text")
+
+    print(f"🧪 Fault injection: {args.callers} callers, {args.phase_seconds}s phases")
+    print("=" * 72)
+    try:
+        phases, transitions, checks = asyncio.run(run(args))
+    finally:
+        log_listener.stop()
+    print("=" * 72)
+    outage = phases[2]
+    if outage["fast_fail_ms_median"] is not None:
+        print(
+            f"⏱️  Open circuit: calls failed in {outage['fast_fail_ms_median']:.2f} ms (median), "
+            f"{outage['fast_fail_ms_max']:.2f} ms (max) instead of {args.run_timeout * 1000:.0f} ms timeouts"
+        )
+    print(f"🔁 Transitions: {transitions}")
+    failed = [name for name, passed in checks if not passed]
+    for name, passed in checks:
+        print(f"{'✅' if passed else '❌'} {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Graceful shutdown check: SIGTERM under load loses no completions
+
+Runs the bot through run_polling() (the same path as production) against
+the fake Telegram Bot API from load_test.py and the fal stand-in. Synthetic
+users start paid jobs (product shots, texts, presets); partway through, the
+process sends itself SIGTERM. The bot drains its running jobs for
+--drain-seconds, saves the ones still running and stops. A fresh bot is then
+started in the same process, resumes the saved jobs, and is stopped with a
+second SIGTERM once every user is done.
+
+A completion is lost when a user saw their job start ("🔄 ...") but never
+got its result, before or after the restart. The check fails if any is lost
+or if jobs are left in the pending file.
+
+Examples:
+    python shutdown_check.py
+    python shutdown_check.py --users 60 --sigterm-after 4 --drain-seconds 0.5
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Jobs of many users must be in flight at once when the stop signal arrives
+os.environ.setdefault("CONCURRENT_UPDATES", "64")
+
+from telegram import Update
+
+from api_client import FalAPIClient
+from async_logging import setup_logging
+from bot import ContentCreatorBot
+from config import PRODUCT_SHOT_TYPES, TEXT_CONTENT_TYPES, PIPELINE_PRESETS
+from fal_standin import FalStandIn
+from load_test import TOKEN, FakeTelegramAPI, SyntheticUser, UserTimeout, make_photos, parse_latency, has_button, is_prompt
+from metrics import SHUTDOWN_JOBS_TOTAL, RESUMED_JOBS_TOTAL
+
+SCENARIOS = ("image", "text", "preset")
+
+
+def is_started(event):
+    return event["text"].startswith("🔄")
+
+
+def is_result(event):
+    return event["kind"] in ("photo", "document") or event["text"].startswith(("✅", "❌", "⚠️"))
+
+
+async def run_user(user, scenario, photo_index, start_timeout):
+    """
+    Start one paid job and wait for its result
+
+    Returns:
+        str: 'not_started' (a tap was refused during the shutdown, or its
+            button was stale after the restart), 'delivered', 'failed' (an
+            error was delivered) or 'lost'
+    """
+    timeout, user.timeout = user.timeout, start_timeout
+    try:
+        await user.step("upload_photo", lambda: user.send_photo(photo_index), has_button("product_image"))
+        if scenario == "image":
+            await user.step("open_menu", lambda: user.click("product_image"), has_button("shot_"))
+            user.click(f"shot_{user.rng.choice(list(PRODUCT_SHOT_TYPES))}")
+        elif scenario == "text":
+            await user.step("open_menu", lambda: user.click("text_content"), has_button("text_"))
+            await user.step("open_menu", lambda: user.click(f"text_{user.rng.choice(TEXT_CONTENT_TYPES)}"), is_prompt)
+            user.send_text("برای معرفی محصول در شبکه‌های اجتماعی")
+        else:
+            await user.step("open_menu", lambda: user.click("presets"), has_button("preset_"))
+            user.click(f"preset_{user.rng.choice(list(PIPELINE_PRESETS))}")
+        await user.expect(is_started)
+    except UserTimeout:
+        return "not_started"
+    
+    user.timeout = timeout
+    try:
+        event = await user.expect(is_result)
+    except UserTimeout:
+        return "lost"
+    return "failed" if event["text"].startswith(("❌", "⚠️")) else "delivered"
+
+
+async def run_users(args, telegram, photos, bot_running):
+    """Run every user, sending SIGTERM after --sigterm-after seconds and once all are done"""
+    while not bot_running():
+        await asyncio.sleep(0.05)
+    loop = asyncio.get_running_loop()
+    loop.call_later(args.sigterm_after, os.kill, os.getpid(), signal.SIGTERM)
+
+    rng = random.Random(args.seed)
+    tasks = []
+    start = time.perf_counter()
+    for i in range(args.users):
+        delay = start + args.ramp * i / max(1, args.users) - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user = SyntheticUser(20_000 + i, telegram, random.Random(rng.random()), parse_latency(args.think), args.user_timeout)
+        # A photo per user, so no near-duplicate reuse offers get in the way
+        tasks.append(asyncio.ensure_future(run_user(user, rng.choice(SCENARIOS), i % len(photos), args.start_timeout)))
+    outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Stop the restarted bot
+    while not bot_running():
+        await asyncio.sleep(0.05)
+    os.kill(os.getpid(), signal.SIGTERM)
+    return [outcome if isinstance(outcome, str) else f"exception: {outcome}" for outcome in outcomes]
+
+
+def counter_values(counter):
+    return {"/".join(key): child.value for key, child in counter._children.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=40, help="Synthetic users, each starting one paid job")
+    parser.add_argument("--ramp", type=float, default=3.0, help="Seconds over which users arrive")
+    parser.add_argument("--think", default="0.05-0.2", help="User think time between actions")
+    parser.add_argument("--sigterm-after", type=float, default=3.5, help="Seconds after polling starts to send SIGTERM")
+    parser.add_argument("--drain-seconds", type=float, default=1.0, help="Drain deadline (SHUTDOWN_DRAIN_SECONDS)")
+    parser.add_argument("--fal-latency", default="1.0-4.0", help="fal workflow run time (see load_test.py)")
+    parser.add_argument("--start-timeout", type=float, default=15.0, help="Longest a user waits for their job to start")
+    parser.add_argument("--user-timeout", type=float, default=60.0, help="Longest a user waits for a result")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING", help="Bot log level during the run")
+    args = parser.parse_args()
+
+    log_listener = setup_logging(level=args.log_level, fmt="text")
+    photos = make_photos(args.users, seed=args.seed)
+    pending_file = os.path.join(tempfile.mkdtemp(prefix="shutdown_check_"), "pending_jobs.json")
+
+    # The fake Telegram API and the users run on their own loop; the bot owns
+    # the main thread so it can install its signal handlers
+    stand_in_loop = asyncio.new_event_loop()
+    threading.Thread(target=stand_in_loop.run_forever, daemon=True).start()
+
+    async def start_telegram():
+        telegram = FakeTelegramAPI(photos, latency=parse_latency("0.005-0.02"), seed=args.seed)
+        await telegram.start()
+        return telegram
+
+    telegram = asyncio.run_coroutine_threadsafe(start_telegram(), stand_in_loop).result()
+    current = {}
+    users = asyncio.run_coroutine_threadsafe(
+        run_users(args, telegram, photos, lambda: current.get("application") is not None and current["application"].running),
+        stand_in_loop
+    )
+
+    phases = []
+    try:
+        with FalStandIn(latency=parse_latency(args.fal_latency), seed=args.seed) as fal:
+            for phase in ("before SIGTERM", "after restart"):
+                bot = ContentCreatorBot(api_client=FalAPIClient(backend=fal))
+                bot.jobs.path = pending_file
+                bot.jobs.drain_seconds = args.drain_seconds
+                application = bot.build_application(
+                    token=TOKEN,
+                    base_url=f"{telegram.base_url}/bot",
+                    base_file_url=f"{telegram.base_url}/file/bot"
+                )
+                current["application"] = application
+                start = time.perf_counter()
+                print(f"🚀 Polling ({phase})")
+                # Stop signals go to the bot's own handlers, as in ContentCreatorBot.run()
+                application.run_polling(
+                    allowed_updates=Update.ALL_TYPES, poll_interval=0.0, timeout=1, stop_signals=None, close_loop=False
+                )
+                saved = os.path.exists(pending_file)
+                phases.append((phase, time.perf_counter() - start, saved))
+                current["application"] = None
+                print(f"🛑 Stopped after {time.perf_counter() - start:.1f}s, jobs saved for the restart: {'yes' if saved else 'no'}")
+            fal_calls = dict(fal.calls)
+        outcomes = Counter(users.result(timeout=args.user_timeout))
+    finally:
+        asyncio.run_coroutine_threadsafe(telegram.stop(), stand_in_loop).result()
+        stand_in_loop.call_soon_threadsafe(stand_in_loop.stop)
+        log_listener.stop()
+
+    left_over = os.path.exists(pending_file)
+    print("=" * 72)
+    print(f"👥 Users: {dict(outcomes)}")
+    print(f"📦 Jobs at shutdown: {counter_values(SHUTDOWN_JOBS_TOTAL)}")
+    print(f"♻️  Jobs resumed: {counter_values(RESUMED_JOBS_TOTAL)}")
+    print(f"🤖 fal calls: {fal_calls}")
+    print("=" * 72)
+
+    lost = outcomes["lost"] + sum(count for outcome, count in outcomes.items() if outcome.startswith("exception"))
+    if lost or left_over:
+        print(f"❌ {lost} completions lost{', jobs left in the pending file' if left_over else ''}")
+        return 1
+    if not phases[0][2]:
+        print("⚠️  No job was still running at the deadline; raise --users or lower --drain-seconds to exercise resuming")
+    print("✅ Zero lost completions")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
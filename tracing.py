@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-update tracing with a local JSONL exporter
+
+Every incoming update opens a root span; FalAPIClient, WatermarkProcessor and
+the Telegram calls open child spans under it. The current span is tracked
+with contextvars, so spans follow the update across awaits and into tasks it
+starts. Finished spans of sampled traces are written as one JSON object per
+line using OTLP field names (traceId, spanId, parentSpanId, ...).
+
+Summarize a trace file:
+    python tracing.py summarize traces.jsonl --top 10
+"""
+
+import argparse
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Offset that turns time.perf_counter() readings into wall-clock time
+_PERF_TO_WALL = time.time() - time.perf_counter()
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    def __init__(self, tracer, name, trace_id, parent_id=None, attributes=None, start=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "ok"
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        self.events.append((time.perf_counter(), name, attributes))
+
+    def finish(self, end=None):
+        if self.end is None:
+            self.end = time.perf_counter() if end is None else end
+            self.tracer.exporter.export(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        self.finish()
+
+    def to_dict(self):
+        def nanos(perf):
+            return int((perf + _PERF_TO_WALL) * 1e9)
+
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": nanos(self.start),
+            "endTimeUnixNano": nanos(self.end),
+            "attributes": self.attributes,
+            "events": [
+                {"timeUnixNano": nanos(at), "name": name, "attributes": attributes}
+                for at, name, attributes in self.events
+            ],
+            "status": self.status
+        }
+
+
+class _NoopSpan:
+    """Stands in for spans of unsampled traces so callers never need to check"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonlExporter:
+    def __init__(self, path):
+        """
+        Write finished spans to a JSONL file from a background thread
+
+        Args:
+            path (str): File that spans are appended to
+        """
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        self._queue.put(span)
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    break
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                # Flush once the queue is drained rather than after every span
+                if self._queue.empty():
+                    f.flush()
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate=1.0):
+        """
+        Args:
+            exporter: Object with an export(span) method; None disables tracing
+            sample_rate (float): Fraction of root spans (updates) that are recorded
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start_trace(self, name, **attributes):
+        """Open a root span, or a no-op span if the trace isn't sampled"""
+        if self.exporter is None or random.random() >= self.sample_rate:
+            return NOOP_SPAN
+        return Span(self, name, _new_id(128), attributes=attributes)
+
+    def span(self, name, **attributes):
+        """Open a child span of the current span (no-op outside a sampled trace)"""
+        parent = _current_span.get()
+        if not isinstance(parent, Span):
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def record_span(self, name, start, end, **attributes):
+        """Record an already finished child span from perf_counter() timestamps"""
+        parent = _current_span.get()
+        if isinstance(parent, Span):
+            Span(self, name, parent.trace_id, parent.span_id, attributes, start=start).finish(end)
+
+
+# Disabled until configure() is called
+tracer = Tracer(None, 0.0)
+
+
+def configure(path, sample_rate):
+    """
+    Enable tracing to a JSONL file for the module tracer
+
+    Args:
+        path (str): Trace file; empty disables tracing
+        sample_rate (float): Fraction of updates that are traced
+    """
+    global tracer
+    if tracer.exporter is not None:
+        tracer.exporter.shutdown()
+    if not path or sample_rate <= 0:
+        tracer = Tracer(None, 0.0)
+    else:
+        tracer = Tracer(JsonlExporter(path), sample_rate)
+        logger.info(f"Tracing {sample_rate:.0%} of updates to {path}")
+    return tracer
+
+
+def span(name, **attributes):
+    """Open a child span of the current span on the module tracer"""
+    return tracer.span(name, **attributes)
+
+
+def record_span(name, start, end, **attributes):
+    """Record a finished child span on the module tracer"""
+    tracer.record_span(name, start, end, **attributes)
+
+
+def current_span():
+    """The span of the current context, or a no-op span"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def run_in_context(func, *args):
+    """Wrap a function for run_in_executor so its spans join the current trace"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func, *args)
+
+
+def trace_update(func):
+    """Decorator for ContentCreatorBot handlers: one root span per update"""
+    @functools.wraps(func)
+    async def wrapper(self, update, context):
+        user = update.effective_user
+        with tracer.start_trace(
+            func.__name__,
+            update_id=update.update_id,
+            user_id=user.id if user else None
+        ):
+            return await func(self, update, context)
+    return wrapper
+
+
+def load_traces(path):
+    """Group the spans of a JSONL trace file by trace id"""
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            traces[record["traceId"]].append(record)
+    return traces
+
+
+def _duration_ms(record):
+    return (record["endTimeUnixNano"] - record["startTimeUnixNano"]) / 1e6
+
+
+def critical_path(spans):
+    """
+    Find the chain of spans that bounded the trace duration
+
+    Starting from the root, the child that finished last is on the critical
+    path, then the child that finished last before it started, and so on;
+    each of those is expanded the same way.
+
+    Returns:
+        list: (depth, span record) pairs in start order
+    """
+    children = defaultdict(list)
+    ids = {record["spanId"] for record in spans}
+    roots = []
+    for record in spans:
+        if record["parentSpanId"] and record["parentSpanId"] in ids:
+            children[record["parentSpanId"]].append(record)
+        else:
+            roots.append(record)
+    if not roots:
+        return []
+
+    path = []
+
+    def walk(node, depth):
+        path.append((depth, node))
+        chain = []
+        cursor = node["endTimeUnixNano"]
+        for child in sorted(children[node["spanId"]], key=lambda record: -record["endTimeUnixNano"]):
+            if child["endTimeUnixNano"] <= cursor:
+                chain.append(child)
+                cursor = child["startTimeUnixNano"]
+        for child in reversed(chain):
+            walk(child, depth + 1)
+
+    walk(max(roots, key=_duration_ms), 0)
+    return path
+
+
+def summarize(path, top=10):
+    traces = load_traces(path)
+    if not traces:
+        print(f"No traces in {path}")
+        return
+
+    def trace_duration(spans):
+        start = min(record["startTimeUnixNano"] for record in spans)
+        end = max(record["endTimeUnixNano"] for record in spans)
+        return (end - start) / 1e6
+
+    # Time per span name across every trace shows where time usually goes
+    totals = defaultdict(list)
+    for spans in traces.values():
+        for record in spans:
+            totals[record["name"]].append(_duration_ms(record))
+
+    print(f"📊 {len(traces)} traces, {sum(len(spans) for spans in traces.values())} spans")
+    print("=" * 70)
+    print(f"{'span':34s} {'count':>7s} {'mean ms':>10s} {'max ms':>10s}")
+    for name, durations in sorted(totals.items(), key=lambda item: -sum(item[1])):
+        print(f"{name:34s} {len(durations):7d} {sum(durations) / len(durations):10.1f} {max(durations):10.1f}")
+
+    print("=" * 70)
+    print(f"🐢 Slowest {min(top, len(traces))} traces")
+    slowest = sorted(traces.items(), key=lambda item: -trace_duration(item[1]))[:top]
+    for trace_id, spans in slowest:
+        path_spans = critical_path(spans)
+        root = path_spans[0][1] if path_spans else spans[0]
+        user = root["attributes"].get("user_id")
+        print(f"\n{trace_duration(spans):10.1f} ms  {root['name']}  trace={trace_id[:16]}  user={user}")
+        for depth, record in path_spans:
+            attributes = {key: value for key, value in record["attributes"].items() if key not in ("user_id", "update_id")}
+            detail = f"  {attributes}" if attributes else ""
+            print(f"{'':12s}{'  ' * depth}└ {record['name']} {_duration_ms(record):.1f} ms{detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect trace files written by the bot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summarize_parser = subparsers.add_parser("summarize", help="Slowest traces and their critical paths")
+    summarize_parser.add_argument("path", nargs="?", default=os.getenv("TRACE_FILE", "traces.jsonl"))
+    summarize_parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "summarize":
+        summarize(args.path, args.top)
+
+
+if __name__ == "__main__":
+    main()
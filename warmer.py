@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Keeping fal workflows warm between bursts of traffic
+
+fal scales a workflow's workers down after a while without requests, and
+the next run pays for starting one again. WorkflowWarmer follows the runs
+FalAPIClient makes and, when enabled:
+
+- keeps each workflow that had real traffic in the last FAL_WARM_WINDOW_SECONDS
+  busy with a cheap keep-alive run whenever it has been idle for
+  FAL_WARM_INTERVAL_SECONDS, so a burst that pauses briefly doesn't go cold
+- pre-warms cold workflows when a user sends a photo, so the worker starts
+  while the user is still choosing what to generate
+
+Keep-alive runs are draft runs on a tiny image and are counted at their
+WORKFLOW_COSTS estimate; no more than FAL_WARM_MAX_COST_PER_HOUR is spent
+in any hour. Keep-alive runs are skipped while the workflow's circuit
+breaker is open, and give up after the same timeout as real runs. Whether or not warming is enabled, every real run is labelled
+cold or warm (idle longer than FAL_WARM_IDLE_SECONDS before it started) in
+fal_run_seconds, so the settings can be tuned from the latency difference.
+"""
+
+import asyncio
+import io
+import logging
+import time
+from collections import deque
+
+from config import (
+    CONTENT_CREATOR_WORKFLOW,
+    VISION_SPECIALIST_WORKFLOW,
+    WORKFLOW_COSTS,
+    DRAFT_RENDER,
+    FAL_WARMER,
+    FAL_WARM_IDLE_SECONDS,
+    FAL_WARM_INTERVAL_SECONDS,
+    FAL_WARM_WINDOW_SECONDS,
+    FAL_WARM_MAX_COST_PER_HOUR,
+    FAL_WARM_IMAGE_URL,
+    FAL_RUN_TIMEOUT_SECONDS
+)
+from metrics import FAL_RUN_SECONDS, FAL_WARM_REQUESTS_TOTAL, FAL_WARM_SPEND_USD
+
+logger = logging.getLogger(__name__)
+
+# Arguments of a keep-alive run, per workflow (the image URL is added)
+KEEP_ALIVE_ARGUMENTS = {
+    CONTENT_CREATOR_WORKFLOW: {"prompt": "keep-alive", **DRAFT_RENDER},
+    VISION_SPECIALIST_WORKFLOW: {"prompt": "Reply with OK"}
+}
+
+
+class WorkflowWarmer:
+    def __init__(
+        self,
+        backend,
+        enabled=FAL_WARMER,
+        idle_seconds=FAL_WARM_IDLE_SECONDS,
+        interval=FAL_WARM_INTERVAL_SECONDS,
+        window=FAL_WARM_WINDOW_SECONDS,
+        max_cost_per_hour=FAL_WARM_MAX_COST_PER_HOUR,
+        image_url=FAL_WARM_IMAGE_URL,
+        run_timeout=FAL_RUN_TIMEOUT_SECONDS
+    ):
+        """
+        Args:
+            backend: fal_client or a stand-in, used for keep-alive runs
+            enabled (bool): Send keep-alive and pre-warm runs (cold/warm
+                latency is recorded either way)
+            idle_seconds (float): Idle time after which a workflow is taken to be cold
+            interval (float): Idle time after which a keep-alive run is sent
+                (keep it below idle_seconds)
+            window (float): Keep warming this long after the last real run
+            max_cost_per_hour (float): Keep-alive spend ceiling, USD per rolling hour
+            image_url (str): Image for keep-alive runs; a tiny generated image
+                is uploaded when empty
+            run_timeout (float): Seconds after which a keep-alive run is abandoned
+        """
+        self.backend = backend
+        self.enabled = enabled
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.window = window
+        self.max_cost_per_hour = max_cost_per_hour
+        self.image_url = image_url or None
+        self.run_timeout = run_timeout
+        # workflow -> CircuitBreaker, shared by FalAPIClient; no keep-alive runs while one is open
+        self.breakers = {}
+        self._last_active = {}  # workflow -> monotonic time the last run ended (or started)
+        self._last_real = {}  # workflow -> monotonic time of the last real run
+        self._running = {}  # workflow -> runs in progress, real or keep-alive
+        self._starting = set()  # workflows whose worker is starting (no run has finished since they were cold)
+        self._warming = {}  # workflow -> keep-alive task
+        self._spend = deque()  # (monotonic time, cost) of keep-alive runs
+        self._task = None
+
+        FAL_WARM_SPEND_USD.set_function(self.spent_last_hour)
+
+    def is_cold(self, workflow, now=None):
+        """True if the workflow has no run in progress and has been idle longer than idle_seconds"""
+        if self._running.get(workflow):
+            return False
+        last = self._last_active.get(workflow)
+        now = time.monotonic() if now is None else now
+        return last is None or now - last > self.idle_seconds
+
+    def run_started(self, workflow, real=True):
+        """
+        Note that a run is starting
+
+        Returns:
+            str: 'cold' or 'warm', the state the run is expected to find the
+                workflow in; runs that arrive while a cold workflow starts
+                are cold too
+        """
+        now = time.monotonic()
+        if self.is_cold(workflow, now):
+            self._starting.add(workflow)
+        state = "cold" if workflow in self._starting else "warm"
+        self._running[workflow] = self._running.get(workflow, 0) + 1
+        self._last_active[workflow] = now
+        if real:
+            self._last_real[workflow] = now
+            self._ensure_loop()
+        return state
+
+    def run_finished(self, workflow, state, seconds, real=True):
+        """Note that a run has ended and record its latency by state"""
+        self._running[workflow] -= 1
+        self._last_active[workflow] = time.monotonic()
+        self._starting.discard(workflow)
+        if real:
+            FAL_RUN_SECONDS.labels(workflow=workflow, state=state).observe(seconds)
+
+    def spent_last_hour(self):
+        """Keep-alive spend over the last hour, USD (also read by the metrics thread)"""
+        cutoff = time.monotonic() - 3600
+        return sum(cost for started, cost in list(self._spend) if started >= cutoff)
+
+    def prewarm(self, workflows=None):
+        """
+        Start keep-alive runs for the cold workflows, e.g. when a user sends a photo
+
+        Args:
+            workflows (iterable): Workflows the user may run next (default: all)
+        """
+        if not self.enabled:
+            return
+        for workflow in workflows or KEEP_ALIVE_ARGUMENTS:
+            if self.is_cold(workflow):
+                self._warm(workflow, "prewarm")
+
+    def _warm(self, workflow, reason):
+        """Start one keep-alive run unless one is already running, the circuit is open or the budget is spent"""
+        if workflow in self._warming:
+            return
+        breaker = self.breakers.get(workflow)
+        if breaker is not None and breaker.retry_after() > 0:
+            # Don't keep a failing workflow busy; real runs are refused too
+            FAL_WARM_REQUESTS_TOTAL.labels(workflow=workflow, reason=reason, outcome="circuit_open").inc()
+            return
+        cost = WORKFLOW_COSTS.get(workflow, 0.0)
+        cutoff = time.monotonic() - 3600
+        while self._spend and self._spend[0][0] < cutoff:
+            self._spend.popleft()
+        if self.spent_last_hour() + cost > self.max_cost_per_hour:
+            FAL_WARM_REQUESTS_TOTAL.labels(workflow=workflow, reason=reason, outcome="over_budget").inc()
+            return
+        self._spend.append((time.monotonic(), cost))
+        task = self._warming[workflow] = asyncio.ensure_future(self._keep_alive(workflow, reason))
+        task.add_done_callback(lambda _: self._warming.pop(workflow, None))
+
+    async def _keep_alive(self, workflow, reason):
+        outcome = "error"
+        state = self.run_started(workflow, real=False)
+        start = time.perf_counter()
+
+        async def consume():
+            nonlocal outcome
+            arguments = dict(KEEP_ALIVE_ARGUMENTS.get(workflow, {}), image_url=await self._image())
+            async for event in self.backend.stream_async(workflow, arguments=arguments):
+                if event.get("type") == "output":
+                    outcome = "ok"
+                    break
+                if event.get("type") == "error":
+                    break
+
+        try:
+            # A hung stream would otherwise block keep-alive runs of the workflow for good
+            await asyncio.wait_for(consume(), self.run_timeout)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            logger.warning(f"Keep-alive run of {workflow} timed out after {self.run_timeout:.0f}s")
+        except Exception as e:
+            logger.warning(f"Keep-alive run of {workflow} failed: {e}")
+        finally:
+            self.run_finished(workflow, state, time.perf_counter() - start, real=False)
+            FAL_WARM_REQUESTS_TOTAL.labels(workflow=workflow, reason=reason, outcome=outcome).inc()
+            logger.debug(
+                f"Keep-alive run of {workflow} ({reason}, {state}) took {time.perf_counter() - start:.1f}s",
+                extra={"event": "fal.keep_alive", "workflow": workflow, "reason": reason, "state": state, "outcome": outcome}
+            )
+
+    async def _image(self):
+        """URL of the keep-alive image, uploaded once"""
+        if self.image_url is None:
+            from PIL import Image
+            buffer = io.BytesIO()
+            Image.new("RGB", (64, 64), (255, 255, 255)).save(buffer, format="JPEG")
+            self.image_url = await self.backend.upload_async(buffer.getvalue(), "image/jpeg", "keep_alive.jpg")
+        return self.image_url
+
+    def _ensure_loop(self):
+        """Start the keep-alive loop on the event loop of the first real run"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def _loop(self):
+        # Check often enough to catch every workflow before it goes cold
+        period = max(0.05, min(30.0, self.interval / 4))
+        while True:
+            await asyncio.sleep(period)
+            now = time.monotonic()
+            for workflow, last_real in list(self._last_real.items()):
+                if now - last_real > self.window or self._running.get(workflow):
+                    # Traffic stopped: let it go cold
+                    continue
+                if now - self._last_active.get(workflow, 0) >= self.interval:
+                    self._warm(workflow, "keepalive")
+
+    async def close(self):
+        """Stop the keep-alive loop and any keep-alive runs"""
+        tasks = [task for task in [self._task, *self._warming.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
@@ -4,24 +4,52 @@ Watermark module for adding business logo to images
 """
 
 import os
-import requests
 import io
+import time
 from PIL import Image, ImageEnhance
 import logging
 
+import animation
+import blending
+import buffers
+from config import WATERMARK_BACKEND, WATERMARK_TILE_OPACITY, WATERMARK_TILE_ANGLE, ANIMATED_WATERMARK_QUALITY
+from encoder import ImageEncoder
+from logo_registry import LogoPyramid
+from metrics import IMAGE_DOWNLOAD_SECONDS, WATERMARK_SECONDS, ERRORS_TOTAL, JOBS_IN_FLIGHT
+from tracing import record_span
+
 logger = logging.getLogger(__name__)
 
+# Position that repeats the logo across the whole image
+TILED = "tiled"
+
+# Size of each tiled logo relative to the image (single logos use 0.3)
+TILE_RATIO = 0.15
+
 class WatermarkProcessor:
-    def __init__(self, logo_path="logo.png"):
+    def __init__(self, logo_path="logo.png", backend=WATERMARK_BACKEND, encoder=None, registry=None):
         """
         Initialize watermark processor with business logo
         
         Args:
             logo_path (str): Path to the business logo file
+            backend (str): Compositing backend, 'pillow' or 'numpy' (falls back
+                to 'pillow' if NumPy isn't installed)
+            encoder (ImageEncoder): Output encoder; defaults to the OUTPUT_* settings
+            registry (LogoRegistry): Per-tenant logos; tenants without one
+                (and every tenant, without a registry) get the default logo
         """
         self.logo_path = logo_path
+        self.encoder = encoder or ImageEncoder.from_config()
+        self.registry = registry
         self.logo = None
+        self.pyramid = None
         self.load_logo()
+        
+        if backend == "numpy" and not blending.AVAILABLE:
+            logger.warning("NumPy is not installed, using the Pillow watermark backend")
+            backend = "pillow"
+        self.backend = backend
     
     def load_logo(self):
         """Load and prepare the business logo"""
@@ -34,6 +62,9 @@ class WatermarkProcessor:
                 if self.logo.mode != 'RGBA':
                     self.logo = self.logo.convert("RGBA")
                 
+                # Same resize path and caches as tenant logos
+                self.pyramid = LogoPyramid(self.logo)
+                
                 logger.info(f"Logo loaded successfully: {self.logo_path} (mode: {self.logo.mode})")
             else:
                 logger.error(f"Logo file not found: {self.logo_path}")
@@ -42,55 +73,121 @@ class WatermarkProcessor:
             logger.error(f"Error loading logo: {e}")
             self.logo = None
     
+    def logo_for(self, tenant=None):
+        """
+        Logo to watermark with for a tenant
+        
+        Args:
+            tenant: Tenant id (e.g. a Telegram user id), or None for the default logo
+            
+        Returns:
+            LogoPyramid: The tenant's logo, the default logo, or None if neither is available
+        """
+        if tenant is not None and self.registry is not None:
+            pyramid = self.registry.get(tenant)
+            if pyramid is not None:
+                return pyramid
+        return self.pyramid
+    
+    def open_image(self, image_url):
+        """
+        Open an image from URL, local file or bytes without decoding it
+        
+        Animations stay multi-frame, so their frames can be decoded one at a time.
+        
+        Args:
+            image_url (str, bytes or file-like): URL of the image to download, local
+                file path, or the encoded image itself (e.g. a buffers.SpooledBuffer)
+        
+        Returns:
+            tuple: (PIL.Image, buffers.SpooledBuffer or None) - the lazily opened
+                image, and the buffer a URL was downloaded into; close both
+                when done with the image
+        """
+        start = time.perf_counter()
+        buffer = None
+        # Image already in memory (e.g. passed between pipeline stages)
+        if isinstance(image_url, (bytes, bytearray)):
+            source = "memory"
+            image = Image.open(io.BytesIO(image_url))
+        elif hasattr(image_url, "read"):
+            source = "memory"
+            image_url.seek(0)
+            image = Image.open(image_url)
+        # Check if it's a local file
+        elif image_url.startswith('file://'):
+            source = "file"
+            file_path = image_url[7:]  # Remove 'file://' prefix
+            image = Image.open(file_path)
+        elif os.path.exists(image_url):
+            # Direct file path
+            source = "file"
+            image = Image.open(image_url)
+        else:
+            # Download from URL, streamed (large images spill to a temporary file)
+            source = "url"
+            buffer = buffers.fetch(image_url)
+            try:
+                image = Image.open(buffer)
+            except Exception:
+                buffer.close()
+                raise
+        end = time.perf_counter()
+        IMAGE_DOWNLOAD_SECONDS.labels(source=source).observe(end - start)
+        record_span("image.download", start, end, source=source)
+        return image, buffer
+    
     def download_image(self, image_url):
         """
         Download image from URL or load from local file
         
         Args:
-            image_url (str): URL of the image to download or local file path
-            
+            image_url (str, bytes or file-like): URL of the image to download, local
+                file path, or the encoded image itself
+        
         Returns:
-            PIL.Image: Downloaded image or None if failed
+            PIL.Image: Downloaded image (first frame of an animation) or None if failed
         """
+        source = buffer = image = None
         try:
-            # Check if it's a local file
-            if image_url.startswith('file://'):
-                file_path = image_url[7:]  # Remove 'file://' prefix
-                image = Image.open(file_path)
-            elif os.path.exists(image_url):
-                # Direct file path
-                image = Image.open(image_url)
-            else:
-                # Download from URL
-                response = requests.get(image_url, timeout=30)
-                response.raise_for_status()
-                
-                image_data = io.BytesIO(response.content)
-                image = Image.open(image_data)
-            
-            # Convert to RGB for better compatibility
-            if image.mode in ('RGBA', 'LA', 'P'):
-                # Create white background for transparent images
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                if image.mode == 'P':
-                    image = image.convert('RGBA')
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            elif image.mode != 'RGB':
-                image = image.convert('RGB')
-            
+            source, buffer = self.open_image(image_url)
+            image = self.flatten(source)
+            # Decode now: the download is closed below
+            image.load()
             return image
         except Exception as e:
             logger.error(f"Error loading image: {e}")
+            ERRORS_TOTAL.labels(stage="image_download").inc()
             return None
+        finally:
+            if source is not None and source is not image:
+                source.close()
+            if buffer is not None:
+                buffer.close()
+    
+    def flatten(self, image):
+        """RGB copy of an image, with transparency over a white background"""
+        # Convert to RGB for better compatibility
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Create white background for transparent images
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            if image.mode == 'P':
+                image = image.convert('RGBA')
+            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        return image
     
-    def calculate_watermark_size(self, base_image, watermark_ratio=0.3):
+    def calculate_watermark_size(self, base_image, watermark_ratio=0.3, logo=None):
         """
         Calculate appropriate watermark size based on base image
         
         Args:
             base_image (PIL.Image): Base image to watermark
             watermark_ratio (float): Ratio of watermark size to image size
+            logo (LogoPyramid): Logo to size; defaults to the default logo
             
         Returns:
             tuple: (width, height) for watermark
@@ -102,7 +199,7 @@ class WatermarkProcessor:
         watermark_size = int(min_dimension * watermark_ratio)
         
         # Maintain aspect ratio
-        logo_width, logo_height = self.logo.size
+        logo_width, logo_height = (logo or self.pyramid).size
         aspect_ratio = logo_width / logo_height
         
         if aspect_ratio > 1:  # Logo is wider than tall
@@ -114,93 +211,288 @@ class WatermarkProcessor:
         
         return (watermark_width, watermark_height)
     
-    def add_watermark(self, image_url, position="bottom-right", opacity=1.0):
+    def add_watermark(self, image_url, position="bottom-right", opacity=1.0, tenant=None):
         """
         Add watermark to image from URL
         
         Args:
-            image_url (str): URL of the image to watermark
-            position (str): Position of watermark ('bottom-right', 'bottom-left', 'top-right', 'top-left', 'center')
+            image_url (str, bytes or file-like): URL, local path or encoded image to watermark
+            position (str): Position of watermark ('bottom-right', 'bottom-left', 'top-right', 'top-left', 'center',
+                or 'tiled' to repeat it diagonally across the image)
             opacity (float): Opacity of watermark (0.0 to 1.0)
+            tenant: Whose logo to use (see logo_for)
             
         Returns:
-            bytes: Watermarked image as bytes or None if failed
+            bytes or buffers.SpooledBuffer: Watermarked image (animations come as a
+                buffer, spilled to a temporary file when large), or None if failed
         """
-        if self.logo is None:
+        logo = self.logo_for(tenant)
+        if logo is None:
             logger.error("Logo not loaded, cannot add watermark")
             return None
         
+        in_flight = JOBS_IN_FLIGHT.labels(kind="watermark")
+        in_flight.inc()
+        source = buffer = None
         try:
             # Download the image
-            base_image = self.download_image(image_url)
-            if base_image is None:
+            try:
+                source, buffer = self.open_image(image_url)
+            except Exception as e:
+                logger.error(f"Error loading image: {e}")
+                ERRORS_TOTAL.labels(stage="image_download").inc()
                 return None
+            if animation.is_animated(source):
+                return self.add_watermark_animated(source, position, opacity, logo=logo)
+            base_image = self.flatten(source)
             
-            # Resize logo to appropriate size
-            watermark_size = self.calculate_watermark_size(base_image)
-            watermark = self.logo.resize(watermark_size, Image.Resampling.LANCZOS)
-            
-            # Apply opacity while preserving colors
-            if opacity < 1.0:
-                # Create a new alpha channel with the desired opacity
-                alpha = watermark.split()[-1]  # Get the alpha channel
-                alpha = alpha.point(lambda x: int(x * opacity))
-                watermark.putalpha(alpha)
+            compose_start = time.perf_counter()
             
-            # Ensure watermark is in RGBA mode
-            if watermark.mode != 'RGBA':
-                watermark = watermark.convert('RGBA')
-            
-            # Calculate position
-            base_width, base_height = base_image.size
-            watermark_width, watermark_height = watermark.size
-            
-            if position == "bottom-right":
-                x = base_width - watermark_width - 20
-                y = base_height - watermark_height - 20
-            elif position == "bottom-left":
-                x = 20
-                y = base_height - watermark_height - 20
-            elif position == "top-right":
-                x = base_width - watermark_width - 20
-                y = 20
-            elif position == "top-left":
-                x = 20
-                y = 20
-            elif position == "center":
-                x = (base_width - watermark_width) // 2
-                y = base_height - watermark_height - 30
+            if self.backend == "numpy":
+                result_image = self.compose_numpy(base_image, position, opacity, logo=logo)
             else:
-                # Default to bottom-right
-                x = base_width - watermark_width - 20
-                y = base_height - watermark_height - 20
-            
-            # Create a copy of the base image
-            result_image = base_image.copy()
+                result_image = self.compose_pillow(base_image, position, opacity, logo=logo)
             
-            # Convert base image to RGBA for watermarking
-            if result_image.mode != 'RGBA':
-                result_image = result_image.convert('RGBA')
+            encode_start = time.perf_counter()
+            WATERMARK_SECONDS.labels(stage="compose").observe(encode_start - compose_start)
+            record_span("watermark.compose", compose_start, encode_start, position=position)
             
-            # Paste watermark
-            result_image.paste(watermark, (x, y), watermark)
-            
-            # Convert back to RGB for JPEG compatibility
-            background = Image.new('RGB', result_image.size, (255, 255, 255))
-            background.paste(result_image, mask=result_image.split()[-1])  # Use alpha channel as mask
-            result_image = background
-            
-            # Save to bytes
-            output_buffer = io.BytesIO()
-            result_image.save(output_buffer, format='JPEG', quality=95)
-            output_buffer.seek(0)
+            # Save to bytes, within the output byte budget
+            encoded = self.encoder.encode(result_image)
+            encode_end = time.perf_counter()
+            WATERMARK_SECONDS.labels(stage="encode").observe(encode_end - encode_start)
+            record_span("watermark.encode", encode_start, encode_end, bytes=encoded.bytes, quality=encoded.quality)
             
             logger.info(f"Watermark added successfully to image")
-            return output_buffer.getvalue()
+            return encoded.data
             
         except Exception as e:
             logger.error(f"Error adding watermark: {e}")
+            ERRORS_TOTAL.labels(stage="watermark").inc()
             return None
+        finally:
+            if source is not None:
+                source.close()
+            if buffer is not None:
+                buffer.close()
+            in_flight.dec()
+    
+    def watermark_frames(self, frames, position, opacity=1.0, logo=None):
+        """
+        Composite the logo onto frames as they are decoded
+        
+        The logo is sized and placed once, from the first frame, and the same
+        cached copy goes onto every frame.
+        
+        Args:
+            frames (iterable): (RGBA frame, duration in ms) pairs, e.g. from animation.iter_frames
+            position (str): Position name
+            opacity (float): Opacity of watermark (0.0 to 1.0)
+            logo (LogoPyramid): Logo to use; defaults to the default logo
+        
+        Yields:
+            tuple: (watermarked RGBA frame, duration in ms)
+        """
+        logo = logo or self.pyramid
+        watermark = corner = None
+        for frame, duration in frames:
+            if watermark is None and position == TILED:
+                watermark, corner = self.tiled_overlay(frame, opacity, logo=logo), (0, 0)
+            elif watermark is None:
+                watermark = logo.resized(self.calculate_watermark_size(frame, logo=logo), opacity)
+                corner = self.calculate_position(frame.size, watermark.size, position)
+            # Transparent frame pixels stay transparent outside the logo
+            frame.alpha_composite(watermark, corner)
+            yield frame, duration
+    
+    def add_watermark_animated(self, source, position="bottom-right", opacity=1.0, logo=None):
+        """
+        Watermark an animated GIF or WebP frame by frame (see watermark_animation)
+        
+        Returns:
+            buffers.SpooledBuffer: Watermarked animation
+        """
+        output = buffers.SpooledBuffer(name=f"watermarked{animation.FORMATS[source.format]}")
+        self.watermark_animation(source, output, position, opacity, logo=logo)
+        output.seek(0)
+        return output
+    
+    def watermark_animation(self, source, output, position="bottom-right", opacity=1.0, logo=None):
+        """
+        Watermark an animated GIF or WebP into a file, frame by frame
+        
+        Frames are decoded, watermarked and encoded one at a time, so memory
+        use doesn't grow with the number of frames. The output keeps the
+        source format, frame durations and loop count (a GIF without one
+        still plays once); the output byte budget doesn't apply. Streamed
+        GIFs are larger and slower to encode than Pillow's all-frames
+        writer makes them (see animation.py).
+        
+        Args:
+            source (PIL.Image): Animation opened with open_image (left open)
+            output: Seekable binary file-like object the animation is written to
+            position (str): Position name
+            opacity (float): Opacity of watermark (0.0 to 1.0)
+            logo (LogoPyramid): Logo to use; defaults to the default logo
+        
+        Returns:
+            int: Frames written
+        """
+        start = time.perf_counter()
+        frames = self.watermark_frames(animation.iter_frames(source), position, opacity, logo=logo)
+        count = animation.write_frames(
+            frames, source.format, output, source.size,
+            loop=source.info.get("loop"), quality=ANIMATED_WATERMARK_QUALITY
+        )
+        end = time.perf_counter()
+        # Decoding, compositing and encoding are interleaved, so the whole run counts as compose
+        WATERMARK_SECONDS.labels(stage="compose").observe(end - start)
+        record_span("watermark.animated", start, end, position=position, frames=count, format=source.format)
+        logger.info(f"Watermark added to {count} frames of an animated {source.format}")
+        return count
+    
+    def calculate_position(self, base_size, watermark_size, position):
+        """
+        Top-left corner of the watermark for a position name
+        
+        Args:
+            base_size (tuple): (width, height) of the image
+            watermark_size (tuple): (width, height) of the resized logo
+            position (str): One of get_watermark_positions(); unknown values
+                fall back to bottom-right
+            
+        Returns:
+            tuple: (x, y)
+        """
+        base_width, base_height = base_size
+        watermark_width, watermark_height = watermark_size
+        
+        if position == "bottom-left":
+            return (20, base_height - watermark_height - 20)
+        elif position == "top-right":
+            return (base_width - watermark_width - 20, 20)
+        elif position == "top-left":
+            return (20, 20)
+        elif position == "center":
+            return ((base_width - watermark_width) // 2, base_height - watermark_height - 30)
+        # bottom-right and default
+        return (base_width - watermark_width - 20, base_height - watermark_height - 20)
+    
+    def compose_pillow(self, base_image, position, opacity=1.0, logo=None):
+        """
+        Composite the logo with Pillow
+        
+        Args:
+            logo (LogoPyramid): Logo to use; defaults to the default logo
+        
+        Returns:
+            PIL.Image: RGB image with the watermark
+        """
+        logo = logo or self.pyramid
+        if position == TILED:
+            return self.compose_tiled(base_image, opacity, logo=logo)
+        
+        # Resized logo with the opacity applied (cached per size and opacity)
+        watermark_size = self.calculate_watermark_size(base_image, logo=logo)
+        watermark = logo.resized(watermark_size, opacity)
+        
+        # Calculate position
+        x, y = self.calculate_position(base_image.size, watermark.size, position)
+        
+        # Create a copy of the base image
+        result_image = base_image.copy()
+        
+        # Convert base image to RGBA for watermarking
+        if result_image.mode != 'RGBA':
+            result_image = result_image.convert('RGBA')
+        
+        # Paste watermark
+        result_image.paste(watermark, (x, y), watermark)
+        
+        # Convert back to RGB for JPEG compatibility
+        background = Image.new('RGB', result_image.size, (255, 255, 255))
+        background.paste(result_image, mask=result_image.split()[-1])  # Use alpha channel as mask
+        return background
+    
+    def tiled_overlay(self, base_image, opacity=1.0, logo=None):
+        """
+        Full-size RGBA layer with the logo repeated diagonally
+        
+        The rotated tile comes from the logo's cache. It is laid out with a
+        handful of pastes that double the covered area each time, not one
+        paste per logo.
+        
+        Args:
+            base_image (PIL.Image): Image the layer is for (only its size is used)
+            opacity (float): Opacity of watermark (0.0 to 1.0), scaled by WATERMARK_TILE_OPACITY
+            logo (LogoPyramid): Logo to use; defaults to the default logo
+        
+        Returns:
+            PIL.Image: RGBA image the size of base_image
+        """
+        logo = logo or self.pyramid
+        logo_size = self.calculate_watermark_size(base_image, TILE_RATIO, logo=logo)
+        tile = logo.tile(logo_size, opacity * WATERMARK_TILE_OPACITY, WATERMARK_TILE_ANGLE)
+        
+        width, height = base_image.size
+        overlay = Image.new("RGBA", base_image.size)
+        overlay.paste(tile, (0, 0))
+        filled_width, filled_height = tile.size
+        while filled_width < width:
+            overlay.paste(overlay.crop((0, 0, filled_width, tile.height)), (filled_width, 0))
+            filled_width *= 2
+        while filled_height < height:
+            overlay.paste(overlay.crop((0, 0, width, filled_height)), (0, filled_height))
+            filled_height *= 2
+        return overlay
+    
+    def compose_tiled(self, base_image, opacity=1.0, logo=None):
+        """
+        Repeat the logo diagonally across the image in one full-frame blend
+        
+        Returns:
+            PIL.Image: RGB image with the watermark
+        """
+        overlay = self.tiled_overlay(base_image, opacity, logo=logo)
+        result_image = base_image.convert("RGB")
+        result_image.paste(overlay, (0, 0), overlay)
+        return result_image
+    
+    def premultiplied_logo(self, watermark_size, opacity=1.0, logo=None):
+        """Resized, premultiplied logo for the NumPy backend (cached)"""
+        return (logo or self.pyramid).premultiplied(watermark_size, opacity)
+    
+    def compose_numpy(self, base_image, position, opacity=1.0, positions=None, logo=None):
+        """
+        Composite the logo with the vectorized NumPy backend
+        
+        Args:
+            base_image (PIL.Image): RGB image
+            position (str): Position name
+            opacity (float): Opacity of watermark (0.0 to 1.0)
+            positions (list): Extra position names blended in the same pass
+            logo (LogoPyramid): Logo to use; defaults to the default logo
+            
+        Returns:
+            PIL.Image: RGB image with the watermark
+        """
+        logo = logo or self.pyramid
+        names = [position] + list(positions or [])
+        if TILED in names:
+            # Already a single full-frame blend in Pillow
+            base_image = self.compose_tiled(base_image, opacity, logo=logo)
+            names = [name for name in names if name != TILED]
+            if not names:
+                return base_image
+        logo = logo.premultiplied(self.calculate_watermark_size(base_image, logo=logo), opacity)
+        corners = [
+            self.calculate_position(base_image.size, logo.size, name)
+            for name in names
+        ]
+        # np.array copies, so the caller's image is left untouched
+        array = blending.load_numpy().array(base_image.convert("RGB"))
+        blending.blend(array, logo, corners)
+        return Image.fromarray(array)
     
     def get_watermark_positions(self):
         """Get available watermark positions"""
@@ -209,5 +501,6 @@ class WatermarkProcessor:
             "bottom-left", 
             "top-right",
             "top-left",
-            "center"
+            "center",
+            TILED
         ] 
\ No newline at end of file